@@ -1,25 +1,50 @@
 import os
+import io
+import asyncio
 import logging
 from datetime import datetime
+from typing import List
 from dotenv import load_dotenv
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters, ConversationHandler
-from functools import wraps
-from sheets_handler import GoogleSheetsHandler
 
+# Модули ниже читают настройки из окружения при импорте
 load_dotenv()
 
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
+from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, TypeHandler, ContextTypes, filters, ConversationHandler
+from functools import wraps
+from lead_index import normalize_phone
+from lead_form import LEAD_TEMPLATE, MIN_AGE, MAX_AGE, MIN_GRADE, MAX_GRADE, parse_lead_form
+from program_info import PROGRAM_INFO
+from promo_media import send_promo_media
+from throttle import rate_limited, telegram_quota
+from segments import PRESETS, SegmentError
+from broadcast import BroadcastPost, ALBUM_WAIT
+from chat_registry import is_dead_chat_error, FLUSH_INTERVAL
+from health import HealthServer
+from test_connection import check_sheets_access
+from profiler import profiler, DEFAULT_WINDOW, MAX_WINDOW
+from tracing import setup_tracing, trace_handlers, trace_stats
+from reports import REPORTS, HISTORY_TIME, shutdown_executor
+from tenants import Tenant, load_tenants, current_tenant, tenant_job, TenantProxy, use_tenant, SharedHTTPXRequest, run_applications
+from digests import DigestScheduler
+from locks import PerUserUpdateProcessor
+from idempotency import claim, Submission, PENDING, DONE
+from user_state import CONVERSATION_TIMEOUT, UserDataJanitor, clear_on_end, timeout_handler
+from moderation import STATUS_ICONS, format_pending_lead, parse_decisions_csv
+from records import STATUS_APPROVED, STATUS_REJECTED
+from log_setup import setup_logging, instrument_handlers, log_stats
+
 logger = logging.getLogger(__name__)
 
-# Инициализация Google Sheets
-sheets_handler = GoogleSheetsHandler(
-    credentials_path='credentials.json',
-    spreadsheet_id=os.getenv('SPREADSHEET_ID')
-)
+# Админы бота из .env (в TENANTS_FILE у каждого бота свои)
+ADMIN_IDS = [641057657, 6466769330]
+
+# Боты процесса: один из .env или несколько из TENANTS_FILE; загружаются в main(), чтобы
+# импорт модуля рабочими процессами отчетов (spawn/forkserver) не создавал клиентов и журнал
+tenants: List[Tenant] = []
+# Таблица и отчеты бота, получившего текущий апдейт (см. tenants.py)
+sheets_handler = TenantProxy('sheets')
+report_service = TenantProxy('reports')
 
 REGISTERING = 1
 ADDING_LEAD = 2
@@ -30,26 +55,73 @@ LEAD_PARENT_PHONE = 6
 LEAD_PARENT_PHONE2 = 7
 BROADCAST_TEXT = 8
 BROADCAST_CONFIRM = 9
+BROADCAST_SEGMENT = 10
 
-ADMIN_IDS = [641057657, 6466769330]
+# Ключи user_data разговоров; удаляются, когда разговор завершается (см. user_state.py)
+LEAD_KEYS = ('lead_participant_id', 'lead_type', 'lead_full_name', 'lead_age', 'lead_grade',
+             'lead_telegram', 'lead_phone', 'lead_parent')
+BROADCAST_KEYS = ('broadcast_segment', 'broadcast_post')
+
+FIND_PAGE_SIZE = 10
+MODERATION_PAGE_SIZE = 8
+# Сколько апдейтов разных пользователей обрабатывается одновременно; апдейты одного - по очереди
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', 32))
 
 def admin_only(func):
     """Decorator to restrict access to admin commands."""
     @wraps(func)
     async def wrapped(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
         user_id = update.effective_user.id
-        if user_id not in ADMIN_IDS:
-            await update.message.reply_text("У вас нет доступа к этой команде.")
+        if user_id not in current_tenant().admin_ids:
+            await update.effective_message.reply_text("У вас нет доступа к этой команде.")
             return
         return await func(update, context, *args, **kwargs)
     return wrapped
 
+async def notify_admins(context: ContextTypes.DEFAULT_TYPE, text: str):
+    """Sends a service message to every admin."""
+    for admin_id in current_tenant().admin_ids:
+        try:
+            await context.bot.send_message(chat_id=admin_id, text=text)
+        except Exception as e:
+            logger.error(f"Failed to notify admin {admin_id}: {e}")
+
 def get_all_chat_ids():
-    """Fetches all non-null chat_ids from the participants table."""
+    """Fetches chat_ids of participants that can still receive messages."""
     participants = sheets_handler.get_all_participants()
-    chat_ids = [p['chat_id'] for p in participants if p['chat_id']]
+    chat_ids = [p.chat_id for p in participants if sheets_handler.chat_registry.is_active(p.chat_id)]
     return chat_ids
 
+def duplicate_lead_text(duplicate: dict, participant_id) -> str:
+    """Текст отказа для лида, который уже есть в таблице."""
+    if str(duplicate['participant_id']) == str(participant_id):
+        return "❌ Вы уже добавляли этого ученика."
+    return "❌ Этот ученик уже добавлен другим участником. Если это ошибка, обратитесь к администратору."
+
+async def reject_duplicate_lead(update: Update, participant_id, duplicate: dict) -> int:
+    """Завершает добавление лида, если он уже записан в таблице."""
+    await update.message.reply_text(
+        duplicate_lead_text(duplicate, participant_id),
+        reply_markup=get_main_keyboard()
+    )
+    return ConversationHandler.END
+
+DUPLICATE_SUBMISSION_TEXTS = {
+    'registration': {
+        PENDING: "⏳ Регистрация уже выполняется, подождите немного.",
+        DONE: "✅ Вы уже зарегистрированы!",
+    },
+    'lead': {
+        PENDING: "⏳ Этот лид уже сохраняется, подождите немного.",
+        DONE: "✅ Этот лид уже добавлен.",
+    },
+}
+
+async def reply_duplicate_submission(update: Update, kind: str, state: str) -> int:
+    """Отвечает на повторную отправку регистрации или лида, не обращаясь к таблице."""
+    await update.message.reply_text(DUPLICATE_SUBMISSION_TEXTS[kind][state], reply_markup=get_main_keyboard())
+    return ConversationHandler.END
+
 def get_main_keyboard():
     """Create main menu keyboard."""
     keyboard = [
@@ -77,15 +149,20 @@ async def show_registration_prompt(update: Update):
     reply_markup = InlineKeyboardMarkup(keyboard)
     await update.message.reply_text(welcome_text, reply_markup=reply_markup)
 
+@rate_limited
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Простая регистрация: если пользователь есть в базе — меню, если нет — регистрация."""
     telegram_id = update.effective_user.id
 
-    participant = sheets_handler.find_participant_by_telegram_id(telegram_id)
+    participant = await asyncio.to_thread(sheets_handler.find_participant_by_telegram_id, telegram_id)
+    if not participant:
+        # Участник прошлого сезона: возвращаем его из архива с прежним ID
+        async with current_tenant().registration_lock:
+            participant = await asyncio.to_thread(sheets_handler.restore_archived_participant, telegram_id, update.effective_chat.id)
 
     if participant:
-        if not participant['chat_id']:
-            sheets_handler.update_participant_chat_id(telegram_id, update.effective_chat.id)
+        # Запоминает новый Chat ID и снова включает рассылки, если бот был заблокирован
+        await asyncio.to_thread(sheets_handler.update_participant_chat_id, telegram_id, update.effective_chat.id)
         await update.message.reply_text(
             "С возвращением! Используйте меню для навигации:",
             reply_markup=get_main_keyboard()
@@ -94,7 +171,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Дополнительно проверяем Google-таблицу (на всякий случай)
         in_sheet = False
         try:
-            row = sheets_handler.find_participant_by_telegram_id(telegram_id)
+            row = await asyncio.to_thread(sheets_handler.find_participant_by_telegram_id, telegram_id)
             if row:
                 in_sheet = True
         except Exception as e:
@@ -117,6 +194,7 @@ async def register_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     return REGISTERING
 
+@rate_limited
 async def process_registration(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         full_name, course = update.message.text.split('\n')
@@ -131,20 +209,28 @@ async def process_registration(update: Update, context: ContextTypes.DEFAULT_TYP
             )
             return REGISTERING
         
-        # Получаем максимальный ID из Google-таблицы
-        max_sheet_id = sheets_handler.get_max_id()
-        new_id = max(max_sheet_id, 1) + 1
+        # Повторная доставка или повторная отправка той же анкеты не доходит до таблицы
+        with claim(update, context, 'registration', full_name, course) as submission:
+            if submission.duplicate:
+                return await reply_duplicate_submission(update, 'registration', submission.duplicate)
+
+            # Новый ID выдается и записывается под общей блокировкой, иначе параллельные регистрации получат один ID
+            async with current_tenant().registration_lock:
+                # Получаем максимальный ID из Google-таблицы
+                max_sheet_id = await asyncio.to_thread(sheets_handler.get_max_id)
+                new_id = max(max_sheet_id, 1) + 1
+
+                # Добавляем участника в Google таблицу
+                try:
+                    await asyncio.to_thread(sheets_handler.add_participant, new_id, full_name, course, update.effective_chat.id, update.effective_user.id)
+                except Exception as e:
+                    logger.error(f"Ошибка при добавлении строки в Google Sheets: {e}")
+                    await update.message.reply_text(
+                        "❌ Произошла ошибка при добавлении в Google-таблицу. Попробуйте позже!"
+                    )
+                    return ConversationHandler.END
+            submission.done()
 
-        # Добавляем участника в Google таблицу
-        try:
-            sheets_handler.add_participant(new_id, full_name, course, update.effective_chat.id, update.effective_user.id)
-        except Exception as e:
-            logger.error(f"Ошибка при добавлении строки в Google Sheets: {e}")
-            await update.message.reply_text(
-                "❌ Произошла ошибка при добавлении в Google-таблицу. Попробуйте позже!"
-            )
-            return ConversationHandler.END
-        
         await update.message.reply_text(
             "✅ Регистрация успешно завершена!",
             reply_markup=get_main_keyboard()
@@ -160,14 +246,17 @@ async def process_registration(update: Update, context: ContextTypes.DEFAULT_TYP
         )
         return REGISTERING
 
+@rate_limited
 async def add_lead(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = sheets_handler.find_participant_by_telegram_id(update.effective_user.id)
+    user = await asyncio.to_thread(sheets_handler.find_participant_by_telegram_id, update.effective_user.id)
     
     if not user:
         await update.message.reply_text(
             "❌ Сначала зарегистрируйтесь через кнопку '📝 Зарегистрироваться' в главном меню"
         )
         return ConversationHandler.END
+
+    context.user_data['lead_participant_id'] = user.participant_id
     
     keyboard = [
         [
@@ -212,9 +301,19 @@ async def process_lead_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
         age = int(age)
         grade = int(grade)
         
-        if not (4 <= grade <= 9):
+        if not (MIN_AGE <= age <= MAX_AGE):
+            await update.message.reply_text(
+                f"❌ Возраст должен быть от {MIN_AGE} до {MAX_AGE}. Попробуйте снова.\n\n"
+                "Пример ввода✅:\n"
+                "Иванов Иван Иванович\n"
+                "14\n"
+                "8"
+            )
+            return LEAD_INFO
+
+        if not (MIN_GRADE <= grade <= MAX_GRADE):
             await update.message.reply_text(
-                "❌ Класс должен быть от 4 до 9. Попробуйте снова.\n\n"
+                f"❌ Класс должен быть от {MIN_GRADE} до {MAX_GRADE}. Попробуйте снова.\n\n"
                 "Пример ввода✅:\n"
                 "Иванов Иван Иванович\n"
                 "14\n"
@@ -251,6 +350,10 @@ async def process_lead_phone(update: Update, context: ContextTypes.DEFAULT_TYPE)
     elif not username.startswith('@'):
         username = '@' + username
     
+    duplicate = await asyncio.to_thread(sheets_handler.find_duplicate_lead, {'telegram': username})
+    if duplicate:
+        return await reject_duplicate_lead(update, context.user_data.get('lead_participant_id'), duplicate)
+
     context.user_data['lead_telegram'] = username
     
     await update.message.reply_text(
@@ -281,6 +384,11 @@ async def process_lead_parent(update: Update, context: ContextTypes.DEFAULT_TYPE
         )
         return LEAD_PARENT
 
+    phone = normalize_phone(phone) or phone
+    duplicate = await asyncio.to_thread(sheets_handler.find_duplicate_lead, {'phone': phone})
+    if duplicate:
+        return await reject_duplicate_lead(update, context.user_data.get('lead_participant_id'), duplicate)
+
     context.user_data['lead_phone'] = phone
     await update.message.reply_text(
         "Теперь отправьте ФИО родителя:\n\nДля отмены используйте команду /cancel"
@@ -295,6 +403,73 @@ async def process_lead_parent_phone(update: Update, context: ContextTypes.DEFAUL
     )
     return LEAD_PARENT_PHONE2  # Новый шаг для номера телефона родителя
 
+def lead_content(lead_data: dict) -> list:
+    """Содержимое лида для ключа идемпотентности."""
+    return [f"{field}={value}" for field, value in sorted(lead_data.items())]
+
+async def save_lead(update: Update, context: ContextTypes.DEFAULT_TYPE, user, lead_data: dict,
+                    submission: Submission) -> int:
+    """Checks the lead for duplicates and records it with a single sheet write."""
+    # Лиды участника пишутся в его строку: проверка дубликата и запись не должны перемежаться
+    async with current_tenant().participant_locks.hold(user.participant_id):
+        duplicate = await asyncio.to_thread(sheets_handler.find_duplicate_lead, lead_data)
+        if duplicate and duplicate['field'] != 'parent_phone':
+            return await reject_duplicate_lead(update, user.participant_id, duplicate)
+        # Chat ID дописывается той же записью, если его еще нет в таблице
+        await asyncio.to_thread(sheets_handler.add_lead, user.participant_id, lead_data, chat_id=update.effective_chat.id)
+    submission.done()
+    if duplicate and str(duplicate['participant_id']) != str(user.participant_id):
+        # Совпал только телефон родителя: скорее всего брат или сестра, но админам стоит проверить
+        await notify_admins(
+            context,
+            f"⚠️ Возможный дубликат: участник {user.participant_id} добавил лида {lead_data['child_name']}, "
+            f"телефон родителя {lead_data['parent_phone']} уже указан у участника {duplicate['participant_id']}"
+        )
+    await update.message.reply_text(
+        "✅ Лид добавлен успешно! Баллы будут начислены администратором после проверки.",
+        reply_markup=get_main_keyboard()
+    )
+    return ConversationHandler.END
+
+@rate_limited
+async def lead_form(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Adds a lead from a one-message form: /lead followed by the filled template."""
+    form = update.message.text.partition('\n')[2]
+    if not form.strip():
+        await update.message.reply_text(
+            "Добавьте лида одним сообщением: отправьте /lead и анкету с новой строки.\n\n"
+            "Пример ввода✅:\n"
+            f"/lead\n{LEAD_TEMPLATE}\n\n"
+            "Программа определяется по классу; при необходимости добавьте строку «Программа: Колледж»."
+        )
+        return
+
+    lead_data, errors = parse_lead_form(form)
+    if errors:
+        await update.message.reply_text(
+            "❌ Лид не добавлен, исправьте анкету и отправьте ее снова:\n\n"
+            + "\n".join(f"• {error}" for error in errors)
+        )
+        return
+    try:
+        with claim(update, context, 'lead', *lead_content(lead_data)) as submission:
+            if submission.duplicate:
+                await reply_duplicate_submission(update, 'lead', submission.duplicate)
+                return
+            user = await asyncio.to_thread(sheets_handler.find_participant_by_telegram_id, update.effective_user.id)
+            if not user:
+                await update.message.reply_text(
+                    "❌ Сначала зарегистрируйтесь через кнопку '📝 Зарегистрироваться' в главном меню"
+                )
+                return
+            await save_lead(update, context, user, lead_data, submission)
+    except Exception as e:
+        logger.error(f"Error in lead_form: {e}")
+        await update.message.reply_text(
+            "❌ Произошла ошибка при сохранении данных. Попробуйте позже.",
+            reply_markup=get_main_keyboard()
+        )
+
 async def process_lead_parent_phone2(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         parent_phone = update.message.text.strip()
@@ -318,14 +493,6 @@ async def process_lead_parent_phone2(update: Update, context: ContextTypes.DEFAU
             return LEAD_PARENT_PHONE2
         if parent_phone.startswith('8'):
             parent_phone = '+7' + parent_phone[1:]
-        user = sheets_handler.find_participant_by_telegram_id(update.effective_user.id)
-        
-        if user and (len(user) > 16 and not user[16]):
-            sheets_handler.update_participant_chat_id(update.effective_user.id, update.effective_chat.id)
-        
-        if not user:
-             await update.message.reply_text("Пожалуйста, сначала зарегистрируйтесь, используя команду /start.")
-             return ConversationHandler.END
 
         # Создаем нового лида
         lead_data = {
@@ -338,12 +505,15 @@ async def process_lead_parent_phone2(update: Update, context: ContextTypes.DEFAU
             'parent_phone': parent_phone,
             'program_type': context.user_data['lead_type']
         }
-        sheets_handler.add_lead(user[1], lead_data)
-        await update.message.reply_text(
-            "✅ Лид добавлен успешно! Баллы будут начислены администратором после проверки.",
-            reply_markup=get_main_keyboard()
-        )
-        return ConversationHandler.END
+        # Повторная доставка или повторная отправка того же лида не доходит до таблицы
+        with claim(update, context, 'lead', *lead_content(lead_data)) as submission:
+            if submission.duplicate:
+                return await reply_duplicate_submission(update, 'lead', submission.duplicate)
+            user = await asyncio.to_thread(sheets_handler.find_participant_by_telegram_id, update.effective_user.id)
+            if not user:
+                await update.message.reply_text("Пожалуйста, сначала зарегистрируйтесь, используя команду /start.")
+                return ConversationHandler.END
+            return await save_lead(update, context, user, lead_data, submission)
     except Exception as e:
         logger.error(f"Error in process_lead_parent_phone2: {e}")
         await update.message.reply_text(
@@ -384,26 +554,25 @@ async def info(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup=reply_markup
     )
 
+@rate_limited
 async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Показывает статистику участника."""
     user_id = update.effective_user.id
     
-    sheet_user_row = sheets_handler.find_participant_by_telegram_id(user_id)
+    participant = await asyncio.to_thread(sheets_handler.find_participant_by_telegram_id, user_id)
     
-    if not sheet_user_row:
+    if not participant:
         await update.message.reply_text(
             "Вы не зарегистрированы в системе. Используйте /start для регистрации."
         )
         return ConversationHandler.END
         
-    full_name = sheet_user_row[2]
-    course = sheet_user_row[3]
+    full_name = participant.full_name
+    course = participant.course
 
-    # Получаем баллы из Google Sheets
-    points = sheets_handler.get_participant_points(sheet_user_row[1])
-    
-    # Получаем лиды из Google Sheets
-    leads = sheets_handler.get_all_leads(sheet_user_row[1])
+    # Баллы и лиды берем из той же записи снимка, без повторного чтения таблицы
+    points = participant.points
+    leads = participant.leads
     
     # Формируем сообщение со статистикой
     message = (
@@ -416,7 +585,7 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     
     if leads:
         for lead in leads:
-            message += f"{lead['child_name']}\n"
+            message += f"{lead.child_name} — {lead.status}\n"
     else:
         message += "У вас пока нет лидов"
     
@@ -432,12 +601,17 @@ async def info_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"{info['title']}\n\n{info['text']}"
     )
 
+    # Флаеры и видео для пересылки: загружаются один раз, дальше отправляются по file_id
+    try:
+        await send_promo_media(context.bot, query.message.chat_id, query.data, cache=current_tenant().media_cache)
+    except Exception as e:
+        logger.error(f"Failed to send promo media for {query.data}: {e}")
+
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
         "❌ Операция отменена",
         reply_markup=get_main_keyboard()
     )
-    context.user_data.clear()
     return ConversationHandler.END
 
 # --- Admin Panel & Broadcast Functions ---
@@ -445,25 +619,386 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
 @admin_only
 async def root(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Admin panel entry point."""
-    keyboard = [[InlineKeyboardButton("Начать рассылку", callback_data="start_broadcast")]]
+    keyboard = [
+        [InlineKeyboardButton("Начать рассылку", callback_data="start_broadcast")],
+        [InlineKeyboardButton("📊 Сводка", callback_data="dashboard")],
+        [InlineKeyboardButton("📈 Отчеты", callback_data="reports")],
+        [InlineKeyboardButton("✅ Модерация лидов", callback_data="mod_open")]
+    ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     await update.message.reply_text("Админ-панель:", reply_markup=reply_markup)
 
+@admin_only
+async def dashboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Shows campaign totals from the incrementally maintained counters."""
+    stats = await asyncio.to_thread(sheets_handler.get_campaign_stats)
+    text = stats.format()
+    if update.callback_query:
+        await update.callback_query.answer()
+    await update.effective_message.reply_text(text)
+
+@admin_only
+async def reports_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Lists the reports available from the admin panel."""
+    query = update.callback_query
+    await query.answer()
+    keyboard = [
+        [InlineKeyboardButton(title, callback_data=f"report_{kind}")]
+        for kind, (title, _, _) in REPORTS.items()
+    ]
+    await query.edit_message_text("Выберите отчет:", reply_markup=InlineKeyboardMarkup(keyboard))
+
+@admin_only
+async def report_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Renders the report in the process pool and sends it when ready."""
+    query = update.callback_query
+    await query.answer("Готовлю отчет…")
+    kind = query.data.removeprefix('report_')
+
+    # Отчет отправляется отдельной задачей: обработчик не ждет отрисовки
+    async def deliver(bot, chat_id):
+        try:
+            filename, content = await report_service.render(kind)
+        except Exception as e:
+            logger.error(f"Report {kind} failed: {e}")
+            await bot.send_message(chat_id=chat_id, text=f"❌ Не удалось построить отчет: {e}")
+            return
+        if filename.endswith('.png'):
+            await bot.send_photo(chat_id=chat_id, photo=content, caption=REPORTS[kind][0])
+        else:
+            await bot.send_document(chat_id=chat_id, document=io.BytesIO(content), filename=filename)
+
+    context.application.create_task(deliver(context.bot, update.effective_chat.id), update=update)
+
+def render_moderation_page(decisions: dict, page: int):
+    """Возвращает текст и клавиатуру страницы очереди модерации."""
+    pending = sheets_handler.pending_leads()
+    pages = max(1, (len(pending) + MODERATION_PAGE_SIZE - 1) // MODERATION_PAGE_SIZE)
+    page = max(0, min(page, pages - 1))
+    chunk = pending[page * MODERATION_PAGE_SIZE:(page + 1) * MODERATION_PAGE_SIZE]
+    lines = [f"🗂 На проверке: {len(pending)}, решений в сессии: {len(decisions)} (стр. {page + 1}/{pages})"]
+    keyboard = []
+    for position, (participant, lead) in enumerate(chunk, start=1):
+        key = f"{participant.participant_id}_{lead.number}"
+        status = decisions.get((participant.participant_id, lead.number), lead.status)
+        lines.append(f"{position}. {STATUS_ICONS[status]} {format_pending_lead(participant, lead)}")
+        keyboard.append([
+            InlineKeyboardButton(f"✅ {position}", callback_data=f"mod_a_{key}"),
+            InlineKeyboardButton(f"❌ {position}", callback_data=f"mod_r_{key}"),
+        ])
+    if chunk:
+        keyboard.append([
+            InlineKeyboardButton("✅ Все на странице", callback_data=f"mod_pa_{page}"),
+            InlineKeyboardButton("❌ Все на странице", callback_data=f"mod_pr_{page}"),
+        ])
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton("◀️", callback_data=f"mod_page_{page - 1}"))
+    if page < pages - 1:
+        navigation.append(InlineKeyboardButton("▶️", callback_data=f"mod_page_{page + 1}"))
+    if navigation:
+        keyboard.append(navigation)
+    keyboard.append([
+        InlineKeyboardButton(f"💾 Сохранить ({len(decisions)})", callback_data="mod_save"),
+        InlineKeyboardButton("✖️ Отменить", callback_data="mod_cancel"),
+    ])
+    if not pending:
+        lines.append("\nНепроверенных лидов нет.")
+    lines.append("\nРешения можно прислать CSV-файлом: ID участника, номер лида, approve/reject.")
+    return '\n'.join(lines), InlineKeyboardMarkup(keyboard), page
+
+@admin_only
+async def moderate(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Opens the lead moderation queue: /moderate or the admin panel button."""
+    decisions = context.user_data.setdefault('moderation', {})
+    context.user_data['moderation_page'] = 0
+    text, reply_markup, _ = await asyncio.to_thread(render_moderation_page, decisions, 0)
+    if update.callback_query:
+        await update.callback_query.answer()
+        await update.callback_query.edit_message_text(text, reply_markup=reply_markup)
+    else:
+        await update.message.reply_text(text, reply_markup=reply_markup)
+
+@admin_only
+async def moderation_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Per-lead and bulk decisions, paging, saving and cancelling the moderation session."""
+    query = update.callback_query
+    decisions = context.user_data.setdefault('moderation', {})
+    page = context.user_data.get('moderation_page', 0)
+    action = query.data.removeprefix('mod_')
+
+    if action == 'cancel':
+        context.user_data.pop('moderation', None)
+        await query.answer()
+        await query.edit_message_text("Модерация отменена, решения не записаны.")
+        return
+    if action == 'save':
+        if not decisions:
+            await query.answer("Нет решений для сохранения")
+            return
+        await query.answer("Сохраняю…")
+        try:
+            # Статусы (M) и баллы (L) переписываются в строках участников, как и при добавлении лида
+            async with current_tenant().participant_locks.hold_all(pid for pid, _ in decisions):
+                result = await asyncio.to_thread(sheets_handler.apply_moderation, decisions)
+        except Exception as e:
+            logger.error(f"Moderation save failed: {e}")
+            await query.edit_message_text(f"❌ Не удалось сохранить решения: {e}\nСессия сохранена, попробуйте еще раз.")
+            return
+        context.user_data.pop('moderation', None)
+        text = (
+            f"💾 Сохранено: одобрено {result['approved']}, отклонено {result['rejected']}, "
+            f"баллов начислено {result['points']:+d}."
+        )
+        if result['missing']:
+            text += f"\nНе найдено участников для {result['missing']} решений."
+        await query.edit_message_text(text)
+        return
+
+    if action.startswith(('a_', 'r_')):
+        status = STATUS_APPROVED if action[0] == 'a' else STATUS_REJECTED
+        participant_id, lead_number = map(int, action[2:].split('_'))
+        key = (participant_id, lead_number)
+        # Повторное нажатие той же кнопки снимает решение
+        if decisions.get(key) == status:
+            del decisions[key]
+        else:
+            decisions[key] = status
+    elif action.startswith(('pa_', 'pr_')):
+        status = STATUS_APPROVED if action[1] == 'a' else STATUS_REJECTED
+        page = int(action[3:])
+        pending = await asyncio.to_thread(sheets_handler.pending_leads)
+        for participant, lead in pending[page * MODERATION_PAGE_SIZE:(page + 1) * MODERATION_PAGE_SIZE]:
+            decisions[(participant.participant_id, lead.number)] = status
+    elif action.startswith('page_'):
+        page = int(action.removeprefix('page_'))
+
+    await query.answer()
+    text, reply_markup, page = await asyncio.to_thread(render_moderation_page, decisions, page)
+    context.user_data['moderation_page'] = page
+    await query.edit_message_text(text, reply_markup=reply_markup)
+
+async def moderation_csv(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Adds decisions from an uploaded CSV file to the moderation session."""
+    document = update.message.document
+    content = await (await document.get_file()).download_as_bytearray()
+    decisions, errors = parse_decisions_csv(bytes(content).decode('utf-8-sig', errors='replace'))
+    if errors and not decisions:
+        await update.message.reply_text("❌ В файле нет решений:\n" + '\n'.join(errors[:10]))
+        return
+    session = context.user_data.setdefault('moderation', {})
+    session.update(decisions)
+    approved = sum(status == STATUS_APPROVED for status in decisions.values())
+    text = (
+        f"📄 Из файла {document.file_name}: одобрить {approved}, отклонить {len(decisions) - approved}.\n"
+        f"Решений в сессии: {len(session)}."
+    )
+    if errors:
+        text += f"\n\nПропущено строк: {len(errors)}\n" + '\n'.join(errors[:10])
+    keyboard = [[
+        InlineKeyboardButton(f"💾 Сохранить ({len(session)})", callback_data="mod_save"),
+        InlineKeyboardButton("🗂 Очередь", callback_data="mod_open"),
+        InlineKeyboardButton("✖️ Отменить", callback_data="mod_cancel"),
+    ]]
+    await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+
+def format_search_result(doc: dict) -> str:
+    """Одна строка результата поиска /find."""
+    if doc['kind'] == 'participant':
+        return f"👤 {doc['full_name']} (ID {doc['participant_id']}, курс {doc['course']})"
+    details = ', '.join(value for value in (doc['telegram'], doc['parent_name']) if value)
+    line = f"🧒 {doc['child_name']} — лид участника {doc['owner_name']} (ID {doc['participant_id']})"
+    return f"{line}\n    {details}" if details else line
+
+def render_search_page(query: str, page: int):
+    """Возвращает текст и клавиатуру для страницы результатов поиска."""
+    results = sheets_handler.search(query)
+    if not results:
+        return f"По запросу «{query}» ничего не найдено.", None
+    pages = (len(results) + FIND_PAGE_SIZE - 1) // FIND_PAGE_SIZE
+    page = max(0, min(page, pages - 1))
+    chunk = results[page * FIND_PAGE_SIZE:(page + 1) * FIND_PAGE_SIZE]
+    text = (
+        f"🔎 «{query}»: найдено {len(results)} (стр. {page + 1}/{pages})\n\n"
+        + '\n'.join(format_search_result(doc) for doc in chunk)
+    )
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("◀️", callback_data=f"find_page_{page - 1}"))
+    if page < pages - 1:
+        buttons.append(InlineKeyboardButton("▶️", callback_data=f"find_page_{page + 1}"))
+    return text, InlineKeyboardMarkup([buttons]) if buttons else None
+
+@admin_only
+async def find(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Searches participants and leads: /find <query>."""
+    query = ' '.join(context.args).strip()
+    if not query:
+        await update.message.reply_text("Использование: /find <ФИО, username или часть имени>")
+        return
+    context.user_data['find_query'] = query
+    text, reply_markup = await asyncio.to_thread(render_search_page, query, 0)
+    await update.message.reply_text(text, reply_markup=reply_markup)
+
+@admin_only
+async def find_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Switches the page of /find results."""
+    query = update.callback_query
+    await query.answer()
+    search_query = context.user_data.get('find_query')
+    if not search_query:
+        await query.edit_message_text("Поиск устарел, повторите /find.")
+        return
+    page = int(query.data.removeprefix('find_page_'))
+    text, reply_markup = await asyncio.to_thread(render_search_page, search_query, page)
+    await query.edit_message_text(text, reply_markup=reply_markup)
+
+@admin_only
+async def new_season(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Archives the current season: /new_season <label of the finished season>."""
+    season = ' '.join(context.args).strip()
+    if not season:
+        await update.message.reply_text(
+            "Использование: /new_season <название завершившегося сезона>\n"
+            "Например: /new_season Лето 2025"
+        )
+        return
+    preview = await asyncio.to_thread(sheets_handler.preview_rollover)
+    context.user_data['new_season'] = season
+    keyboard = [
+        [
+            InlineKeyboardButton("✅ Начать новый сезон", callback_data="season_confirm"),
+            InlineKeyboardButton("❌ Отменить", callback_data="season_cancel")
+        ]
+    ]
+    await update.message.reply_text(
+        f"Текущий лист будет переименован в «Архив {season}» ({preview['archived']} участников).\n"
+        f"В новый сезон перейдут {preview['carried']} активных участников, без лидов и баллов.\n\n"
+        f"Продолжить?",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+@admin_only
+async def new_season_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Confirms or cancels the season rollover."""
+    query = update.callback_query
+    await query.answer()
+    season = context.user_data.pop('new_season', None)
+    if query.data == 'season_cancel' or not season:
+        await query.edit_message_text("Смена сезона отменена.")
+        return
+    try:
+        async with current_tenant().registration_lock:
+            result = await asyncio.to_thread(sheets_handler.rollover_season, season)
+    except Exception as e:
+        logger.error(f"Season rollover failed: {e}")
+        await query.edit_message_text(f"❌ Не удалось начать новый сезон: {e}")
+        return
+    await query.edit_message_text(
+        f"✅ Новый сезон начат.\n"
+        f"В архиве «Архив {season}»: {result['archived']} участников\n"
+        f"Перенесено в новый сезон: {result['carried']}"
+    )
+
+@admin_only
+async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Sampled profiling of the bot: /profile on [seconds] | off | dump."""
+    action = context.args[0].lower() if context.args else ''
+    if action == 'on':
+        try:
+            window = min(int(context.args[1]), MAX_WINDOW) if len(context.args) > 1 else DEFAULT_WINDOW
+        except ValueError:
+            await update.message.reply_text("Длительность должна быть числом секунд, например: /profile on 120")
+            return
+        profiler.start(window)
+        await update.message.reply_text(
+            f"🔬 Профилирование включено на {window} с.\n"
+            "Повторите медленные действия, затем отправьте /profile dump"
+        )
+    elif action == 'off':
+        profiler.stop()
+        await update.message.reply_text("Профилирование выключено. Отчет: /profile dump")
+    elif action == 'dump':
+        if profiler.started_at is None:
+            await update.message.reply_text("Профилирование еще не запускалось: /profile on")
+            return
+        status = "идет" if profiler.running else "завершено"
+        await update.message.reply_text(f"Профилирование {status}.\n\n{profiler.top()}")
+        if profiler.samples:
+            await update.message.reply_document(
+                document=io.BytesIO(profiler.collapsed().encode('utf-8')),
+                filename='profile.collapsed.txt',
+                caption="Collapsed stacks для flamegraph.pl или speedscope.app"
+            )
+    else:
+        await update.message.reply_text(
+            "Использование:\n"
+            f"/profile on [секунд] - включить сэмплирование (по умолчанию {DEFAULT_WINDOW} с)\n"
+            "/profile off - выключить\n"
+            "/profile dump - топ функций и файл для flame graph"
+        )
+
+def get_segment_keyboard():
+    """Preset audience buttons for the broadcast flow."""
+    buttons = [InlineKeyboardButton(title, callback_data=f"segment_{key}") for key, (title, _) in PRESETS.items()]
+    keyboard = [buttons[i:i + 3] for i in range(0, len(buttons), 3)]
+    keyboard.append([InlineKeyboardButton("✍️ Свой фильтр", callback_data="segment_custom")])
+    return InlineKeyboardMarkup(keyboard)
+
+def describe_segment(expression: str) -> str:
+    return f"«{expression}»" if expression else "все участники"
+
 async def start_broadcast_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Asks for the broadcast message text."""
+    """Asks who should receive the broadcast."""
     query = update.callback_query
     await query.answer()
-    await query.edit_message_text("Пожалуйста, введите текст для рассылки.")
+    await query.edit_message_text("Кому отправить рассылку?", reply_markup=get_segment_keyboard())
+    return BROADCAST_SEGMENT
+
+async def ask_broadcast_text(message, context: ContextTypes.DEFAULT_TYPE, expression: str, edit: bool = False):
+    """Stores the segment, shows the recipient count and asks for the text."""
+    count = await asyncio.to_thread(sheets_handler.count_segment, expression)
+    context.user_data['broadcast_segment'] = expression
+    text = (
+        f"Сегмент: {describe_segment(expression)}\n"
+        f"Получателей: {count}\n\n"
+        "Отправьте сообщение для рассылки: текст, фото, видео, документ или альбом."
+    )
+    if edit:
+        await message.edit_text(text)
+    else:
+        await message.reply_text(text)
     return BROADCAST_TEXT
 
-async def get_broadcast_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Shows a preview of the broadcast message."""
-    broadcast_text = update.message.text
-    context.user_data['broadcast_text'] = broadcast_text
+async def broadcast_segment_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handles a preset or custom segment button."""
+    query = update.callback_query
+    await query.answer()
+    key = query.data.removeprefix('segment_')
+    if key == 'custom':
+        await query.edit_message_text(
+            "Отправьте условия через запятую или с новой строки.\n"
+            "Поля: курс, баллы, статус, лиды. Операторы: = != > >= < <=\n\n"
+            "Пример ввода✅:\n"
+            "курс=1, лиды=0"
+        )
+        return BROADCAST_SEGMENT
+    return await ask_broadcast_text(query.message, context, PRESETS[key][1], edit=True)
+
+async def get_broadcast_segment(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Parses a custom segment expression."""
+    expression = update.message.text.strip()
+    try:
+        return await ask_broadcast_text(update.message, context, expression)
+    except SegmentError as e:
+        await update.message.reply_text(f"❌ {e}\n\nПопробуйте снова или используйте /cancel")
+        return BROADCAST_SEGMENT
 
-    # Show preview
-    await update.message.reply_text("<b>Пример рассылки:</b>", parse_mode='HTML')
-    await update.message.reply_text(broadcast_text)
+async def show_broadcast_preview(bot, chat_id: int, user_data: dict):
+    """Sends the post back to the admin and asks for confirmation."""
+    post = user_data['broadcast_post']
+    await bot.send_message(chat_id=chat_id, text="<b>Пример рассылки:</b>", parse_mode='HTML')
+    await post.send(bot, chat_id)
 
     keyboard = [
         [
@@ -472,38 +1007,71 @@ async def get_broadcast_text(update: Update, context: ContextTypes.DEFAULT_TYPE)
         ]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text(
-        "Вы уверены, что хотите начать рассылку с этим текстом?",
+    expression = user_data.get('broadcast_segment', '')
+    count = await asyncio.to_thread(sheets_handler.count_segment, expression)
+    await bot.send_message(
+        chat_id=chat_id,
+        text=f"Сегмент: {describe_segment(expression)}, получателей: {count}\n"
+             f"Вы уверены, что хотите начать рассылку ({post.describe()})?",
         reply_markup=reply_markup
     )
+
+async def get_broadcast_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Stores any admin message as the broadcast source and shows a preview."""
+    post = BroadcastPost(update.message)
+    context.user_data['broadcast_post'] = post
+    if not post.is_album:
+        await show_broadcast_preview(context.bot, update.effective_chat.id, context.user_data)
+        return BROADCAST_CONFIRM
+
+    # The rest of the album arrives as separate updates; preview once they are collected
+    async def delayed_preview(bot, chat_id, user_data):
+        await asyncio.sleep(ALBUM_WAIT)
+        await show_broadcast_preview(bot, chat_id, user_data)
+
+    context.application.create_task(
+        delayed_preview(context.bot, update.effective_chat.id, context.user_data), update=update
+    )
+    return BROADCAST_CONFIRM
+
+async def collect_broadcast_album(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Adds the remaining messages of an album to the broadcast post."""
+    post = context.user_data.get('broadcast_post')
+    if post is None or not post.add_album_message(update.message):
+        await update.message.reply_text("Нажмите «✅ Начать» или «❌ Отменить».")
     return BROADCAST_CONFIRM
 
 async def send_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Sends the message to all users."""
+    """Sends the post to every participant of the chosen segment."""
     query = update.callback_query
     await query.answer()
     await query.edit_message_text("Рассылка начата...")
 
-    broadcast_text = context.user_data['broadcast_text']
-    chat_ids = get_all_chat_ids()
+    post = context.user_data['broadcast_post']
+    chat_ids = await asyncio.to_thread(sheets_handler.segment_chat_ids, context.user_data.get('broadcast_segment', ''))
     
     successful_sends = 0
     failed_sends = 0
+    dead_chats = []
 
     for chat_id in chat_ids:
+        await telegram_quota.wait()
         try:
-            await context.bot.send_message(chat_id=chat_id, text=broadcast_text)
+            await post.send(context.bot, chat_id)
             successful_sends += 1
         except Exception as e:
             logger.error(f"Failed to send message to {chat_id}: {e}")
             failed_sends += 1
+            if is_dead_chat_error(e):
+                dead_chats.append(chat_id)
+    await asyncio.to_thread(sheets_handler.mark_chats_inactive, dead_chats)
     
     await query.message.reply_text(
         f"✅ Рассылка завершена!\n"
         f"Успешно отправлено: {successful_sends}\n"
-        f"Не удалось отправить: {failed_sends}"
+        f"Не удалось отправить: {failed_sends}\n"
+        f"Заблокировали бота или удалили чат: {len(dead_chats)}"
     )
-    context.user_data.clear()
     return ConversationHandler.END
 
 async def cancel_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -511,11 +1079,90 @@ async def cancel_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     await query.edit_message_text("Рассылка отменена.")
-    context.user_data.clear()
     return ConversationHandler.END
 
-def main():
-    application = Application.builder().token(os.getenv('BOT_TOKEN')).build()
+def check_tenants() -> str:
+    """Readiness check: every bot's sheet must be readable."""
+    return '; '.join(f"{tenant.name}: {check_sheets_access(tenant.sheets)}" for tenant in tenants)
+
+health_server = HealthServer(
+    check=check_tenants,
+    metrics=lambda: {**{tenant.name: tenant.stats() for tenant in tenants}, 'logging': {**log_stats(), **trace_stats()}}
+)
+warmups = {}
+running_bots = set()
+WARMUP_RETRY_DELAYS = (5, 15, 60, 300)  # Секунд до повторного прогрева; дальше каждые 5 минут
+
+async def on_startup(application: Application):
+    """Warms up Sheets access before polling starts and exposes health checks."""
+    tenant = application.bot_data['tenant']
+    running_bots.add(tenant.name)
+    if not health_server.running:
+        await health_server.start()
+    if await asyncio.to_thread(tenant.sheets.load_snapshot_cache):
+        # Отвечаем по снимку с диска сразу, а таблицу перечитываем в фоне
+        warmed_up(tenant, {'source': 'snapshot_cache'})
+        application.create_task(warm_up_sheets(tenant))
+    elif not await warm_up_sheets(tenant):
+        # Не блокируем запуск: повторяем прогрев в фоне, пока таблица не станет доступна
+        application.create_task(retry_warm_up(tenant))
+
+def warmed_up(tenant: Tenant, timings: dict):
+    warmups[tenant.name] = timings
+    # Бот готов, когда прогреты таблицы всех ботов процесса
+    if len(warmups) == len(tenants):
+        health_server.warmed_up(warmups if len(tenants) > 1 else timings)
+
+async def warm_up_sheets(tenant: Tenant) -> bool:
+    try:
+        timings = await asyncio.to_thread(tenant.sheets.warmup)
+    except Exception as e:
+        logger.error(f"Warmup of {tenant.name} failed, first requests will load the sheet: {e}")
+        if health_server.warmup is None:
+            health_server.warmup_failed(e)
+        return False
+    logger.info(f"Warmup of {tenant.name} finished: {timings}")
+    warmed_up(tenant, timings)
+    return True
+
+async def retry_warm_up(tenant: Tenant):
+    """Retries a failed warmup with backoff so /readyz recovers once the sheet is reachable."""
+    attempt = 0
+    while tenant.name in running_bots and tenant.name not in warmups:
+        await asyncio.sleep(WARMUP_RETRY_DELAYS[min(attempt, len(WARMUP_RETRY_DELAYS) - 1)])
+        attempt += 1
+        if tenant.name in running_bots and await warm_up_sheets(tenant):
+            return
+
+async def on_shutdown(application: Application):
+    """Writes chat IDs collected in memory and saves the snapshot; the last bot stops shared workers."""
+    tenant = application.bot_data['tenant']
+    await asyncio.to_thread(tenant.sheets.flush_chat_ids)
+    await asyncio.to_thread(tenant.sheets.save_snapshot_cache)
+    running_bots.discard(tenant.name)
+    if not running_bots:
+        shutdown_executor()
+        await health_server.stop()
+
+async def flush_chat_ids(context: ContextTypes.DEFAULT_TYPE):
+    """Writes chat IDs collected in memory every FLUSH_INTERVAL, even if no new ones arrive."""
+    await asyncio.to_thread(current_tenant().sheets.flush_chat_ids)
+
+async def record_leads_history(context: ContextTypes.DEFAULT_TYPE):
+    """Records daily campaign totals for the leads chart, whether or not reports are requested."""
+    await report_service.record_daily()
+
+def build_application(tenant: Tenant, request: SharedHTTPXRequest) -> Application:
+    """Application of one bot with all handlers; request is the HTTP pool shared by all bots."""
+    application = (
+        Application.builder()
+        .token(tenant.bot_token)
+        .request(request)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
+        .build()
+    )
 
     # Conversation handlers
     conv_handler = ConversationHandler(
@@ -525,8 +1172,10 @@ def main():
         ],
         states={
             REGISTERING: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_registration)],
+            ConversationHandler.TIMEOUT: [timeout_handler((), "⌛ Регистрация отменена: не было ответа. Начните заново через /start.")],
         },
         fallbacks=[CommandHandler('cancel', cancel)],
+        conversation_timeout=CONVERSATION_TIMEOUT,
     )
 
     lead_handler = ConversationHandler(
@@ -541,21 +1190,32 @@ def main():
             LEAD_PARENT: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_lead_parent)],
             LEAD_PARENT_PHONE: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_lead_parent_phone)],
             LEAD_PARENT_PHONE2: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_lead_parent_phone2)],
+            ConversationHandler.TIMEOUT: [timeout_handler(LEAD_KEYS, "⌛ Добавление лида отменено: не было ответа. Начните заново кнопкой «➕ Добавить лида».")],
         },
         fallbacks=[CommandHandler('cancel', cancel)],
+        conversation_timeout=CONVERSATION_TIMEOUT,
     )
+    clear_on_end(lead_handler, LEAD_KEYS)
 
     broadcast_handler = ConversationHandler(
         entry_points=[CallbackQueryHandler(start_broadcast_callback, pattern="^start_broadcast$")],
         states={
-            BROADCAST_TEXT: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_broadcast_text)],
+            BROADCAST_SEGMENT: [
+                CallbackQueryHandler(broadcast_segment_callback, pattern="^segment_"),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, get_broadcast_segment)
+            ],
+            BROADCAST_TEXT: [MessageHandler(~filters.COMMAND & ~filters.StatusUpdate.ALL, get_broadcast_text)],
             BROADCAST_CONFIRM: [
                 CallbackQueryHandler(send_broadcast, pattern="^confirm_broadcast$"),
-                CallbackQueryHandler(cancel_broadcast, pattern="^cancel_broadcast$")
-            ]
+                CallbackQueryHandler(cancel_broadcast, pattern="^cancel_broadcast$"),
+                MessageHandler(~filters.COMMAND & ~filters.StatusUpdate.ALL, collect_broadcast_album)
+            ],
+            ConversationHandler.TIMEOUT: [timeout_handler(BROADCAST_KEYS, "⌛ Рассылка отменена: не было ответа.")],
         },
-        fallbacks=[CommandHandler('cancel', cancel_broadcast)]
+        fallbacks=[CommandHandler('cancel', cancel_broadcast)],
+        conversation_timeout=CONVERSATION_TIMEOUT,
     )
+    clear_on_end(broadcast_handler, BROADCAST_KEYS)
 
     # Add handlers
     application.add_handler(conv_handler)
@@ -563,15 +1223,62 @@ def main():
     application.add_handler(broadcast_handler)
 
     application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("lead", lead_form))
     application.add_handler(CommandHandler("root", root))
+    application.add_handler(CommandHandler("find", find))
+    application.add_handler(CommandHandler("dashboard", dashboard))
+    application.add_handler(CommandHandler("new_season", new_season))
+    application.add_handler(CommandHandler("profile", profile))
+    application.add_handler(CallbackQueryHandler(new_season_callback, pattern="^season_(confirm|cancel)$"))
+    application.add_handler(CallbackQueryHandler(dashboard, pattern="^dashboard$"))
+    application.add_handler(CallbackQueryHandler(reports_menu, pattern="^reports$"))
+    application.add_handler(CallbackQueryHandler(report_callback, pattern="^report_"))
+    application.add_handler(CommandHandler("moderate", moderate))
+    application.add_handler(CallbackQueryHandler(moderate, pattern="^mod_open$"))
+    application.add_handler(CallbackQueryHandler(moderation_callback, pattern="^mod_"))
+    application.add_handler(MessageHandler(
+        filters.Document.FileExtension("csv") & filters.User(tenant.admin_ids), moderation_csv
+    ))
+    application.add_handler(CallbackQueryHandler(find_page_callback, pattern="^find_page_"))
     application.add_handler(MessageHandler(filters.Regex("^ℹ️ О конкурсе$"), about))
     application.add_handler(MessageHandler(filters.Regex("^📱 Информация для продвижения$"), info))
     application.add_handler(MessageHandler(filters.Regex("^👤 Моя статистика$"), stats))
     application.add_handler(CommandHandler("info", info))
     application.add_handler(CommandHandler("stats", stats))
     application.add_handler(CallbackQueryHandler(info_callback, pattern="^info_"))
-    
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+
+    # Еженедельные сводки и напоминания (см. digests.py)
+    digests = DigestScheduler(application)
+    digests.schedule()
+    application.bot_data['digests'] = digests
+
+    instrument_handlers(application)
+    trace_handlers(application)
+    use_tenant(application, tenant)
+
+    # Учет активности для вытеснения user_data; добавляется после оберток, чтобы не считаться апдейтом в метриках
+    janitor = UserDataJanitor(application)
+    application.add_handler(TypeHandler(Update, janitor.touch), group=-1)
+    janitor.schedule()
+    tenant.footprint = janitor.footprint
+
+    if application.job_queue is not None:
+        application.job_queue.run_repeating(
+            tenant_job(flush_chat_ids), interval=FLUSH_INTERVAL, first=FLUSH_INTERVAL, name='flush_chat_ids'
+        )
+        application.job_queue.run_daily(tenant_job(record_leads_history), time=HISTORY_TIME, name='leads_history')
+    return application
+
+def main():
+    setup_logging(logging.INFO)
+    setup_tracing()
+    tenants.extend(load_tenants(ADMIN_IDS))
+    request = SharedHTTPXRequest(connection_pool_size=256)
+    applications = [build_application(tenant, request) for tenant in tenants]
+    if len(applications) == 1:
+        applications[0].run_polling(allowed_updates=Update.ALL_TYPES)
+    else:
+        asyncio.run(run_applications(applications))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,73 @@
+"""
+Источник рассылки: любое сообщение администратора (текст с форматированием,
+фото, видео, документ, альбом).
+
+Одиночное сообщение рассылается через copy_message: Telegram копирует его
+на своей стороне вместе с подписью и разметкой, файл не загружается заново.
+Альбомы copy_message разбил бы на отдельные сообщения, поэтому для них
+собираются file_id вложений и отправляется send_media_group - тоже без
+повторной загрузки.
+"""
+
+from typing import List, Optional
+
+from telegram import (
+    Bot, Message, InputMediaPhoto, InputMediaVideo, InputMediaDocument, InputMediaAudio
+)
+
+ALBUM_WAIT = 1.5  # Секунд на получение остальных сообщений альбома перед предпросмотром
+
+INPUT_MEDIA = {
+    'photo': InputMediaPhoto,
+    'video': InputMediaVideo,
+    'document': InputMediaDocument,
+    'audio': InputMediaAudio,
+}
+
+
+def _album_item(message: Message):
+    """InputMedia по file_id вложения сообщения альбома."""
+    for media_type, input_media in INPUT_MEDIA.items():
+        attachment = getattr(message, media_type, None)
+        if not attachment:
+            continue
+        file_id = attachment[-1].file_id if media_type == 'photo' else attachment.file_id
+        return input_media(media=file_id, caption=message.caption, caption_entities=message.caption_entities)
+    return None
+
+
+class BroadcastPost:
+    """Сообщение (или альбом), которое нужно разослать."""
+
+    def __init__(self, message: Message):
+        self.from_chat_id = message.chat_id
+        self.message_id = message.message_id
+        self.media_group_id: Optional[str] = message.media_group_id
+        self._album: List[tuple] = []
+        if self.media_group_id:
+            self.add_album_message(message)
+
+    @property
+    def is_album(self) -> bool:
+        return self.media_group_id is not None
+
+    def add_album_message(self, message: Message) -> bool:
+        """Добавляет сообщение того же альбома; False, если оно из другого альбома."""
+        if not self.is_album or message.media_group_id != self.media_group_id:
+            return False
+        item = _album_item(message)
+        if item is not None:
+            self._album.append((message.message_id, item))
+        return True
+
+    def describe(self) -> str:
+        if self.is_album:
+            return f"альбом из {len(self._album)} файлов"
+        return "сообщение"
+
+    async def send(self, bot: Bot, chat_id: int) -> None:
+        if self.is_album:
+            media = [item for _, item in sorted(self._album, key=lambda pair: pair[0])]
+            await bot.send_media_group(chat_id=chat_id, media=media)
+        else:
+            await bot.copy_message(chat_id=chat_id, from_chat_id=self.from_chat_id, message_id=self.message_id)
@@ -0,0 +1,113 @@
+"""
+Сводные счетчики по конкурсу для админ-панели.
+
+Счетчики обновляются при каждой записи бота (регистрация, новый лид) и
+полностью пересчитываются при обновлении снимка таблицы, чтобы учесть
+ручные правки администраторов. Ответ на запрос сводки не требует
+обращения к таблице.
+"""
+
+from collections import Counter
+from typing import Any, Dict, Iterable
+
+from program_info import POINTS
+from records import Participant
+
+UNKNOWN = 'не указан'
+
+# Границы корзин распределения баллов: (нижняя граница, подпись)
+POINTS_BUCKETS = [(50, '50+'), (20, '20–49'), (10, '10–19'), (1, '1–9'), (0, '0')]
+
+PROGRAM_TITLES = {
+    'lead_camp_do': 'Кэмп/ДО',
+    'lead_college': 'Колледж',
+}
+
+
+def points_bucket(points: int) -> str:
+    for lower, title in POINTS_BUCKETS:
+        if points >= lower:
+            return title
+    return '0'
+
+
+class CampaignStats:
+    """Счетчики участников, лидов и баллов."""
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self) -> None:
+        self.participants_by_course = Counter()
+        self.leads_by_grade = Counter()
+        self.leads_by_program = Counter()
+        self.points_distribution = Counter()
+        self.total_points = 0
+
+    @property
+    def total_participants(self) -> int:
+        return sum(self.participants_by_course.values())
+
+    @property
+    def total_leads(self) -> int:
+        return sum(self.leads_by_program.values())
+
+    def rebuild(self, participants: Iterable[Participant]) -> None:
+        """Пересчитывает все счетчики по участникам снимка."""
+        self._reset()
+        for participant in participants:
+            self.participants_by_course[str(participant.course or '') or UNKNOWN] += 1
+            self.total_points += participant.points
+            self.points_distribution[points_bucket(participant.points)] += 1
+            if not participant.lead_count:
+                continue
+            for grade in participant.lead_values('grade'):
+                self.leads_by_grade[grade or UNKNOWN] += 1
+            for program in participant.lead_values('program_type'):
+                self.leads_by_program[program or UNKNOWN] += 1
+
+    def add_participant(self, course) -> None:
+        self.participants_by_course[str(course or '') or UNKNOWN] += 1
+        self.points_distribution[points_bucket(0)] += 1
+
+    def add_lead(self, lead_data: Dict[str, Any]) -> None:
+        self.leads_by_grade[str(lead_data.get('grade', '')) or UNKNOWN] += 1
+        self.leads_by_program[lead_data.get('program_type') or UNKNOWN] += 1
+
+    def update_points(self, old_points: int, new_points: int) -> None:
+        self.total_points += new_points - old_points
+        self.points_distribution[points_bucket(old_points)] -= 1
+        self.points_distribution[points_bucket(new_points)] += 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'total_participants': self.total_participants,
+            'total_leads': self.total_leads,
+            'total_points': self.total_points,
+            'participants_by_course': dict(self.participants_by_course),
+            'leads_by_grade': dict(self.leads_by_grade),
+            'leads_by_program': dict(self.leads_by_program),
+            'points_distribution': dict(self.points_distribution),
+        }
+
+    def format(self) -> str:
+        """Текст сводки для админ-панели."""
+        def lines(counter: Dict[str, int], titles: Dict[str, str] | None = None, ordered: bool = False) -> str:
+            if not counter:
+                return "  —"
+            items = counter.items() if ordered else sorted(counter.items(), key=lambda item: str(item[0]))
+            return '\n'.join(f"  {(titles or {}).get(key, key)}: {count}" for key, count in items)
+
+        potential = sum(POINTS.get(program, 0) * count for program, count in self.leads_by_program.items())
+        buckets = {title: self.points_distribution[title] for _, title in reversed(POINTS_BUCKETS)
+                   if self.points_distribution[title]}
+        return (
+            f"📊 Сводка по конкурсу\n\n"
+            f"👥 Участников: {self.total_participants}\n"
+            f"🧒 Лидов: {self.total_leads}\n"
+            f"⭐️ Начислено баллов: {self.total_points} (по правилам за всех лидов: {potential})\n\n"
+            f"🎓 Участники по курсам:\n{lines(self.participants_by_course)}\n\n"
+            f"🏫 Лиды по классам:\n{lines(self.leads_by_grade)}\n\n"
+            f"📚 Лиды по программам:\n{lines(self.leads_by_program, PROGRAM_TITLES)}\n\n"
+            f"📈 Распределение баллов:\n{lines(buckets, ordered=True)}"
+        )
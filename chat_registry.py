@@ -0,0 +1,154 @@
+"""
+Реестр чатов участников.
+
+Chat ID и Telegram ID, которых еще нет в таблице (колонки Q и R), запоминаются
+при первом контакте только в памяти и сразу видны боту (рассылки, сегменты).
+В таблицу они дописываются пачкой одним batchUpdate: когда накопится
+FLUSH_BATCH записей, пройдет FLUSH_INTERVAL секунд (задача JobQueue в bot.py
+проверяет это и без новых записей) или бот остановится.
+
+Чаты, для которых Telegram ответил Forbidden (бот заблокирован) или
+"chat not found", помечаются неактивными и пропускаются в рассылках, пока
+пользователь снова не напишет боту. Список неактивных чатов хранится в
+inactive_chats.json.
+"""
+
+import os
+import json
+import time
+import logging
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from telegram.error import BadRequest, Forbidden
+
+from records import Participant, Snapshot
+
+logger = logging.getLogger(__name__)
+
+INACTIVE_FILE = 'inactive_chats.json'
+FLUSH_BATCH = 50     # Записей, после которых дописываем таблицу сразу
+FLUSH_INTERVAL = 30  # Секунд, дольше которых запись не ждет в памяти
+
+DEAD_CHAT_ERRORS = ('chat not found', 'user is deactivated')
+
+
+def is_dead_chat_error(error: Exception) -> bool:
+    """Ошибка Telegram означает, что в этот чат больше нельзя писать."""
+    if isinstance(error, Forbidden):
+        return True
+    return isinstance(error, BadRequest) and any(marker in str(error).lower() for marker in DEAD_CHAT_ERRORS)
+
+
+class ChatRegistry:
+    def __init__(self, path: str = INACTIVE_FILE):
+        self.path = path
+        # participant_id -> (chat_id, telegram_id), которых нет в строке участника в таблице
+        self._pending: Dict[int, Tuple[Optional[int], Optional[int]]] = {}
+        self._pending_since: Optional[float] = None
+        self._inactive: Set[int] = set()
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self._inactive = set(json.load(f))
+            except (OSError, ValueError) as e:
+                logger.error(f"Failed to read {path}: {e}")
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def record(self, participant: Participant, chat_id: Optional[int], telegram_id: Optional[int]) -> bool:
+        """
+        Запоминает ID, которых нет у участника, и сразу проставляет их в памяти.
+
+        Возвращает True, если участник изменился (новый ID или чат снова активен).
+        """
+        changed = False
+        if chat_id and chat_id in self._inactive:
+            self._inactive.discard(chat_id)
+            self._save()
+            changed = True
+
+        new_chat_id = chat_id if chat_id and not participant.chat_id else None
+        new_telegram_id = telegram_id if telegram_id and not participant.telegram_id else None
+        if new_chat_id is None and new_telegram_id is None:
+            return changed
+
+        known_chat_id, known_telegram_id = self._pending.get(participant.participant_id, (None, None))
+        self._pending[participant.participant_id] = (new_chat_id or known_chat_id, new_telegram_id or known_telegram_id)
+        if self._pending_since is None:
+            self._pending_since = time.monotonic()
+        participant.chat_id = participant.chat_id or new_chat_id
+        participant.telegram_id = participant.telegram_id or new_telegram_id
+        return True
+
+    def apply(self, snapshot: Snapshot) -> None:
+        """
+        Накладывает еще не записанные ID на свежий снимок таблицы.
+
+        Записи, которые уже есть в таблице (или участника больше нет), забываются.
+        """
+        for participant_id, (chat_id, telegram_id) in list(self._pending.items()):
+            participant = snapshot.by_participant_id.get(participant_id)
+            if participant is None:
+                del self._pending[participant_id]
+                continue
+            chat_id = chat_id if not participant.chat_id else None
+            telegram_id = telegram_id if not participant.telegram_id else None
+            if chat_id is None and telegram_id is None:
+                del self._pending[participant_id]
+                continue
+            self._pending[participant_id] = (chat_id, telegram_id)
+            if chat_id:
+                participant.chat_id = chat_id
+            if telegram_id:
+                participant.telegram_id = telegram_id
+                snapshot.by_telegram_id.setdefault(telegram_id, participant)
+        if not self._pending:
+            self._pending_since = None
+
+    def pending_cells(self, snapshot: Snapshot) -> Tuple[Dict[str, tuple], List[tuple]]:
+        """
+        Ячейки Q/R для записи: адрес -> (значение в таблице, новое значение).
+
+        Снимок должен пройти через apply(), поэтому в таблице эти ячейки пусты.
+        Второе значение - записи, которые нужно передать в mark_flushed().
+        """
+        cells = {}
+        entries = []
+        for participant_id, (chat_id, telegram_id) in self._pending.items():
+            row = snapshot.by_participant_id[participant_id].row_number
+            if chat_id:
+                cells[f"{snapshot.columns.letter('chat_id')}{row}"] = ('', chat_id)
+            if telegram_id:
+                cells[f"{snapshot.columns.letter('telegram_id')}{row}"] = ('', telegram_id)
+            entries.append((participant_id, (chat_id, telegram_id)))
+        return cells, entries
+
+    def mark_flushed(self, entries: List[tuple]) -> None:
+        for participant_id, ids in entries:
+            # Запись могла дополниться, пока шла запись в таблицу
+            if self._pending.get(participant_id) == ids:
+                del self._pending[participant_id]
+        self._pending_since = time.monotonic() if self._pending else None
+
+    def should_flush(self) -> bool:
+        if not self._pending:
+            return False
+        return len(self._pending) >= FLUSH_BATCH or time.monotonic() - self._pending_since >= FLUSH_INTERVAL
+
+    def is_active(self, chat_id: Optional[int]) -> bool:
+        return bool(chat_id) and chat_id not in self._inactive
+
+    def mark_inactive(self, chat_ids: Iterable[int]) -> Set[int]:
+        """Помечает чаты неактивными; возвращает те, что были активны."""
+        new = set(chat_ids) - self._inactive
+        if new:
+            self._inactive |= new
+            self._save()
+        return new
+
+    def _save(self) -> None:
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(sorted(self._inactive), f)
+        os.replace(tmp_path, self.path)
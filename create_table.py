@@ -58,7 +58,7 @@ def create_spreadsheet():
         # Добавляем заголовки
         headers = [
             'ID', 'ID_участника', 'ФИО', 'Курс', 'Имя_ребенка', 'Возраст', 'Класс',
-            'Telegram', 'Телефон_ученика', 'ФИО_родителя', 'Телефон_родителя',
+            'Telegram', 'ФИО_родителя', 'Телефон_ученика', 'Телефон_родителя',
             'Баллы', 'Статус', 'Дата_добавления', 'Программа', 'Комментарий',
             'Chat_ID', 'Telegram_ID'
         ]
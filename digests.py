@@ -0,0 +1,280 @@
+"""
+Еженедельные сводки и напоминания участникам по расписанию (JobQueue).
+
+Сводка: баллы, место в рейтинге, лиды на проверке и сколько дней осталось
+до конца конкурса (CAMPAIGN_END_DATE). Напоминание получают участники без
+лидов. Тексты для всех получателей считаются за один проход по снимку таблицы,
+без отдельных запросов к Sheets на участника.
+
+Чтобы не отправлять тысячи сообщений в одну минуту и не писать участникам ночью,
+отправка растягивается:
+
+- получатели перемешиваются и распределяются по окну DIGEST_WINDOW_MINUTES,
+  к каждому времени добавляется случайный сдвиг до DIGEST_JITTER_SECONDS;
+- если окна не хватает при TELEGRAM_MESSAGES_PER_SECOND, оно удлиняется,
+  а каждая отправка проходит через общую квоту throttle.telegram_quota;
+- в тихие часы (QUIET_HOURS, по TIMEZONE) ничего не отправляется: сообщения,
+  попавшие на них, после окончания тихих часов заново распределяются по окну
+  DIGEST_RAMP_MINUTES, а не уходят все разом.
+
+Расписание задается как "mon 10:00" (DIGEST_SCHEDULE, REMINDER_SCHEDULE);
+пустое значение отключает рассылку. Очередь хранится в памяти: неотправленное
+при остановке бота пропадает до следующего запуска по расписанию.
+"""
+
+import os
+import heapq
+import random
+import asyncio
+import logging
+import warnings
+import itertools
+from datetime import date, datetime, time, timedelta
+from typing import Callable, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from telegram.warnings import PTBUserWarning
+
+from chat_registry import is_dead_chat_error
+from program_info import POINTS
+from records import Participant, DEFAULT_STATUS
+from tenants import current_tenant, tenant_job
+from throttle import telegram_quota, TELEGRAM_MESSAGES_PER_SECOND
+
+logger = logging.getLogger(__name__)
+
+TIMEZONE = ZoneInfo(os.getenv('TIMEZONE', 'Europe/Moscow'))
+DIGEST_SCHEDULE = os.getenv('DIGEST_SCHEDULE', 'mon 10:00')
+REMINDER_SCHEDULE = os.getenv('REMINDER_SCHEDULE', 'thu 17:00')
+DIGEST_WINDOW_MINUTES = int(os.getenv('DIGEST_WINDOW_MINUTES', 120))
+DIGEST_JITTER_SECONDS = int(os.getenv('DIGEST_JITTER_SECONDS', 60))
+DIGEST_RAMP_MINUTES = int(os.getenv('DIGEST_RAMP_MINUTES', DIGEST_WINDOW_MINUTES))
+QUIET_HOURS = os.getenv('QUIET_HOURS', '22-9')
+CAMPAIGN_END_DATE = os.getenv('CAMPAIGN_END_DATE')  # 2025-12-20
+
+# Порядок дней как в JobQueue.run_daily: 0 - воскресенье
+WEEKDAYS = ('sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat')
+
+# Сообщение к отправке: (chat_id, текст)
+Message = Tuple[int, str]
+
+
+def parse_schedule(value: str) -> Optional[Tuple[int, time]]:
+    """'mon 10:00' -> (день для run_daily, время в TIMEZONE); None для пустой строки."""
+    if not value.strip():
+        return None
+    day, _, clock = value.strip().lower().partition(' ')
+    hour, _, minute = clock.strip().partition(':')
+    if day not in WEEKDAYS or not hour.isdigit() or not (minute or '0').isdigit():
+        raise ValueError(f"Неверное расписание «{value}», нужно например «mon 10:00»")
+    return WEEKDAYS.index(day), time(int(hour), int(minute or 0), tzinfo=TIMEZONE)
+
+
+def parse_quiet_hours(value: str) -> Optional[Tuple[int, int]]:
+    """'22-9' -> (22, 9); None, если тихих часов нет."""
+    if not value.strip():
+        return None
+    start, _, end = value.partition('-')
+    return int(start) % 24, int(end) % 24
+
+
+def quiet_until(moment: datetime, quiet: Optional[Tuple[int, int]]) -> Optional[datetime]:
+    """Конец тихих часов, если moment в них попадает, иначе None."""
+    if not quiet or quiet[0] == quiet[1]:
+        return None
+    start, end = quiet
+    moment = moment.astimezone(TIMEZONE)
+    overnight = start > end
+    if overnight and not (moment.hour >= start or moment.hour < end):
+        return None
+    if not overnight and not start <= moment.hour < end:
+        return None
+    until = moment.replace(hour=end, minute=0, second=0, microsecond=0)
+    return until if until > moment else until + timedelta(days=1)
+
+
+def days_left(today: date) -> Optional[int]:
+    """Дней до конца конкурса включительно; None, если дата окончания не задана."""
+    if not CAMPAIGN_END_DATE:
+        return None
+    return (date.fromisoformat(CAMPAIGN_END_DATE) - today).days
+
+
+def build_digests(participants: List[Participant], is_reachable: Callable[[Optional[int]], bool],
+                  today: date) -> List[Message]:
+    """Персональные сводки всем участникам, которым можно написать; рейтинг считается один раз."""
+    remaining = days_left(today)
+    ranked = sorted(participants, key=lambda p: -p.points)
+    scored = sum(1 for p in ranked if p.points > 0)
+    messages = []
+    rank = 0
+    previous_points = None
+    for position, participant in enumerate(ranked, start=1):
+        # Одинаковые баллы - одно место: 1, 2, 2, 4
+        if participant.points != previous_points:
+            rank, previous_points = position, participant.points
+        if not is_reachable(participant.chat_id):
+            continue
+        statuses = participant.lead_statuses()
+        text = f"📬 Итоги недели\n\n⭐️ Ваши баллы: {participant.points}\n"
+        if participant.points > 0:
+            text += f"🏆 Место в рейтинге: {rank} из {scored}\n"
+        text += f"👥 Лидов: {len(statuses)}"
+        pending = statuses.count(DEFAULT_STATUS)
+        if pending:
+            text += f", на проверке: {pending}"
+        text += "\n"
+        if remaining is not None:
+            text += f"⏳ До конца конкурса осталось дней: {remaining}\n"
+        messages.append((participant.chat_id, text))
+    return messages
+
+
+def build_reminders(participants: List[Participant], is_reachable: Callable[[Optional[int]], bool],
+                    today: date) -> List[Message]:
+    """Напоминания участникам без лидов."""
+    remaining = days_left(today)
+    text = (
+        "👋 У вас пока нет ни одного лида.\n\n"
+        f"Каждый приведенный ученик приносит до {max(POINTS.values())} баллов. "
+        "Добавить лида можно кнопкой «➕ Добавить лида» или командой /lead."
+    )
+    if remaining is not None:
+        text += f"\n\n⏳ До конца конкурса осталось дней: {remaining}"
+    return [
+        (participant.chat_id, text)
+        for participant in participants
+        if not participant.lead_count and is_reachable(participant.chat_id)
+    ]
+
+
+BUILDERS = {
+    'digest': (DIGEST_SCHEDULE, build_digests),
+    'reminder': (REMINDER_SCHEDULE, build_reminders),
+}
+
+
+def plan_delivery(count: int, start: datetime, window: float = DIGEST_WINDOW_MINUTES * 60,
+                  rate: float = TELEGRAM_MESSAGES_PER_SECOND, jitter: float = DIGEST_JITTER_SECONDS,
+                  rng: random.Random = random) -> List[datetime]:
+    """Время отправки count сообщений: равномерно по окну (не быстрее rate в секунду) плюс jitter."""
+    if not count:
+        return []
+    step = max(window / count, 1 / rate)
+    return [start + timedelta(seconds=position * step + rng.uniform(0, jitter)) for position in range(count)]
+
+
+class DigestScheduler:
+    """Задачи расписания и очередь отправки сводок одного бота."""
+
+    def __init__(self, application, quiet: Optional[Tuple[int, int]] = None):
+        self.application = application
+        self.quiet = quiet if quiet is not None else parse_quiet_hours(QUIET_HOURS)
+        # Куча (время отправки, порядковый номер, вид, chat_id, текст)
+        self._queue: List[Tuple[datetime, int, str, int, str]] = []
+        self._order = itertools.count()
+        self._delivery_job = None
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def schedule(self) -> None:
+        """Ставит еженедельные задачи в JobQueue приложения."""
+        job_queue = self.application.job_queue
+        if job_queue is None:
+            logger.warning("JobQueue is not available (install python-telegram-bot[job-queue]), digests are off")
+            return
+        for kind, (schedule, _) in BUILDERS.items():
+            parsed = parse_schedule(schedule)
+            if parsed is None:
+                continue
+            day, at = parsed
+            with warnings.catch_warnings():
+                # Дни уже в нумерации v20 (0 - воскресенье), предупреждение о ее смене не нужно
+                warnings.simplefilter('ignore', PTBUserWarning)
+                job_queue.run_daily(tenant_job(self._plan), time=at, days=(day,), data=kind, name=f"{kind}_plan")
+            logger.info(f"Scheduled {kind}s on {WEEKDAYS[day]} {at:%H:%M}")
+
+    async def _plan(self, context) -> None:
+        kind = context.job.data
+        await self.plan(kind)
+
+    async def plan(self, kind: str) -> int:
+        """Считает сообщения вида kind по снимку таблицы и ставит их в очередь; возвращает их число."""
+        sheets = current_tenant().sheets
+        now = datetime.now(TIMEZONE)
+        remaining = days_left(now.date())
+        if remaining is not None and remaining < 0:
+            logger.info(f"Campaign is over, skipping {kind}s")
+            return 0
+        participants = await asyncio.to_thread(sheets.get_all_participants)
+        messages = BUILDERS[kind][1](participants, sheets.chat_registry.is_active, now.date())
+        random.shuffle(messages)
+        start = quiet_until(now, self.quiet) or now
+        send_times = plan_delivery(len(messages), start)
+
+        # Неотправленные сообщения прошлого запуска того же вида устарели
+        self._queue = [item for item in self._queue if item[2] != kind]
+        self._queue.extend(
+            (send_at, next(self._order), kind, chat_id, text)
+            for (chat_id, text), send_at in zip(messages, send_times)
+        )
+        heapq.heapify(self._queue)
+        if send_times:
+            logger.info(f"Planned {len(messages)} {kind}s from {send_times[0]:%H:%M} to {send_times[-1]:%H:%M}")
+        self._schedule_delivery()
+        return len(messages)
+
+    def _schedule_delivery(self) -> None:
+        if self._delivery_job is not None:
+            self._delivery_job.schedule_removal()
+            self._delivery_job = None
+        if not self._queue:
+            return
+        now = datetime.now(TIMEZONE)
+        send_at = max(self._queue[0][0], now)
+        resume_at = quiet_until(send_at, self.quiet)
+        if resume_at:
+            self.respread(resume_at)
+            send_at = self._queue[0][0]
+        self._delivery_job = self.application.job_queue.run_once(
+            tenant_job(self._deliver), when=(send_at - now).total_seconds(), name='digest_delivery'
+        )
+
+    def respread(self, start: datetime) -> None:
+        """Сообщения, задержанные до start тихими часами, распределяет по окну DIGEST_RAMP_MINUTES после start."""
+        held = sorted(item for item in self._queue if item[0] < start)
+        if not held:
+            return
+        send_times = plan_delivery(len(held), start, window=DIGEST_RAMP_MINUTES * 60)
+        self._queue = [item for item in self._queue if item[0] >= start] + [
+            (send_at, order, kind, chat_id, text)
+            for (_, order, kind, chat_id, text), send_at in zip(held, send_times)
+        ]
+        heapq.heapify(self._queue)
+        logger.info(f"Quiet hours: {len(held)} messages moved to {send_times[0]:%H:%M}-{send_times[-1]:%H:%M}")
+
+    async def _deliver(self, context) -> None:
+        """Отправляет сообщения, время которых наступило, и планирует следующий запуск."""
+        self._delivery_job = None
+        sent = failed = 0
+        dead_chats = []
+        while self._queue:
+            now = datetime.now(TIMEZONE)
+            if self._queue[0][0] > now or quiet_until(now, self.quiet):
+                break
+            _, _, kind, chat_id, text = heapq.heappop(self._queue)
+            await telegram_quota.wait()
+            try:
+                await context.bot.send_message(chat_id=chat_id, text=text)
+                sent += 1
+            except Exception as e:
+                logger.error(f"Failed to send {kind} to {chat_id}: {e}")
+                failed += 1
+                if is_dead_chat_error(e):
+                    dead_chats.append(chat_id)
+        if dead_chats:
+            await asyncio.to_thread(current_tenant().sheets.mark_chats_inactive, dead_chats)
+        if sent or failed:
+            logger.info(f"Delivered {sent} scheduled messages, {failed} failed, {len(self._queue)} left")
+        self._schedule_delivery()
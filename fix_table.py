@@ -2,105 +2,206 @@
 """
 Скрипт для исправления структуры существующей Google таблицы.
 Используйте этот скрипт, если данные в таблице находятся в неправильных колонках.
+
+Исправление сначала полностью рассчитывается в памяти (diff по ячейкам),
+показывается как отчет (dry-run), а затем применяется несколькими
+пакетными запросами batchUpdate. Если запрос упал посередине, план
+сохраняется в файл и применение можно продолжить с нужного пакета:
+
+    python fix_table.py --dry-run          # только отчет
+    python fix_table.py --yes              # применить без вопроса
+    python fix_table.py --resume 3         # продолжить с пакета №3
 """
 
 import os
+import json
+import argparse
 from dotenv import load_dotenv
 from sheets_handler import GoogleSheetsHandler
+from records import ColumnMap, column_letter
 
 load_dotenv()
 
-def fix_table_structure():
+PLAN_FILE = 'fix_table_plan.json'
+CHUNK_SIZE = 500  # Количество ячеек в одном batchUpdate
+
+
+def fix_row(row: list) -> list:
+    """Возвращает исправленную копию строки (A–R, 18 колонок)."""
+    new_row = list(row[:18]) + [''] * (18 - len(row))
+
+    # Проверяем, есть ли данные о лидах в неправильных колонках
+    # Если в колонке E-L есть числа, возможно это баллы в неправильном месте
+    has_leads_data = any(
+        new_row[col] and str(new_row[col]).isdigit() for col in range(4, 12)
+    )
+    if not has_leads_data:
+        return new_row
+
+    # Убеждаемся, что баллы находятся в колонке L (индекс 11)
+    if new_row[11] and str(new_row[11]).isdigit():
+        return new_row
+
+    # Ищем баллы в других колонках и перемещаем в L
+    for col in range(4, 12):
+        if new_row[col] and str(new_row[col]).isdigit():
+            points = int(new_row[col])
+            if 0 <= points <= 1000:  # Разумный диапазон баллов
+                new_row[11] = str(points)  # Перемещаем в колонку L
+                new_row[col] = ''  # Очищаем старую колонку
+                break
+    return new_row
+
+
+def plan_fixes(values: list) -> list:
+    """
+    Рассчитывает исправления для всей таблицы, ничего не записывая.
+
+    Возвращает список изменений ячеек: {'row', 'col', 'old', 'new'}.
+    Строки, которые не меняются, в план не попадают. Перепутанные подписи
+    I и J старого create_table.py исправляются по данным (ФИО родителя в I).
+    """
+    changes = []
+    if values and ColumnMap.is_legacy_header(values[0]):
+        for col, title in ((8, 'ФИО_родителя'), (9, 'Телефон_ученика')):
+            changes.append({'row': 1, 'col': col, 'old': values[0][col], 'new': title})
+    for i, row in enumerate(values[1:], start=2):
+        new_row = fix_row(row)
+        for col, new_value in enumerate(new_row):
+            old_value = row[col] if col < len(row) else ''
+            if str(old_value) != str(new_value):
+                changes.append({'row': i, 'col': col, 'old': old_value, 'new': new_value})
+    return changes
+
+
+def print_report(changes: list) -> None:
+    """Печатает отчет о планируемых изменениях."""
+    if not changes:
+        print("Исправления не требуются")
+        return
+    rows = sorted({change['row'] for change in changes})
+    print(f"Будет изменено {len(changes)} ячеек в {len(rows)} строках:")
+    for change in changes:
+        cell = f"{column_letter(change['col'])}{change['row']}"
+        print(f"  {cell}: {change['old']!r} -> {change['new']!r}")
+
+
+def build_chunks(changes: list, sheet_range=lambda a1: a1, chunk_size: int = CHUNK_SIZE) -> list:
+    """
+    Разбивает изменения на пакеты для values().batchUpdate.
+
+    sheet_range добавляет к адресу ячейки лист (GoogleSheetsHandler.sheet_range).
+    """
+    data = [
+        {
+            'range': sheet_range(f"{column_letter(change['col'])}{change['row']}"),
+            'values': [[change['new']]]
+        }
+        for change in changes
+    ]
+    return [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+
+
+def save_plan(chunks: list) -> None:
+    with open(PLAN_FILE, 'w', encoding='utf-8') as f:
+        json.dump(chunks, f, ensure_ascii=False)
+
+
+def load_plan() -> list:
+    with open(PLAN_FILE, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def apply_chunks(sheets_handler: GoogleSheetsHandler, chunks: list, start_chunk: int = 0) -> bool:
+    """
+    Применяет пакеты по порядку, начиная с start_chunk.
+
+    start_chunk отсчитывается с нуля. При ошибке печатает номер пакета
+    (с единицы), с которого нужно продолжить, и возвращает False.
+    """
+    total = len(chunks)
+    for number in range(start_chunk, total):
+        try:
+            sheets_handler.service.spreadsheets().values().batchUpdate(
+                spreadsheetId=sheets_handler.spreadsheet_id,
+                body={'valueInputOption': 'RAW', 'data': chunks[number]}
+            ).execute()
+        except Exception as e:
+            print(f"Ошибка в пакете {number + 1}/{total}: {e}")
+            print(f"Для продолжения запустите: python fix_table.py --resume {number + 1}")
+            return False
+        print(f"  Пакет {number + 1}/{total} применен ({len(chunks[number])} ячеек)")
+    return True
+
+
+def fix_table_structure(dry_run: bool = False, assume_yes: bool = False, resume_from: int | None = None):
     """Исправляет структуру таблицы, перемещая данные в правильные колонки."""
-    
+
     # Инициализация Google Sheets
     sheets_handler = GoogleSheetsHandler(
         credentials_path='credentials.json',
         spreadsheet_id=os.getenv('SPREADSHEET_ID')
     )
-    
+
+    if resume_from is not None:
+        if not os.path.exists(PLAN_FILE):
+            print(f"Файл плана {PLAN_FILE} не найден, продолжать нечего")
+            return
+        chunks = load_plan()
+        print(f"Продолжение с пакета {resume_from}/{len(chunks)}")
+        if apply_chunks(sheets_handler, chunks, max(resume_from, 1) - 1):
+            os.remove(PLAN_FILE)
+            print("Структура таблицы исправлена!")
+        return
+
     try:
         # Получаем все данные из таблицы
         result = sheets_handler.service.spreadsheets().values().get(
             spreadsheetId=sheets_handler.spreadsheet_id,
-            range='A:R'
+            range=sheets_handler.sheet_range('A:R')
         ).execute()
-        
-        values = result.get('values', [])
-        print(f"Найдено {len(values)} строк в таблице")
-        
-        if len(values) < 2:
-            print("Таблица пуста или содержит только заголовки")
+    except Exception as e:
+        print(f"Ошибка при чтении таблицы: {e}")
+        return
+
+    values = result.get('values', [])
+    print(f"Найдено {len(values)} строк в таблице")
+
+    if len(values) < 2:
+        print("Таблица пуста или содержит только заголовки")
+        return
+
+    changes = plan_fixes(values)
+    print_report(changes)
+    if not changes or dry_run:
+        return
+
+    if not assume_yes:
+        response = input("Применить изменения? (y/n): ")
+        if response.lower() not in ['y', 'yes', 'да']:
+            print("Операция отменена")
             return
-        
-        # Обрабатываем каждую строку (пропускаем заголовки)
-        for i, row in enumerate(values[1:], start=2):
-            if len(row) < 18:
-                # Дополняем строку до 18 колонок
-                row += [''] * (18 - len(row))
-            
-            # Проверяем, есть ли данные о лидах в неправильных колонках
-            # Ищем данные о лидах в колонках, где они не должны быть
-            has_leads_data = False
-            for col in range(4, 12):  # Колонки E-L
-                if col < len(row) and row[col] and str(row[col]).isdigit():
-                    # Если в колонке E-L есть числа, возможно это баллы в неправильном месте
-                    has_leads_data = True
-                    break
-            
-            if has_leads_data:
-                print(f"Строка {i}: обнаружены данные в неправильных колонках")
-                
-                # Перемещаем данные в правильные колонки
-                # Создаем новую структуру строки
-                new_row = [''] * 18
-                
-                # Копируем основные данные
-                for j in range(min(len(row), 18)):
-                    new_row[j] = row[j]
-                
-                # Убеждаемся, что баллы находятся в колонке L (индекс 11)
-                if len(new_row) > 11 and new_row[11] and str(new_row[11]).isdigit():
-                    # Баллы уже в правильном месте
-                    pass
-                else:
-                    # Ищем баллы в других колонках и перемещаем в L
-                    for col in range(4, 12):
-                        if col < len(new_row) and new_row[col] and str(new_row[col]).isdigit():
-                            try:
-                                points = int(new_row[col])
-                                if 0 <= points <= 1000:  # Разумный диапазон баллов
-                                    new_row[11] = str(points)  # Перемещаем в колонку L
-                                    new_row[col] = ''  # Очищаем старую колонку
-                                    print(f"  Перемещено {points} баллов в колонку L")
-                                    break
-                            except ValueError:
-                                continue
-                
-                # Обновляем строку в таблице
-                sheets_handler.service.spreadsheets().values().update(
-                    spreadsheetId=sheets_handler.spreadsheet_id,
-                    range=f'A{i}:R{i}',
-                    valueInputOption='RAW',
-                    body={'values': [new_row]}
-                ).execute()
-                print(f"  Строка {i} исправлена")
-        
+
+    chunks = build_chunks(changes, sheets_handler.sheet_range)
+    save_plan(chunks)
+    print(f"Применение {len(chunks)} пакетов...")
+    if apply_chunks(sheets_handler, chunks):
+        os.remove(PLAN_FILE)
         print("Структура таблицы исправлена!")
-        
-    except Exception as e:
-        print(f"Ошибка при исправлении таблицы: {e}")
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Исправление структуры Google таблицы")
+    parser.add_argument('--dry-run', action='store_true', help="только показать отчет, ничего не записывать")
+    parser.add_argument('--yes', action='store_true', help="применить без подтверждения")
+    parser.add_argument('--resume', type=int, metavar='N', help=f"продолжить применение из {PLAN_FILE} с пакета N (нумерация с 1)")
+    args = parser.parse_args()
+
     print("Скрипт для исправления структуры Google таблицы")
     print("Убедитесь, что у вас есть:")
     print("1. Файл .env с SPREADSHEET_ID")
     print("2. Файл credentials.json для Google Sheets API")
     print("3. Доступ к таблице для Service Account")
     print()
-    
-    response = input("Продолжить? (y/n): ")
-    if response.lower() in ['y', 'yes', 'да']:
-        fix_table_structure()
-    else:
-        print("Операция отменена")
+
+    fix_table_structure(dry_run=args.dry_run, assume_yes=args.yes, resume_from=args.resume)
@@ -0,0 +1,111 @@
+"""
+Локальный HTTP-эндпоинт состояния бота.
+
+    GET /healthz - liveness: процесс жив и цикл событий отвечает (всегда 200)
+    GET /readyz  - readiness: прогрев завершен и таблица доступна (200 или 503)
+    GET /metrics - счетчики по ботам процесса и логирования (JSON)
+
+Проверка таблицы та же, что в test_connection.py. Ее результат кэшируется
+на READY_CHECK_TTL секунд, чтобы частые опросы не расходовали квоту Sheets API.
+Сервер слушает только localhost (HEALTH_HOST/HEALTH_PORT в .env).
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+HEALTH_HOST = os.getenv('HEALTH_HOST', '127.0.0.1')
+HEALTH_PORT = int(os.getenv('HEALTH_PORT', 8080))
+READY_CHECK_TTL = 30
+
+STATUS_TEXT = {200: 'OK', 404: 'Not Found', 503: 'Service Unavailable'}
+
+
+class HealthServer:
+    def __init__(self, check: Callable[[], str], host: str = HEALTH_HOST, port: int = HEALTH_PORT,
+                 metrics: Optional[Callable[[], Dict[str, Any]]] = None):
+        # check() выполняется в потоке: возвращает описание или бросает исключение
+        self.check = check
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.started_at = time.time()
+        self.warmup: Optional[Dict[str, Any]] = None
+        self.warmup_error: Optional[str] = None
+        self._last_check: Optional[tuple] = None  # (время, ok, описание)
+        self._server: Optional[asyncio.Server] = None
+
+    @property
+    def running(self) -> bool:
+        return self._server is not None
+
+    def warmed_up(self, timings: Dict[str, Any]) -> None:
+        self.warmup = timings
+        self.warmup_error = None
+
+    def warmup_failed(self, error: Exception) -> None:
+        self.warmup_error = str(error)
+
+    async def _check_sheets(self) -> tuple:
+        now = time.monotonic()
+        if self._last_check is None or now - self._last_check[0] > READY_CHECK_TTL:
+            try:
+                detail = await asyncio.to_thread(self.check)
+                self._last_check = (now, True, detail)
+            except Exception as e:
+                logger.warning(f"Readiness check failed: {e}")
+                self._last_check = (now, False, str(e))
+        return self._last_check[1], self._last_check[2]
+
+    async def readiness(self) -> tuple:
+        body: Dict[str, Any] = {'warmup': self.warmup}
+        if self.warmup is None:
+            body['status'] = 'warming_up' if self.warmup_error is None else 'warmup_failed'
+            if self.warmup_error:
+                body['error'] = self.warmup_error
+            return 503, body
+        ok, detail = await self._check_sheets()
+        body['status'] = 'ready' if ok else 'sheets_unavailable'
+        body['sheets'] = detail
+        return (200 if ok else 503), body
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            parts = request_line.decode('latin-1').split()
+            path = parts[1] if len(parts) > 1 else ''
+            if path == '/healthz':
+                status, body = 200, {'status': 'alive', 'uptime_s': round(time.time() - self.started_at)}
+            elif path == '/readyz':
+                status, body = await self.readiness()
+            elif path == '/metrics' and self.metrics is not None:
+                status, body = 200, self.metrics()
+            else:
+                status, body = 404, {'status': 'not_found'}
+            payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+            writer.write(
+                f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+                f"Content-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                f"Connection: close\r\n\r\n".encode('latin-1') + payload
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError) as e:
+            logger.debug(f"Health request dropped: {e}")
+        finally:
+            writer.close()
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"Health endpoint on http://{self.host}:{self.port}/healthz, /readyz")
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
@@ -0,0 +1,136 @@
+"""
+Идемпотентная обработка регистраций и лидов.
+
+Telegram повторно доставляет апдейт, если бот не ответил вовремя, а
+пользователи нажимают и отправляют дважды. Без защиты process_registration
+дважды вызвал бы add_participant, а завершение анкеты лида - add_lead.
+
+Перед обращением к таблице обработчик занимает ключи отправки:
+
+- ('update', ID бота, update_id) - повторная доставка того же апдейта;
+- ('message', ID бота, chat_id, message_id) - то же сообщение в другом апдейте;
+- ('content', ID бота, user_id, вид, хэш содержимого) - то же содержимое
+  повторной отправкой.
+
+Если хотя бы один ключ уже занят, отправка - дубликат: она либо еще
+выполняется (PENDING), либо уже выполнена (DONE) и не доходит до Sheets.
+Ключи хранятся в памяти IDEMPOTENCY_TTL секунд, не больше IDEMPOTENCY_MAX_KEYS
+(старые вытесняются первыми); в кэше только хэши, без персональных данных.
+Отправка, завершившаяся ошибкой, освобождает ключи, и ее можно повторить.
+"""
+
+import os
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Hashable, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_TTL = int(os.getenv('IDEMPOTENCY_TTL', 10 * 60))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv('IDEMPOTENCY_MAX_KEYS', 20000))
+
+PENDING = 'pending'
+DONE = 'done'
+
+
+class IdempotencyCache:
+    """Ключ -> (истекает, состояние) с TTL и ограничением размера."""
+
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL, max_keys: int = IDEMPOTENCY_MAX_KEYS):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self._keys: 'OrderedDict[Hashable, Tuple[float, str]]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def _evict(self, now: float) -> None:
+        # Ключи упорядочены по времени истечения: TTL у всех одинаковый
+        while self._keys:
+            key, (expires_at, _) = next(iter(self._keys.items()))
+            if expires_at > now and len(self._keys) <= self.max_keys:
+                break
+            del self._keys[key]
+
+    def state(self, keys: List[Hashable]) -> Optional[str]:
+        """Состояние отправки с этими ключами: DONE, PENDING или None, если ее не было."""
+        now = time.monotonic()
+        self._evict(now)
+        states = {self._keys[key][1] for key in keys if key in self._keys}
+        if DONE in states:
+            return DONE
+        return PENDING if states else None
+
+    def set(self, keys: List[Hashable], state: str) -> None:
+        expires_at = time.monotonic() + self.ttl
+        for key in keys:
+            self._keys.pop(key, None)
+            self._keys[key] = (expires_at, state)
+        self._evict(time.monotonic())
+
+    def release(self, keys: List[Hashable]) -> None:
+        for key in keys:
+            self._keys.pop(key, None)
+
+
+submissions = IdempotencyCache()
+
+
+def content_hash(*parts: Any) -> str:
+    """Хэш нормализованного содержимого: регистр и лишние пробелы не различаются."""
+    normalized = '\x1f'.join(' '.join(str(part).split()).lower() for part in parts)
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()[:32]
+
+
+def submission_keys(update: Update, context: ContextTypes.DEFAULT_TYPE, kind: str, *content: Any) -> List[Tuple]:
+    bot_id = context.bot.id
+    keys = [('update', bot_id, update.update_id)]
+    message = update.effective_message
+    if message:
+        keys.append(('message', bot_id, message.chat_id, message.message_id))
+    keys.append(('content', bot_id, update.effective_user.id, kind, content_hash(*content)))
+    return keys
+
+
+class Submission:
+    """Занятая отправка; duplicate - состояние уже выполненной или выполняющейся копии."""
+
+    def __init__(self, keys: List[Tuple], duplicate: Optional[str]):
+        self.keys = keys
+        self.duplicate = duplicate
+        self.completed = False
+
+    def done(self) -> None:
+        """Отмечает отправку выполненной: копии в течение TTL будут отклонены."""
+        self.completed = True
+
+
+@contextmanager
+def claim(update: Update, context: ContextTypes.DEFAULT_TYPE, kind: str, *content: Any):
+    """
+    Занимает ключи отправки на время обработки.
+
+    Если отправка дубликат, ключи не занимаются и submission.duplicate задан.
+    Ключи остаются занятыми, только если обработчик вызвал submission.done().
+    """
+    keys = submission_keys(update, context, kind, *content)
+    duplicate = submissions.state(keys)
+    submission = Submission(keys, duplicate)
+    if duplicate:
+        logger.info(f"Duplicate {kind} submission ({duplicate}) from user {update.effective_user.id}")
+        yield submission
+        return
+    submissions.set(keys, PENDING)
+    try:
+        yield submission
+    finally:
+        if submission.completed:
+            submissions.set(keys, DONE)
+        else:
+            submissions.release(keys)
@@ -0,0 +1,148 @@
+"""
+Добавление лида одним сообщением.
+
+Вместо шести шагов диалога участник отправляет /lead и анкету в том же
+сообщении:
+
+    /lead
+    ФИО ученика: Иванов Иван Иванович
+    Возраст: 14
+    Класс: 8
+    Telegram: @ivanov (или нет)
+    Телефон ученика: +79991234567
+    ФИО родителя: Иванова Мария Петровна
+    Телефон родителя: 89997654321
+
+Строка "Программа: Кэмп/ДО или Колледж" необязательна: по умолчанию программа
+определяется по классу. Анкета проверяется целиком, ошибки возвращаются
+по каждому полю сразу.
+"""
+
+import re
+from typing import Dict, List, Tuple
+
+from lead_index import normalize_phone
+
+LEAD_TEMPLATE = (
+    "ФИО ученика: Иванов Иван Иванович\n"
+    "Возраст: 14\n"
+    "Класс: 8\n"
+    "Telegram: @ivanov\n"
+    "Телефон ученика: +79991234567\n"
+    "ФИО родителя: Иванова Мария Петровна\n"
+    "Телефон родителя: 89997654321"
+)
+
+# Подпись строки анкеты (в нижнем регистре) -> поле лида
+LABELS = {
+    'фио ученика': 'child_name',
+    'ученик': 'child_name',
+    'возраст': 'age',
+    'класс': 'grade',
+    'telegram': 'telegram',
+    'телеграм': 'telegram',
+    'username': 'telegram',
+    'телефон ученика': 'phone',
+    'фио родителя': 'parent_name',
+    'родитель': 'parent_name',
+    'телефон родителя': 'parent_phone',
+    'программа': 'program_type',
+}
+
+FIELD_TITLES = {
+    'child_name': 'ФИО ученика',
+    'age': 'Возраст',
+    'grade': 'Класс',
+    'telegram': 'Telegram',
+    'phone': 'Телефон ученика',
+    'parent_name': 'ФИО родителя',
+    'parent_phone': 'Телефон родителя',
+    'program_type': 'Программа',
+}
+# Допустимые возраст и класс ученика; те же границы проверяет пошаговый диалог /add
+MIN_AGE, MAX_AGE = 7, 18
+MIN_GRADE, MAX_GRADE = 4, 9
+
+REQUIRED_FIELDS = ('child_name', 'age', 'grade', 'telegram', 'phone', 'parent_name', 'parent_phone')
+
+LINE_RE = re.compile(r'^\s*([^:]+?)\s*:\s*(.*?)\s*$')
+
+
+def _program_type(value: str, grade: int | None) -> str | None:
+    value = value.lower()
+    if not value:
+        return 'lead_college' if grade == 9 else 'lead_camp_do'
+    if 'колледж' in value:
+        return 'lead_college'
+    if 'кэмп' in value or 'кемп' in value or 'до' in value.split('/'):
+        return 'lead_camp_do'
+    return None
+
+
+def parse_lead_form(text: str) -> Tuple[Dict[str, object], List[str]]:
+    """
+    Разбирает анкету лида.
+
+    Возвращает (lead_data в формате add_lead, список ошибок по полям).
+    Лид можно сохранять только при пустом списке ошибок.
+    """
+    raw: Dict[str, str] = {}
+    errors: List[str] = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        match = LINE_RE.match(line)
+        field = LABELS.get(match.group(1).lower()) if match else None
+        if field is None:
+            errors.append(f"Непонятная строка «{line.strip()}»")
+            continue
+        raw[field] = match.group(2)
+
+    lead_data: Dict[str, object] = {}
+    for field in REQUIRED_FIELDS:
+        if not raw.get(field):
+            errors.append(f"{FIELD_TITLES[field]}: не заполнено")
+
+    if raw.get('child_name'):
+        lead_data['child_name'] = raw['child_name']
+    if raw.get('parent_name'):
+        lead_data['parent_name'] = raw['parent_name']
+
+    if raw.get('age'):
+        if raw['age'].isdigit() and MIN_AGE <= int(raw['age']) <= MAX_AGE:
+            lead_data['age'] = int(raw['age'])
+        else:
+            errors.append(f"Возраст: нужно число от {MIN_AGE} до {MAX_AGE}, а не «{raw['age']}»")
+
+    grade = None
+    if raw.get('grade'):
+        if raw['grade'].isdigit() and MIN_GRADE <= int(raw['grade']) <= MAX_GRADE:
+            grade = int(raw['grade'])
+            lead_data['grade'] = grade
+        else:
+            errors.append(f"Класс: нужно число от {MIN_GRADE} до {MAX_GRADE}, а не «{raw['grade']}»")
+
+    if raw.get('telegram'):
+        username = raw['telegram']
+        if username.lower() == 'нет':
+            lead_data['telegram'] = "Не указан"
+        elif re.fullmatch(r'@?[A-Za-z0-9_]{5,32}', username):
+            lead_data['telegram'] = '@' + username.lstrip('@')
+        else:
+            errors.append(f"Telegram: username из латиницы, цифр и _ (5–32 символа) или «нет», а не «{username}»")
+
+    for field in ('phone', 'parent_phone'):
+        if raw.get(field):
+            phone = normalize_phone(raw[field])
+            if phone:
+                lead_data[field] = phone
+            else:
+                errors.append(f"{FIELD_TITLES[field]}: нужен номер +7XXXXXXXXXX или 8XXXXXXXXXX, а не «{raw[field]}»")
+
+    program_type = _program_type(raw.get('program_type', ''), grade)
+    if program_type:
+        lead_data['program_type'] = program_type
+    else:
+        errors.append(f"Программа: «Кэмп/ДО» или «Колледж», а не «{raw['program_type']}»")
+
+    return lead_data, errors
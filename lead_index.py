@@ -0,0 +1,92 @@
+"""
+Индекс лидов для быстрого поиска дубликатов.
+
+Хранит соответствие нормализованных телефонов ученика и родителя и
+username в Telegram -> (ID участника, номер лида в ячейке). Индекс строится
+один раз по снимку таблицы и дополняется при каждом добавлении лида, поэтому
+проверка на дубликат не требует разбора колонок E–K всех строк.
+"""
+
+from typing import Dict, Any, Iterable, List, Tuple, Optional
+
+from records import Participant
+
+NO_USERNAME = {'', 'не указан', 'нет'}
+
+
+def normalize_phone(phone: str) -> str | None:
+    """Приводит номер к виду +7XXXXXXXXXX. Возвращает None для некорректного номера."""
+    digits = ''.join(filter(str.isdigit, str(phone)))
+    if len(digits) == 11 and digits[0] in '78':
+        return '+7' + digits[1:]
+    if len(digits) == 10 and digits[0] == '9':
+        return '+7' + digits
+    return None
+
+
+def normalize_username(username: str) -> str | None:
+    """Приводит username к нижнему регистру без @. Возвращает None, если username не указан."""
+    username = str(username).strip().lstrip('@').lower()
+    if username in NO_USERNAME:
+        return None
+    return username
+
+
+class LeadIndex:
+    """Глобальный индекс контактов лидов -> владелец лида."""
+
+    def __init__(self):
+        # ключ ('phone' | 'parent_phone' | 'telegram', значение) -> (ID участника, номер лида)
+        self._owners: Dict[Tuple[str, str], Tuple[str, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._owners)
+
+    @staticmethod
+    def _keys(telegram: str, phone: str, parent_phone: str) -> List[Tuple[str, str]]:
+        keys = []
+        username = normalize_username(telegram)
+        if username:
+            keys.append(('telegram', username))
+        phone = normalize_phone(phone)
+        if phone:
+            keys.append(('phone', phone))
+        parent_phone = normalize_phone(parent_phone)
+        if parent_phone:
+            keys.append(('parent_phone', parent_phone))
+        return keys
+
+    def rebuild(self, participants: Iterable[Participant]) -> None:
+        """Перестраивает индекс по участникам снимка."""
+        self._owners.clear()
+        for participant in participants:
+            if not participant.lead_count:
+                continue
+            columns = zip(participant.lead_values('telegram'), participant.lead_values('phone'),
+                          participant.lead_values('parent_phone'))
+            for number, (telegram, phone, parent_phone) in enumerate(columns):
+                for key in self._keys(telegram, phone, parent_phone):
+                    self._owners.setdefault(key, (str(participant.participant_id), number))
+
+    def add(self, participant_id: int, lead_number: int, lead_data: Dict[str, Any]) -> None:
+        """Добавляет в индекс только что записанного лида."""
+        keys = self._keys(lead_data.get('telegram', ''), lead_data.get('phone', ''),
+                          lead_data.get('parent_phone', ''))
+        for key in keys:
+            self._owners.setdefault(key, (str(participant_id), lead_number))
+
+    def find_duplicate(self, lead_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Ищет уже записанного лида с тем же телефоном или username.
+
+        Возвращает словарь {'field', 'participant_id', 'lead_number'} или None.
+        Телефон ученика и username проверяются раньше телефона родителя:
+        совпадение только по родителю обычно означает брата или сестру.
+        """
+        keys = self._keys(lead_data.get('telegram', ''), lead_data.get('phone', ''),
+                          lead_data.get('parent_phone', ''))
+        for field, value in keys:
+            owner = self._owners.get((field, value))
+            if owner is not None:
+                return {'field': field, 'participant_id': owner[0], 'lead_number': owner[1]}
+        return None
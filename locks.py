@@ -0,0 +1,108 @@
+"""
+Блокировки для параллельной обработки апдейтов.
+
+Бот обрабатывает апдейты разных пользователей параллельно (PerUserUpdateProcessor),
+а апдейты одного пользователя - по очереди: ConversationHandler хранит состояние
+разговора и не рассчитан на то, что два апдейта одного пользователя (части
+альбома, двойное нажатие) выполняются одновременно.
+
+Операции чтение-изменение-запись над таблицей сериализуются. У каждого бота
+(Tenant в tenants.py) свои блокировки:
+
+- participant_locks - по ID участника: лиды одного участника пишутся в одну
+  и ту же строку (упакованные ячейки E–K, O), и два лида подряд не должны
+  затереть друг друга. Строка участника одна, так что это и блокировка строки;
+  модерация держит замки всех участников из решений (hold_all);
+- registration_lock - общий на таблицу: выдача нового ID (максимум + 1) и
+  добавление строки в конец листа, а также восстановление из архива и смена сезона.
+
+Записи разных участников выполняются параллельно.
+"""
+
+import sys
+import asyncio
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Any, Awaitable, Dict, Hashable, Iterable, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class KeyedLocks:
+    """asyncio.Lock на ключ; замок удаляется, когда его никто не ждет."""
+
+    def __init__(self):
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+        self._waiters: Dict[Hashable, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable):
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+                del self._locks[key]
+
+    @asynccontextmanager
+    async def hold_all(self, keys: Iterable[Hashable]):
+        """Замки нескольких ключей; берутся по возрастанию, чтобы два вызова не ждали друг друга."""
+        async with AsyncExitStack() as stack:
+            for key in sorted(set(keys)):
+                await stack.enter_async_context(self.hold(key))
+            yield
+
+
+
+def update_key(update: object) -> Optional[Hashable]:
+    """Ключ очереди апдейта: пользователь, а без него - чат; None - ограничений нет."""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user is not None:
+        return 'user', update.effective_user.id
+    if update.effective_chat is not None:
+        return 'chat', update.effective_chat.id
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Апдейты одного пользователя (или чата) - по очереди, разных - параллельно.
+
+    Не больше max_concurrent_updates апдейтов выполняются одновременно; апдейт,
+    ждущий предыдущего апдейта того же пользователя, место не занимает.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        self._limit = max_concurrent_updates
+        # Семафор базового класса не ограничивает: он бы считал и апдейты, ждущие своей очереди
+        super().__init__(sys.maxsize)
+        self._running = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._queues = KeyedLocks()
+
+    @property
+    def max_concurrent_updates(self) -> int:
+        return self._limit
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = update_key(update)
+        if key is None:
+            async with self._running:
+                await coroutine
+            return
+        async with self._queues.hold(key):
+            async with self._running:
+                await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -0,0 +1,195 @@
+"""
+Неблокирующее структурированное логирование.
+
+Обработчики Telegram только кладут записи в очередь (QueueHandler), а запись
+на диск и в консоль выполняет фоновый поток (QueueListener). Каждая запись -
+одна JSON-строка с tenant, update_id, user_id, handler и latency_ms, если они известны.
+Файл журнала ротируется по размеру. Частые события (например, время обработки
+каждого апдейта) помечаются extra={'sample': True} и прореживаются по уровню.
+Если писатель не успевает и очередь заполнена (LOG_QUEUE_SIZE), новые записи
+отбрасываются без ожидания; их число отдается в /metrics (log_stats).
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import contextvars
+from functools import wraps
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOG_FILE = os.getenv('LOG_FILE', 'logs/bot.log')
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', 5))
+LOG_QUEUE_SIZE = 10000
+
+# Доля сохраняемых частых событий по уровням; предупреждения и ошибки не прореживаются
+SAMPLE_RATES = {
+    logging.DEBUG: float(os.getenv('LOG_SAMPLE_DEBUG', 0.01)),
+    logging.INFO: float(os.getenv('LOG_SAMPLE_INFO', 0.1)),
+}
+
+# Контекст текущего апдейта; задается обертками из instrument_handlers
+update_id_var = contextvars.ContextVar('update_id', default=None)
+user_id_var = contextvars.ContextVar('user_id', default=None)
+handler_var = contextvars.ContextVar('handler', default=None)
+# Имя бота в многоботовом режиме; задается в tenants.py
+tenant_var = contextvars.ContextVar('tenant', default=None)
+
+CONTEXT_FIELDS = ('tenant', 'update_id', 'user_id', 'handler', 'latency_ms')
+
+logger = logging.getLogger(__name__)
+_listener = None
+_queue_handler = None
+
+
+class ContextFilter(logging.Filter):
+    """Дописывает в запись поля текущего апдейта."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        for name, var in (('tenant', tenant_var), ('update_id', update_id_var), ('user_id', user_id_var),
+                          ('handler', handler_var)):
+            if getattr(record, name, None) is None:
+                setattr(record, name, var.get())
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Прореживает записи с extra={'sample': True} согласно SAMPLE_RATES."""
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, 'sample', False):
+            return True
+        return random.random() < self.rates.get(record.levelno, 1.0)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler, который при заполненной очереди отбрасывает запись вместо traceback в stderr."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for name in CONTEXT_FIELDS:
+            value = getattr(record, name, None)
+            if value is not None:
+                entry[name] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def setup_logging(level: int = logging.INFO) -> None:
+    """Направляет все логирование через очередь с фоновым писателем."""
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+
+    formatter = JsonFormatter()
+    targets = []
+    log_dir = os.path.dirname(LOG_FILE)
+    if log_dir:
+        os.makedirs(log_dir, exist_ok=True)
+    file_handler = RotatingFileHandler(
+        LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8'
+    )
+    targets.append(file_handler)
+    targets.append(logging.StreamHandler(sys.stderr))
+    for target in targets:
+        target.setFormatter(formatter)
+
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    queue_handler = _queue_handler = DroppingQueueHandler(log_queue)
+    # Фильтры работают в потоке обработчика, чтобы захватить contextvars и не ставить в очередь лишнее
+    queue_handler.addFilter(SamplingFilter(SAMPLE_RATES))
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    # httpx логирует каждый запрос к Telegram API на INFO
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    _listener = QueueListener(log_queue, *targets, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def log_stats() -> dict:
+    """Счетчики логирования процесса для /metrics."""
+    return {'dropped_records': _queue_handler.dropped if _queue_handler is not None else 0}
+
+
+def walk_handlers(handlers):
+    """Обработчики списка, включая вложенные в ConversationHandler."""
+    from telegram.ext import ConversationHandler
+
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            yield from walk_handlers(handler.entry_points)
+            for state_handlers in handler.states.values():
+                yield from walk_handlers(state_handlers)
+            yield from walk_handlers(handler.fallbacks)
+        else:
+            yield handler
+
+
+def iter_handlers(application):
+    """Все обработчики приложения, включая вложенные в ConversationHandler."""
+    for group in application.handlers.values():
+        yield from walk_handlers(group)
+
+
+def wrap_callbacks(application, wrapper) -> None:
+    """Оборачивает callback каждого обработчика; wrapper(callback) -> новый callback."""
+    for handler in iter_handlers(application):
+        handler.callback = wrapper(handler.callback)
+
+
+def _log_context(callback):
+    @wraps(callback)
+    async def wrapped(update, context, *args, **kwargs):
+        tokens = [
+            update_id_var.set(getattr(update, 'update_id', None)),
+            user_id_var.set(update.effective_user.id if getattr(update, 'effective_user', None) else None),
+            handler_var.set(callback.__name__),
+        ]
+        started = time.perf_counter()
+        try:
+            return await callback(update, context, *args, **kwargs)
+        finally:
+            latency_ms = round((time.perf_counter() - started) * 1000, 1)
+            logger.info("handled", extra={'latency_ms': latency_ms, 'sample': True})
+            for var, token in zip((update_id_var, user_id_var, handler_var), tokens):
+                var.reset(token)
+    return wrapped
+
+
+def instrument_handlers(application) -> None:
+    """Проставляет контекст апдейта и логирует время каждого обработчика."""
+    wrap_callbacks(application, _log_context)
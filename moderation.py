@@ -0,0 +1,128 @@
+"""
+Модерация лидов: очередь непроверенных лидов и начисление баллов.
+
+Статусы лидов хранятся в колонке M через перенос строки, по одному на лида
+(см. Participant.lead_statuses). Баллы (L) меняются на разницу по правилам
+POINTS: одобренный лид добавляет баллы своей программы, отмена одобрения
+их снимает. Баллы, добавленные администратором вручную сверх правил,
+сохраняются.
+
+Решения копятся в сессии модерации и записываются одним batchUpdate.
+Решения можно прислать и CSV-файлом, по строке на лида:
+
+    participant_id,lead,decision
+    1001,1,approve
+    1001,2,reject
+
+lead - номер лида участника начиная с 1; decision - approve/reject
+(или одобрить/отклонить, +/-).
+"""
+
+import csv
+import io
+from typing import Dict, List, Tuple
+
+from campaign_stats import PROGRAM_TITLES
+from program_info import POINTS
+from records import Lead, Participant, DEFAULT_STATUS, STATUS_APPROVED, STATUS_REJECTED
+
+# (ID участника, номер лида с 0) -> новый статус
+Decisions = Dict[Tuple[int, int], str]
+
+DECISION_WORDS = {
+    'approve': STATUS_APPROVED,
+    'approved': STATUS_APPROVED,
+    'одобрить': STATUS_APPROVED,
+    STATUS_APPROVED.lower(): STATUS_APPROVED,
+    '+': STATUS_APPROVED,
+    'reject': STATUS_REJECTED,
+    'rejected': STATUS_REJECTED,
+    'отклонить': STATUS_REJECTED,
+    STATUS_REJECTED.lower(): STATUS_REJECTED,
+    '-': STATUS_REJECTED,
+}
+
+STATUS_ICONS = {STATUS_APPROVED: '✅', STATUS_REJECTED: '❌', DEFAULT_STATUS: '⏳'}
+
+
+def lead_program(lead: Lead) -> str:
+    """Программа лида; у старых лидов без колонки O - по классу."""
+    if lead.program_type in POINTS:
+        return lead.program_type
+    return 'lead_college' if str(lead.grade).strip() == '9' else 'lead_camp_do'
+
+
+def lead_points(lead: Lead) -> int:
+    return POINTS[lead_program(lead)]
+
+
+def pending_leads(participants: List[Participant]) -> List[Tuple[Participant, Lead]]:
+    """Лиды со статусом «На проверке» в порядке строк таблицы."""
+    return [
+        (participant, lead)
+        for participant in participants if participant.lead_count
+        for lead in participant.leads if lead.status == DEFAULT_STATUS
+    ]
+
+
+def format_pending_lead(participant: Participant, lead: Lead) -> str:
+    program = lead_program(lead)
+    return (
+        f"{lead.child_name}, {lead.grade} кл., {PROGRAM_TITLES[program]} (+{POINTS[program]}) — "
+        f"{participant.full_name} (ID {participant.participant_id}, лид {lead.number + 1})"
+    )
+
+
+def apply_decisions(participant: Participant, decisions: Dict[int, str]) -> Tuple[str, int, Dict[str, int]]:
+    """
+    Новые статусы и баллы участника по решениям для его лидов.
+
+    Возвращает (упакованные статусы для M, новые баллы для L, счетчики
+    approved/rejected). Номера лидов вне диапазона пропускаются.
+    """
+    statuses = participant.lead_statuses()
+    leads = participant.leads
+    points = participant.points
+    counts = {'approved': 0, 'rejected': 0}
+    for number, status in decisions.items():
+        if not 0 <= number < len(statuses) or statuses[number] == status:
+            continue
+        if statuses[number] == STATUS_APPROVED:
+            points -= lead_points(leads[number])
+        if status == STATUS_APPROVED:
+            points += lead_points(leads[number])
+            counts['approved'] += 1
+        elif status == STATUS_REJECTED:
+            counts['rejected'] += 1
+        statuses[number] = status
+    return '\n'.join(statuses), points, counts
+
+
+def parse_decisions_csv(text: str) -> Tuple[Decisions, List[str]]:
+    """Разбирает CSV с решениями; возвращает (решения, ошибки по строкам)."""
+    decisions: Decisions = {}
+    errors: List[str] = []
+    sample = text[:1024]
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    for line_number, row in enumerate(csv.reader(io.StringIO(text), dialect), start=1):
+        cells = [cell.strip() for cell in row]
+        if not any(cells):
+            continue
+        if len(cells) < 3:
+            errors.append(f"Строка {line_number}: нужно три значения - ID участника, номер лида, решение")
+            continue
+        participant_id, lead_number, decision = cells[:3]
+        if not participant_id.isdigit() or not lead_number.isdigit():
+            if line_number == 1:
+                continue  # Заголовок
+            errors.append(f"Строка {line_number}: ID участника и номер лида должны быть числами")
+            continue
+        status = DECISION_WORDS.get(decision.lower())
+        if status is None or int(lead_number) < 1:
+            errors.append(f"Строка {line_number}: непонятное решение «{decision}» или номер лида «{lead_number}»")
+            continue
+        decisions[(int(participant_id), int(lead_number) - 1)] = status
+    return decisions, errors
@@ -0,0 +1,149 @@
+"""
+Сэмплирующий профилировщик для /profile.
+
+Пока профилирование включено, фоновый поток каждые SAMPLE_INTERVAL секунд
+снимает стеки всех потоков (sys._current_frames) и считает одинаковые стеки.
+Учитываются только стеки, в которых выполняется код бота: в главном потоке -
+кадр проекта выше Handle._run (обработчик, который выполняет цикл событий),
+в остальных потоках - любой кадр проекта (вызовы Sheets через to_thread).
+Простой цикла событий в ожидании апдейтов (select под main) в отчет не
+попадает, как и библиотеки из виртуального окружения внутри проекта.
+Когда профилирование выключено, поток не работает и накладных расходов нет.
+
+Результат - файл в формате collapsed stacks (flamegraph.pl, speedscope) и
+текстовый топ функций по доле сэмплов.
+"""
+
+import os
+import sys
+import time
+import threading
+from collections import Counter
+from typing import List, Optional, Tuple
+
+SAMPLE_INTERVAL = 0.005  # 200 сэмплов в секунду
+DEFAULT_WINDOW = 60      # Секунд профилирования по умолчанию
+MAX_WINDOW = 15 * 60
+MAX_DEPTH = 64
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+LOOP_HANDLE_FILE = os.path.join('asyncio', 'events.py')
+# Каталоги библиотек: .venv внутри проекта не считается кодом бота
+LIBRARY_DIRS = ('site-packages', 'dist-packages', '.venv', 'venv')
+
+
+def is_project_file(filename: str, project_dir: str = PROJECT_DIR) -> bool:
+    if not filename.startswith(project_dir + os.sep):
+        return False
+    parts = os.path.relpath(filename, project_dir).split(os.sep)
+    return not any(part in LIBRARY_DIRS for part in parts[:-1])
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = SAMPLE_INTERVAL, project_dir: str = PROJECT_DIR):
+        self.interval = interval
+        self.project_dir = project_dir
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started_at: Optional[float] = None
+        self.stopped_at: Optional[float] = None
+        # stacks и samples меняет поток сэмплирования, а читают обработчики /profile
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, window: float = DEFAULT_WINDOW) -> None:
+        """Начинает новый сбор сэмплов на window секунд."""
+        self.stop()
+        with self._lock:
+            self.stacks = Counter()
+            self.samples = 0
+        self.started_at = time.monotonic()
+        self.stopped_at = None
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(self.started_at + window,), name='profiler', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, deadline: float) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            main_id = threading.main_thread().ident
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    self._sample(frame, in_loop_thread=thread_id == main_id)
+        self.stopped_at = time.monotonic()
+
+    def _sample(self, frame, in_loop_thread: bool = False) -> None:
+        labels = []
+        in_project = False
+        in_handle = False
+        while frame is not None and len(labels) < MAX_DEPTH:
+            code = frame.f_code
+            # Выше Handle._run - только цикл событий и main(); стек задачи на этом заканчивается
+            if code.co_name == '_run' and code.co_filename.endswith(LOOP_HANDLE_FILE):
+                in_handle = True
+                break
+            if not in_project and is_project_file(code.co_filename, self.project_dir):
+                in_project = True
+            labels.append(_frame_label(frame))
+            frame = frame.f_back
+        # В потоке цикла событий без Handle._run цикл простаивает (select под main)
+        if in_project and (in_handle or not in_loop_thread):
+            self._record(';'.join(reversed(labels)))
+
+    def _record(self, stack: str) -> None:
+        with self._lock:
+            self.stacks[stack] += 1
+            self.samples += 1
+
+    def _copy(self) -> Tuple[Counter, int]:
+        with self._lock:
+            return Counter(self.stacks), self.samples
+
+    def collapsed(self) -> str:
+        """Стеки в формате "a;b;c N" по одному на строку."""
+        stacks, _ = self._copy()
+        return '\n'.join(f"{stack} {count}" for stack, count in stacks.most_common()) + '\n'
+
+    def top(self, limit: int = 15) -> str:
+        """Топ функций бота по доле сэмплов, в которых они были в стеке."""
+        stacks, samples = self._copy()
+        if not samples:
+            return "Сэмплов нет: обработчики не выполнялись во время профилирования."
+        project_modules = {
+            os.path.splitext(name)[0] for name in os.listdir(self.project_dir) if name.endswith('.py')
+        }
+        inclusive: Counter = Counter()
+        for stack, count in stacks.items():
+            for label in set(stack.split(';')):
+                if label.split(':', 1)[0] in project_modules:
+                    inclusive[label] += count
+        end = self.stopped_at or time.monotonic()
+        lines: List[str] = [
+            f"Сэмплов: {samples} за {end - self.started_at:.0f} с "
+            f"(~{samples * self.interval:.1f} с работы кода бота)"
+        ]
+        for label, count in inclusive.most_common(limit):
+            lines.append(f"{100 * count / samples:5.1f}%  {label}")
+        return '\n'.join(lines)
+
+
+profiler = SamplingProfiler()
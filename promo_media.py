@@ -0,0 +1,164 @@
+"""
+Каталог промо-материалов (флаеры, видео) для раздела "📱 Информация для продвижения".
+
+Файлы лежат в папке media/. Каждый файл загружается в Telegram один раз:
+после первой отправки его file_id сохраняется в media_cache.json, и дальше
+материал пересылается по file_id без повторной загрузки. Если Telegram
+отвечает, что file_id устарел, файл загружается заново и кэш обновляется.
+"""
+
+import os
+import json
+import logging
+from typing import Dict, List, Optional
+
+from telegram import Bot, Message, InputMediaPhoto, InputMediaVideo, InputMediaDocument
+from telegram.error import BadRequest
+
+logger = logging.getLogger(__name__)
+
+MEDIA_DIR = 'media'
+CACHE_FILE = 'media_cache.json'
+
+# Категория (callback_data из info) -> список публикаций.
+# Публикация из одного файла отправляется отдельным сообщением,
+# из нескольких - альбомом (до 10 фото/видео).
+PROMO_MEDIA = {
+    'info_courses': [
+        [{'type': 'photo', 'file': 'courses_flyer.jpg', 'caption': 'IT-курсы для детей 10–17 лет'}],
+    ],
+    'info_camp': [
+        [
+            {'type': 'photo', 'file': 'camp_web.jpg', 'caption': 'Смена 1. WEB-РАЗРАБОТКА + НЕЙРОСЕТИ'},
+            {'type': 'photo', 'file': 'camp_games.jpg', 'caption': 'Смена 2. РАЗРАБОТКА ИГРЫ С НУЛЯ'},
+        ],
+        [{'type': 'video', 'file': 'camp_promo.mp4'}],
+    ],
+    'info_college': [
+        [{'type': 'photo', 'file': 'college_flyer.jpg', 'caption': 'Поступление после 9 класса'}],
+        [{'type': 'document', 'file': 'college_booklet.pdf'}],
+    ],
+    'info_admission': [
+        [{'type': 'video', 'file': 'campus_tour.mp4', 'caption': 'Экскурсия по Singularity'}],
+    ],
+}
+
+INPUT_MEDIA = {
+    'photo': InputMediaPhoto,
+    'video': InputMediaVideo,
+    'document': InputMediaDocument,
+}
+
+# Ошибки Telegram, после которых file_id нужно выбросить и загрузить файл заново
+STALE_FILE_ERRORS = ('wrong file identifier', 'file reference', 'wrong remote file', 'file_id')
+
+
+class FileIdCache:
+    """Постоянный кэш: путь к файлу -> file_id в Telegram."""
+
+    def __init__(self, path: str = CACHE_FILE):
+        self.path = path
+        self._ids: Dict[str, Dict[str, object]] = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self._ids = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.error(f"Failed to read {path}: {e}")
+
+    @staticmethod
+    def _signature(file_path: str) -> List[float]:
+        stat = os.stat(file_path)
+        return [stat.st_size, stat.st_mtime]
+
+    def get(self, file_path: str) -> Optional[str]:
+        """Возвращает file_id, если файл не менялся после загрузки."""
+        entry = self._ids.get(file_path)
+        if not entry:
+            return None
+        if entry.get('signature') != self._signature(file_path):
+            return None
+        return entry['file_id']
+
+    def set(self, file_path: str, file_id: str) -> None:
+        self._ids[file_path] = {'file_id': file_id, 'signature': self._signature(file_path)}
+        self._save()
+
+    def forget(self, file_path: str) -> None:
+        if self._ids.pop(file_path, None) is not None:
+            self._save()
+
+    def _save(self) -> None:
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._ids, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+file_id_cache = FileIdCache()
+
+
+def _message_file_id(message: Message, media_type: str) -> Optional[str]:
+    if media_type == 'photo' and message.photo:
+        return message.photo[-1].file_id
+    attachment = getattr(message, media_type, None)
+    return attachment.file_id if attachment else None
+
+
+def _is_stale_file_error(error: BadRequest) -> bool:
+    text = str(error).lower()
+    return any(marker in text for marker in STALE_FILE_ERRORS)
+
+
+async def _send_post(bot: Bot, chat_id: int, items: List[dict], use_cache: bool, cache: FileIdCache) -> None:
+    paths = [os.path.join(MEDIA_DIR, item['file']) for item in items]
+    opened = []
+    try:
+        sources = []
+        for path in paths:
+            file_id = cache.get(path) if use_cache else None
+            if file_id is None:
+                opened.append(open(path, 'rb'))
+                file_id = opened[-1]
+            sources.append(file_id)
+
+        if len(items) == 1:
+            item = items[0]
+            send = getattr(bot, f"send_{item['type']}")
+            messages = [await send(chat_id=chat_id, caption=item.get('caption'), **{item['type']: sources[0]})]
+        else:
+            media = [
+                INPUT_MEDIA[item['type']](media=source, caption=item.get('caption'))
+                for item, source in zip(items, sources)
+            ]
+            messages = await bot.send_media_group(chat_id=chat_id, media=media)
+    finally:
+        for f in opened:
+            f.close()
+
+    for item, path, message in zip(items, paths, messages):
+        file_id = _message_file_id(message, item['type'])
+        if file_id and cache.get(path) != file_id:
+            cache.set(path, file_id)
+
+
+async def send_promo_media(bot: Bot, chat_id: int, category: str, cache: FileIdCache = file_id_cache) -> None:
+    """
+    Отправляет материалы категории; отсутствующие файлы пропускаются.
+
+    file_id действительны только для загрузившего их бота, поэтому у каждого
+    бота процесса свой cache.
+    """
+    for items in PROMO_MEDIA.get(category, []):
+        items = [item for item in items if os.path.exists(os.path.join(MEDIA_DIR, item['file']))]
+        if not items:
+            continue
+        try:
+            await _send_post(bot, chat_id, items, use_cache=True, cache=cache)
+        except BadRequest as e:
+            if not _is_stale_file_error(e):
+                raise
+            logger.warning(f"Stale file_id for {category}, re-uploading: {e}")
+            for item in items:
+                cache.forget(os.path.join(MEDIA_DIR, item['file']))
+            await _send_post(bot, chat_id, items, use_cache=False, cache=cache)
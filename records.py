@@ -0,0 +1,285 @@
+"""
+Типизированные записи участников и лидов.
+
+Строки таблицы разбираются один раз на снимок: вместо списков строк
+переменной длины с доступом по индексам (row[11], row[17]) остальной код
+работает с полями Participant и Lead. Номера колонок определяются по строке
+заголовков, а если заголовок не распознан - по стандартной структуре из
+table_structure.md.
+
+Старый create_table.py подписывал I как Телефон_ученика, а J как ФИО_родителя,
+хотя бот всегда писал ФИО родителя в I, а J оставлял пустым. Такой заголовок
+(LEGACY_PHONE_HEADER) не соответствует данным, поэтому для I и J при нем
+используется стандартная структура.
+"""
+
+from typing import Dict, List, Optional
+
+# Стандартное расположение колонок (см. table_structure.md)
+DEFAULT_COLUMNS = {
+    'participant_id': 1,   # B
+    'full_name': 2,        # C
+    'course': 3,           # D
+    'child_name': 4,       # E
+    'age': 5,              # F
+    'grade': 6,            # G
+    'telegram': 7,         # H
+    'parent_name': 8,      # I
+    'phone': 9,            # J
+    'parent_phone': 10,    # K
+    'points': 11,          # L
+    'status': 12,          # M
+    'program_type': 14,    # O
+    'chat_id': 16,         # Q
+    'telegram_id': 17,     # R
+}
+
+# Названия колонок в заголовке -> поле записи
+HEADER_ALIASES = {
+    'id_участника': 'participant_id',
+    'фио': 'full_name',
+    'курс': 'course',
+    'фио_лида': 'child_name',
+    'имя_ребенка': 'child_name',
+    'возраст': 'age',
+    'класс': 'grade',
+    'telegram': 'telegram',
+    'фио_родителя': 'parent_name',
+    'телефон_ученика': 'phone',
+    'телефон_родителя': 'parent_phone',
+    'баллы': 'points',
+    'статус': 'status',
+    'программа': 'program_type',
+    'chat_id': 'chat_id',
+    'telegram_id': 'telegram_id',
+}
+
+# Подписи I и J в таблицах старого create_table.py: данные в них лежат по DEFAULT_COLUMNS
+LEGACY_PHONE_HEADER = {'phone': 8, 'parent_name': 9}
+
+# Поля лида, которые хранятся в ячейках через перенос строки
+LEAD_FIELDS = ('child_name', 'age', 'grade', 'telegram', 'parent_name',
+               'phone', 'parent_phone', 'program_type')
+
+# Общий кортеж для участников без лидов, чтобы не держать по копии на строку
+EMPTY_LEAD_CELLS = ('',) * len(LEAD_FIELDS)
+
+DEFAULT_STATUS = 'На проверке'
+STATUS_APPROVED = 'Одобрен'
+STATUS_REJECTED = 'Отклонен'
+ROW_WIDTH = 18  # A–R
+
+
+def column_letter(col: int) -> str:
+    """Возвращает букву колонки по индексу (0 -> A)."""
+    return chr(ord('A') + col)
+
+
+def _to_int(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return None
+
+
+class ColumnMap:
+    """Соответствие полей записей и номеров колонок."""
+
+    __slots__ = ('columns',)
+
+    def __init__(self, columns: Optional[Dict[str, int]] = None):
+        self.columns = dict(columns or DEFAULT_COLUMNS)
+
+    @classmethod
+    def from_header(cls, header: List[str]) -> 'ColumnMap':
+        """Строит карту по строке заголовков; нераспознанные поля берутся по умолчанию."""
+        columns = dict(DEFAULT_COLUMNS)
+        found = {}
+        for col, title in enumerate(header):
+            field = HEADER_ALIASES.get(str(title).strip().lower())
+            if field and field not in found:
+                found[field] = col
+        # Заголовок без ID участника считаем нераспознанным целиком
+        if 'participant_id' not in found:
+            return cls(columns)
+        if all(found.get(field) == col for field, col in LEGACY_PHONE_HEADER.items()):
+            for field in LEGACY_PHONE_HEADER:
+                del found[field]
+        columns.update(found)
+        return cls(columns)
+
+    @staticmethod
+    def is_legacy_header(header: List[str]) -> bool:
+        """Заголовок старого create_table.py с перепутанными подписями I и J."""
+        titles = [str(title).strip().lower() for title in header[8:10]]
+        return titles == ['телефон_ученика', 'фио_родителя']
+
+    def __getitem__(self, field: str) -> int:
+        return self.columns[field]
+
+    def letter(self, field: str) -> str:
+        return column_letter(self.columns[field])
+
+
+class Lead:
+    """Один лид участника (одна позиция в ячейках E–O)."""
+
+    __slots__ = ('number',) + LEAD_FIELDS + ('status',)
+
+    def __init__(self, number: int, child_name: str = '', age: str = '', grade: str = '',
+                 telegram: str = '', parent_name: str = '', phone: str = '',
+                 parent_phone: str = '', program_type: str = '', status: str = DEFAULT_STATUS):
+        self.number = number
+        self.child_name = child_name
+        self.age = age
+        self.grade = grade
+        self.telegram = telegram
+        self.parent_name = parent_name
+        self.phone = phone
+        self.parent_phone = parent_phone
+        self.program_type = program_type
+        self.status = status
+
+    def __repr__(self) -> str:
+        return f"Lead({self.number}, {self.child_name!r})"
+
+
+class Participant:
+    """
+    Участник - одна строка таблицы.
+
+    Ячейки с лидами хранятся в упакованном виде (как в таблице) и
+    разбираются только по запросу: lead_values() для одной колонки,
+    leads для полного списка Lead. Статусы лидов (M) упакованы так же;
+    одно значение без переносов относится ко всем лидам участника.
+    """
+
+    __slots__ = ('row_number', 'participant_id', 'full_name', 'course', 'points',
+                 'status', 'chat_id', 'telegram_id', '_lead_cells')
+
+    def __init__(self, row_number: int, participant_id: int, full_name: str = '',
+                 course: Optional[int] = None, points: int = 0, status: str = '',
+                 chat_id: Optional[int] = None, telegram_id: Optional[int] = None,
+                 lead_cells: tuple = ()):
+        self.row_number = row_number
+        self.participant_id = participant_id
+        self.full_name = full_name
+        self.course = course
+        self.points = points
+        self.status = status
+        self.chat_id = chat_id
+        self.telegram_id = telegram_id
+        self._lead_cells = lead_cells if any(lead_cells) else EMPTY_LEAD_CELLS
+
+    def __repr__(self) -> str:
+        return f"Participant({self.participant_id}, {self.full_name!r}, row={self.row_number})"
+
+    @classmethod
+    def from_row(cls, row_number: int, row: list, columns: ColumnMap) -> Optional['Participant']:
+        """Разбирает строку таблицы. Возвращает None для строк без ID участника."""
+        def cell(field: str) -> str:
+            col = columns[field]
+            return row[col] if col < len(row) else ''
+
+        participant_id = _to_int(cell('participant_id'))
+        if participant_id is None:
+            return None
+        return cls(
+            row_number=row_number,
+            participant_id=participant_id,
+            full_name=cell('full_name'),
+            course=_to_int(cell('course')),
+            points=_to_int(cell('points')) or 0,
+            status=cell('status'),
+            chat_id=_to_int(cell('chat_id')),
+            telegram_id=_to_int(cell('telegram_id')),
+            lead_cells=tuple(cell(field) for field in LEAD_FIELDS),
+        )
+
+    def lead_cell(self, field: str) -> str:
+        """Упакованное значение ячейки лидов (значения через перенос строки)."""
+        return self._lead_cells[LEAD_FIELDS.index(field)]
+
+    @property
+    def lead_count(self) -> int:
+        child_names = self._lead_cells[0]
+        return child_names.count('\n') + 1 if child_names else 0
+
+    def lead_values(self, field: str) -> List[str]:
+        """Значения одного поля по всем лидам, дополненные до числа лидов."""
+        packed = self.lead_cell(field)
+        values = packed.split('\n') if packed else []
+        count = self.lead_count
+        return values[:count] + [''] * (count - len(values))
+
+    def lead_statuses(self) -> List[str]:
+        """Статус каждого лида; лиды без статуса - «На проверке»."""
+        count = self.lead_count
+        statuses = self.status.split('\n') if self.status else []
+        if len(statuses) == 1:
+            # Статус, проставленный вручную на всю строку
+            statuses *= count
+        statuses = [status.strip() or DEFAULT_STATUS for status in statuses[:count]]
+        return statuses + [DEFAULT_STATUS] * (count - len(statuses))
+
+    @property
+    def overall_status(self) -> str:
+        """Статус участника для сегментов: «На проверке», пока есть непроверенные лиды."""
+        statuses = set(self.lead_statuses())
+        if not statuses:
+            return self.status
+        if len(statuses) == 1:
+            return statuses.pop()
+        return DEFAULT_STATUS if DEFAULT_STATUS in statuses else STATUS_APPROVED
+
+    @property
+    def leads(self) -> List[Lead]:
+        columns = [self.lead_values(field) for field in LEAD_FIELDS]
+        return [Lead(number, *(column[number] for column in columns), status=status)
+                for number, status in enumerate(self.lead_statuses())]
+
+    def append_lead(self, lead_data: Dict) -> Dict[str, str]:
+        """
+        Добавляет лида к упакованным ячейкам.
+
+        Колонки, появившиеся позже остальных (J, O), выравниваются по числу
+        лидов. Возвращает новые значения ячеек: поле -> строка.
+        """
+        lead_number = self.lead_count
+        cells = {}
+        for field, packed in zip(LEAD_FIELDS, self._lead_cells):
+            entries = packed.split('\n') if packed else []
+            entries += [''] * (lead_number - len(entries))
+            entries.append(str(lead_data.get(field, '')))
+            cells[field] = '\n'.join(entries)
+        self._lead_cells = tuple(cells[field] for field in LEAD_FIELDS)
+        return cells
+
+
+class Snapshot:
+    """Разобранный снимок листа участников с индексами по ID."""
+
+    __slots__ = ('header', 'columns', 'participants', 'by_participant_id', 'by_telegram_id', 'row_count')
+
+    def __init__(self, values: List[list]):
+        header = values[0] if values else []
+        self.header = header
+        self.columns = ColumnMap.from_header(header)
+        self.participants: List[Participant] = []
+        self.by_participant_id: Dict[int, Participant] = {}
+        self.by_telegram_id: Dict[int, Participant] = {}
+        self.row_count = len(values)
+        for row_number, row in enumerate(values[1:], start=2):
+            participant = Participant.from_row(row_number, row, self.columns)
+            if participant is not None:
+                self.add(participant)
+
+    def add(self, participant: Participant) -> None:
+        self.participants.append(participant)
+        self.by_participant_id.setdefault(participant.participant_id, participant)
+        if participant.telegram_id:
+            self.by_telegram_id.setdefault(participant.telegram_id, participant)
+        self.row_count = max(self.row_count, participant.row_number)
+
+    def max_id(self) -> int:
+        return max(self.by_participant_id, default=0)
@@ -0,0 +1,222 @@
+"""
+Отчеты для админов: графики (PNG) и выгрузка таблицы (XLSX).
+
+Отрисовка и сборка XLSX на десятках тысяч строк занимают секунды процессорного
+времени, поэтому выполняются в отдельных процессах (ProcessPoolExecutor), а не
+в цикле событий бота. Рабочий процесс получает сериализованный снимок таблицы
+(pickle участников, см. GoogleSheetsHandler.export_snapshot) и историю итогов
+и возвращает готовый файл в байтах.
+
+Готовые отчеты кэшируются по версии снимка (и дню - для истории): пока таблица
+не изменилась, повторный запрос отдается из памяти без сериализации снимка
+и повторной отрисовки.
+
+В таблице нет дат добавления лидов, поэтому для графика «лиды по дням»
+ReportService запоминает итоги конкурса в LEADS_HISTORY_FILE: ежедневной
+задачей JobQueue в HISTORY_TIME (даже если отчеты никто не запрашивал) и при
+каждой отрисовке. Файл пишется в отдельном потоке, не в цикле событий.
+"""
+
+import io
+import os
+import json
+import time
+import pickle
+import asyncio
+import logging
+import multiprocessing
+from datetime import date, time as dtime
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+from zoneinfo import ZoneInfo
+
+from campaign_stats import PROGRAM_TITLES, UNKNOWN
+from records import LEAD_FIELDS, DEFAULT_STATUS
+
+logger = logging.getLogger(__name__)
+
+REPORT_WORKERS = int(os.getenv('REPORT_WORKERS', 2))
+LEADS_HISTORY_FILE = os.getenv('LEADS_HISTORY_FILE', 'leads_history.json')
+# Время ежедневной записи итогов (в TIMEZONE, как расписание сводок)
+HISTORY_TIME = dtime(23, 50, tzinfo=ZoneInfo(os.getenv('TIMEZONE', 'Europe/Moscow')))
+LEADERBOARD_SIZE = 20
+
+LEAD_COLUMNS = ('ФИО ученика', 'Возраст', 'Класс', 'Telegram', 'ФИО родителя',
+                'Телефон ученика', 'Телефон родителя', 'Программа')
+
+
+def _pyplot():
+    # matplotlib импортируется только в рабочих процессах
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def _png(figure) -> bytes:
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format='png', dpi=150, bbox_inches='tight')
+    _pyplot().close(figure)
+    return buffer.getvalue()
+
+
+def render_leads_chart(snapshot: bytes, history: List[Tuple[str, Dict[str, int]]]) -> bytes:
+    """График числа лидов и участников по дням."""
+    plt = _pyplot()
+    figure, axes = plt.subplots(figsize=(10, 5))
+    days = [date.fromisoformat(day) for day, _ in history]
+    axes.plot(days, [totals['leads'] for _, totals in history], marker='o', label='Лиды')
+    axes.plot(days, [totals['participants'] for _, totals in history], marker='o', label='Участники')
+    axes.set_title('Лиды и участники по дням')
+    axes.grid(alpha=0.3)
+    axes.legend()
+    figure.autofmt_xdate()
+    return _png(figure)
+
+
+def render_leaderboard(snapshot: bytes, history: List[Tuple[str, Dict[str, int]]]) -> bytes:
+    """Рейтинг участников по баллам (LEADERBOARD_SIZE лучших)."""
+    participants = pickle.loads(snapshot)
+    top = sorted(
+        (p for p in participants if p.points > 0),
+        key=lambda p: (-p.points, p.participant_id)
+    )[:LEADERBOARD_SIZE]
+    plt = _pyplot()
+    figure, axes = plt.subplots(figsize=(10, 1 + 0.45 * max(len(top), 1)))
+    names = [f"{place}. {p.full_name}" for place, p in enumerate(top, start=1)]
+    bars = axes.barh(names[::-1], [p.points for p in top][::-1], color='#4c72b0')
+    axes.bar_label(bars, padding=3)
+    axes.set_title('Рейтинг амбассадоров')
+    axes.set_xlabel('Баллы')
+    axes.spines[['top', 'right']].set_visible(False)
+    return _png(figure)
+
+
+def render_xlsx(snapshot: bytes, history: List[Tuple[str, Dict[str, int]]]) -> bytes:
+    """Выгрузка участников и лидов в XLSX (лист на участников и лист на лидов)."""
+    from openpyxl import Workbook
+
+    participants = pickle.loads(snapshot)
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Участники')
+    sheet.append(('ID', 'ФИО', 'Курс', 'Лидов', 'Баллы', 'Статус', 'Chat ID', 'Telegram ID'))
+    for p in participants:
+        sheet.append((p.participant_id, p.full_name, p.course, p.lead_count, p.points,
+                      p.status, p.chat_id, p.telegram_id))
+
+    sheet = workbook.create_sheet('Лиды')
+    sheet.append(('ID участника', 'ФИО участника') + LEAD_COLUMNS + ('Статус',))
+    for p in participants:
+        for lead in p.leads:
+            values = [getattr(lead, field) for field in LEAD_FIELDS]
+            values[-1] = PROGRAM_TITLES.get(values[-1], values[-1] or UNKNOWN)
+            sheet.append((p.participant_id, p.full_name, *values, lead.status or DEFAULT_STATUS))
+
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+# Пул процессов общий для всех ботов процесса (см. tenants.py)
+_executor = None
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # fork копировал бы процесс с циклом событий, HTTP-клиентами и потоком журнала вместе
+        # с удерживаемыми ими замками; рабочие процессы запускаются чистыми
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        _executor = ProcessPoolExecutor(max_workers=REPORT_WORKERS, mp_context=multiprocessing.get_context(method))
+    return _executor
+
+
+def shutdown_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+# Тип отчета -> (название, имя файла, функция отрисовки)
+REPORTS: Dict[str, Tuple[str, str, Callable[..., bytes]]] = {
+    'leads_chart': ('📈 Лиды по дням', 'leads.png', render_leads_chart),
+    'leaderboard': ('🏆 Рейтинг', 'leaderboard.png', render_leaderboard),
+    'xlsx': ('📄 Выгрузка XLSX', 'ambassadors.xlsx', render_xlsx),
+}
+
+
+class ReportService:
+    """Отрисовка отчетов в пуле процессов с кэшем по версии снимка."""
+
+    def __init__(self, sheets_handler, history_path: str = LEADS_HISTORY_FILE):
+        self.sheets_handler = sheets_handler
+        self.history_path = history_path
+        self._cache: Dict[str, Tuple[Any, bytes]] = {}
+        self._pending: Dict[Tuple[str, Any], asyncio.Task] = {}
+        self._history = self._load_history()
+
+    def _load_history(self) -> Dict[str, Dict[str, int]]:
+        if not os.path.exists(self.history_path):
+            return {}
+        try:
+            with open(self.history_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"Failed to load {self.history_path}: {e}")
+            return {}
+
+    def _save_history(self, history: Dict[str, Dict[str, int]]) -> None:
+        tmp_path = f"{self.history_path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(history, f)
+            os.replace(tmp_path, self.history_path)
+        except Exception as e:
+            logger.error(f"Failed to save {self.history_path}: {e}")
+
+    async def record_history(self) -> List[Tuple[str, Dict[str, int]]]:
+        """Запоминает сегодняшние итоги конкурса по текущему снимку; возвращает историю по дням."""
+        stats = self.sheets_handler.campaign_stats
+        totals = {'leads': stats.total_leads, 'participants': stats.total_participants}
+        today = date.today().isoformat()
+        if self._history.get(today) != totals:
+            self._history[today] = totals
+            await asyncio.to_thread(self._save_history, dict(self._history))
+        return sorted(self._history.items())
+
+    async def record_daily(self) -> None:
+        """Ежедневная задача (HISTORY_TIME): итоги по свежему снимку, а не по последнему загруженному."""
+        await asyncio.to_thread(self.sheets_handler.snapshot_version)
+        history = await self.record_history()
+        logger.info(f"Recorded leads history for {history[-1][0]}: {history[-1][1]}")
+
+    async def render(self, kind: str) -> Tuple[str, bytes]:
+        """
+        Возвращает (имя файла, содержимое) отчета по текущему снимку.
+
+        Одновременные запросы одного отчета ждут одну отрисовку.
+        """
+        _, filename, renderer = REPORTS[kind]
+        version = (await asyncio.to_thread(self.sheets_handler.snapshot_version), date.today())
+        cached = self._cache.get(kind)
+        if cached and cached[0] == version:
+            return filename, cached[1]
+
+        key = (kind, version)
+        task = self._pending.get(key)
+        if task is None:
+            task = self._pending[key] = asyncio.ensure_future(self._render(kind, renderer))
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+        return filename, await asyncio.shield(task)
+
+    async def _render(self, kind: str, renderer: Callable[..., bytes]) -> bytes:
+        snapshot_version, snapshot = await asyncio.to_thread(self.sheets_handler.export_snapshot)
+        history = await self.record_history()
+        started = time.perf_counter()
+        content = await asyncio.get_running_loop().run_in_executor(_get_executor(), renderer, snapshot, history)
+        self._cache[kind] = ((snapshot_version, date.today()), content)
+        logger.info(
+            f"Rendered report {kind}: {len(content)} bytes in {time.perf_counter() - started:.2f}s"
+        )
+        return content
@@ -0,0 +1,102 @@
+"""
+Полнотекстовый поиск по участникам и лидам для администраторов.
+
+Инвертированный индекс строится по колонкам C (ФИО участника), E (ФИО лида),
+H (Telegram лида) и I (ФИО родителя). Токены приводятся к нижнему регистру,
+ё заменяется на е, и в индекс попадают все префиксы токена, поэтому запрос
+"петр" находит и "Петров", и "Петрович".
+"""
+
+import re
+from typing import Dict, Any, Iterable, List, Set, Tuple
+
+from records import Participant
+
+MIN_PREFIX = 2  # Короче этого префиксы не индексируются
+
+TOKEN_RE = re.compile(r'\w+')
+
+# Ключ документа: ('participant', ID участника, -1) или ('lead', ID участника, номер лида)
+DocKey = Tuple[str, str, int]
+
+
+def normalize_text(text: str) -> str:
+    """Приводит текст к виду для поиска: casefold и ё -> е."""
+    return str(text).casefold().replace('ё', 'е')
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(normalize_text(text))
+
+
+class SearchIndex:
+    """Инвертированный индекс: префикс токена -> документы."""
+
+    def __init__(self):
+        self._prefixes: Dict[str, Set[DocKey]] = {}
+        self._tokens: Dict[str, Set[DocKey]] = {}
+        self._docs: Dict[DocKey, Dict[str, Any]] = {}
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def _index(self, key: DocKey, doc: Dict[str, Any], *texts: str) -> None:
+        self._docs[key] = doc
+        for text in texts:
+            for token in tokenize(text):
+                self._tokens.setdefault(token, set()).add(key)
+                for end in range(min(MIN_PREFIX, len(token)), len(token) + 1):
+                    self._prefixes.setdefault(token[:end], set()).add(key)
+
+    def add_participant(self, participant_id, full_name: str, course='') -> None:
+        key = ('participant', str(participant_id), -1)
+        doc = {'kind': 'participant', 'participant_id': str(participant_id),
+               'full_name': full_name, 'course': str(course)}
+        self._index(key, doc, full_name)
+
+    def add_lead(self, participant_id, lead_number: int, child_name: str,
+                 telegram: str = '', parent_name: str = '', owner_name: str = '') -> None:
+        key = ('lead', str(participant_id), lead_number)
+        doc = {'kind': 'lead', 'participant_id': str(participant_id), 'owner_name': owner_name,
+               'child_name': child_name, 'telegram': telegram, 'parent_name': parent_name}
+        self._index(key, doc, child_name, telegram, parent_name)
+
+    def rebuild(self, participants: Iterable[Participant]) -> None:
+        """Перестраивает индекс по участникам снимка."""
+        self._prefixes.clear()
+        self._tokens.clear()
+        self._docs.clear()
+        for participant in participants:
+            pid = participant.participant_id
+            self.add_participant(pid, participant.full_name, participant.course or '')
+            if not participant.lead_count:
+                continue
+            columns = zip(participant.lead_values('child_name'), participant.lead_values('telegram'),
+                          participant.lead_values('parent_name'))
+            for number, (child_name, telegram, parent_name) in enumerate(columns):
+                self.add_lead(pid, number, child_name, telegram, parent_name, participant.full_name)
+
+    def search(self, query: str) -> List[Dict[str, Any]]:
+        """
+        Ищет документы, в которых есть все слова запроса (как префиксы).
+
+        Полное совпадение слова весит больше совпадения по префиксу;
+        при равном счете участники идут раньше лидов.
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        scores: Dict[DocKey, int] | None = None
+        for token in tokens:
+            matched = self._prefixes.get(token, set())
+            exact = self._tokens.get(token, set())
+            token_scores = {key: 2 if key in exact else 1 for key in matched}
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {key: score + token_scores[key] for key, score in scores.items()
+                          if key in token_scores}
+            if not scores:
+                return []
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0][0] != 'participant', item[0]))
+        return [self._docs[key] for key, _ in ranked]
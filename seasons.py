@@ -0,0 +1,115 @@
+"""
+Разделение участников по сезонам: горячий лист и архивы.
+
+Текущий сезон живет в основном листе (горячий раздел), и все обычные
+запросы бота читают только его. При смене сезона основной лист целиком
+переименовывается в "Архив <сезон>", а на его место создается новый лист
+с тем же названием. В него переносятся только активные участники: те, у
+кого были лиды или баллы, без лидов и баллов прошлого сезона. Все делается
+одним spreadsheets().batchUpdate.
+
+Архивные листы читаются редко и целиком попадают в ArchiveIndex: по нему
+вернувшийся участник находится по Telegram ID и восстанавливается в
+горячем листе с прежним ID.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from records import ColumnMap, Participant, Snapshot, ROW_WIDTH
+
+ARCHIVE_PREFIX = 'Архив '
+ARCHIVE_TTL = 6 * 60 * 60  # Архивы меняются только при смене сезона
+
+
+def archive_title(season: str) -> str:
+    return f"{ARCHIVE_PREFIX}{season.strip()}"
+
+
+def is_archive_title(title: str) -> bool:
+    return title.startswith(ARCHIVE_PREFIX)
+
+
+def quote_sheet_title(title: str) -> str:
+    """Название листа для A1-нотации: 'Архив Лето 2025'!A:R."""
+    return "'" + title.replace("'", "''") + "'"
+
+
+def is_active(participant: Participant) -> bool:
+    """Участник переносится в новый сезон, если в прошлом сезоне у него были лиды или баллы."""
+    return participant.lead_count > 0 or participant.points > 0
+
+
+def identity_row(participant: Participant, columns: ColumnMap) -> List[Any]:
+    """Строка A–R только с данными участника (ID, ФИО, курс, Chat ID, Telegram ID)."""
+    row: List[Any] = [''] * ROW_WIDTH
+    row[columns['participant_id']] = participant.participant_id
+    row[columns['full_name']] = participant.full_name
+    row[columns['course']] = participant.course if participant.course is not None else ''
+    row[columns['chat_id']] = participant.chat_id or ''
+    row[columns['telegram_id']] = participant.telegram_id or ''
+    return row
+
+
+def _cell_data(value: Any) -> Dict[str, Any]:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {'userEnteredValue': {'numberValue': value}}
+    return {'userEnteredValue': {'stringValue': str(value)}}
+
+
+def rollover_requests(hot_sheet_id: int, hot_title: str, season: str, new_sheet_id: int,
+                      header: List[str], rows: List[List[Any]]) -> List[Dict[str, Any]]:
+    """Запросы spreadsheets().batchUpdate для смены сезона (выполняются атомарно)."""
+    return [
+        {
+            'updateSheetProperties': {
+                'properties': {'sheetId': hot_sheet_id, 'title': archive_title(season)},
+                'fields': 'title'
+            }
+        },
+        {
+            'addSheet': {
+                'properties': {
+                    'sheetId': new_sheet_id,
+                    'title': hot_title,
+                    'index': 0,
+                    'gridProperties': {'rowCount': max(1000, len(rows) + 100), 'columnCount': ROW_WIDTH}
+                }
+            }
+        },
+        {
+            'updateCells': {
+                'start': {'sheetId': new_sheet_id, 'rowIndex': 0, 'columnIndex': 0},
+                'rows': [{'values': [_cell_data(value) for value in row]} for row in [header] + rows],
+                'fields': 'userEnteredValue'
+            }
+        },
+    ]
+
+
+class ArchiveIndex:
+    """Участники архивных сезонов по Telegram ID (более новый сезон важнее)."""
+
+    def __init__(self):
+        self.by_telegram_id: Dict[int, Tuple[str, Participant]] = {}
+        self.max_id = 0
+
+    def __len__(self) -> int:
+        return len(self.by_telegram_id)
+
+    def rebuild(self, sheets: List[Tuple[str, List[list]]]) -> None:
+        """sheets: (название листа, значения A:R) от нового архива к старому."""
+        self.by_telegram_id.clear()
+        self.max_id = 0
+        for title, values in sheets:
+            snapshot = Snapshot(values)
+            self.max_id = max(self.max_id, snapshot.max_id())
+            for participant in snapshot.participants:
+                if participant.telegram_id:
+                    # Для восстановления нужны только данные участника, лиды прошлых сезонов не храним
+                    light = Participant(participant.row_number, participant.participant_id,
+                                        participant.full_name, participant.course,
+                                        chat_id=participant.chat_id, telegram_id=participant.telegram_id)
+                    self.by_telegram_id.setdefault(participant.telegram_id, (title, light))
+
+    def find(self, telegram_id: int) -> Optional[Tuple[str, Participant]]:
+        return self.by_telegram_id.get(int(telegram_id))
@@ -0,0 +1,211 @@
+"""
+Сегменты участников для адресных рассылок.
+
+Сегмент задается условиями через запятую или с новой строки, например:
+
+    курс=1
+    лиды=0
+    баллы>=20, статус=Одобрен
+
+Поля: курс (D), баллы (L), статус (M), лиды (число лидов). Операторы:
+=, !=, >, >=, <, <=. Все условия должны выполняться одновременно.
+
+SegmentIndex хранит для каждого поля битовые маски "значение -> участники",
+поэтому условие вычисляется объединением масок подходящих значений, а сегмент
+- их пересечением. Это миллисекунды даже на 100 тысячах участников.
+"""
+
+import re
+import operator
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from records import Participant
+
+FIELDS = {
+    'курс': 'course',
+    'course': 'course',
+    'баллы': 'points',
+    'points': 'points',
+    'статус': 'status',
+    'status': 'status',
+    'лиды': 'leads',
+    'leads': 'leads',
+}
+NUMERIC_FIELDS = {'course', 'points', 'leads'}
+INDEXED_FIELDS = ('course', 'points', 'status', 'leads')
+
+OPERATORS = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+}
+
+CONDITION_RE = re.compile(r'^\s*(\w+)\s*(>=|<=|!=|=|>|<)\s*(.+?)\s*$')
+
+# Готовые сегменты для кнопок: ключ -> (подпись, выражение)
+PRESETS = {
+    'all': ("👥 Все", ''),
+    'course_1': ("1 курс", 'курс=1'),
+    'course_2': ("2 курс", 'курс=2'),
+    'course_3': ("3 курс", 'курс=3'),
+    'course_4': ("4 курс", 'курс=4'),
+    'no_leads': ("Без лидов", 'лиды=0'),
+    'points_20': ("Баллы ≥ 20", 'баллы>=20'),
+}
+
+Condition = Tuple[str, Callable, object]
+
+
+class SegmentError(ValueError):
+    """Выражение сегмента не удалось разобрать."""
+
+
+def parse_segment(expression: str) -> List[Condition]:
+    """Разбирает выражение в список условий (поле, оператор, значение)."""
+    conditions = []
+    for part in re.split(r'[,;\n]', expression or ''):
+        if not part.strip():
+            continue
+        match = CONDITION_RE.match(part)
+        if not match:
+            raise SegmentError(f"Не понимаю условие «{part.strip()}»")
+        name, op, value = match.groups()
+        field = FIELDS.get(name.lower())
+        if field is None:
+            raise SegmentError(f"Неизвестное поле «{name}». Доступны: курс, баллы, статус, лиды")
+        if field in NUMERIC_FIELDS:
+            try:
+                value = int(value)
+            except ValueError:
+                raise SegmentError(f"Для поля «{name}» нужно число, а не «{value}»")
+        else:
+            value = value.casefold()
+        conditions.append((field, OPERATORS[op], value))
+    return conditions
+
+
+class SegmentIndex:
+    """Битовые маски по значениям полей; бит i соответствует i-му участнику."""
+
+    def __init__(self, is_reachable: Callable[[int | None], bool] = bool):
+        # Можно ли писать в чат: по умолчанию - есть ли Chat ID
+        self._is_reachable = is_reachable
+        self._reset()
+
+    def _reset(self) -> None:
+        self._masks: Dict[str, Dict[object, int]] = {}
+        self._chat_ids: List[int | None] = []
+        self._positions: Dict[int, int] = {}
+        # Значения полей участника по позиции, в порядке INDEXED_FIELDS
+        self._values: List[tuple] = []
+        self._reachable = 0  # Участники, которым можно писать
+
+    def __len__(self) -> int:
+        return len(self._chat_ids)
+
+    def __getstate__(self) -> dict:
+        # Проверка доступности чата принадлежит ChatRegistry и не сохраняется с индексом
+        state = dict(self.__dict__)
+        state.pop('_is_reachable')
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._is_reachable = bool
+
+    @staticmethod
+    def _field_values(participant: Participant) -> Dict[str, object]:
+        return {
+            'course': participant.course if participant.course is not None else -1,
+            'points': participant.points,
+            'status': (participant.overall_status or '').casefold(),
+            'leads': participant.lead_count,
+        }
+
+    def _set_bit(self, position: int, values: Dict[str, object]) -> None:
+        bit = 1 << position
+        for field, value in values.items():
+            masks = self._masks.setdefault(field, {})
+            masks[value] = masks.get(value, 0) | bit
+
+    def _clear_bit(self, position: int, values: Dict[str, object]) -> None:
+        bit = 1 << position
+        for field, value in values.items():
+            masks = self._masks[field]
+            masks[value] &= ~bit
+            if not masks[value]:
+                del masks[value]
+
+    def rebuild(self, participants: Iterable[Participant]) -> None:
+        """
+        Перестраивает маски по снимку.
+
+        Маски собираются в bytearray и превращаются в int один раз: установка
+        битов по одному в большом int стоила бы O(n) на каждого участника.
+        """
+        self._reset()
+        positions: Dict[str, Dict[object, List[int]]] = {}
+        reachable = []
+        for position, participant in enumerate(participants):
+            values = self._field_values(participant)
+            self._positions.setdefault(participant.participant_id, position)
+            self._chat_ids.append(participant.chat_id)
+            self._values.append(tuple(values.values()))
+            if self._is_reachable(participant.chat_id):
+                reachable.append(position)
+            for field, value in values.items():
+                positions.setdefault(field, {}).setdefault(value, []).append(position)
+
+        size = (len(self._chat_ids) + 7) // 8
+
+        def to_mask(bits: List[int]) -> int:
+            buffer = bytearray(size)
+            for position in bits:
+                buffer[position >> 3] |= 1 << (position & 7)
+            return int.from_bytes(buffer, 'little')
+
+        self._masks = {field: {value: to_mask(bits) for value, bits in by_value.items()}
+                       for field, by_value in positions.items()}
+        self._reachable = to_mask(reachable)
+
+    def add(self, participant: Participant) -> None:
+        """Добавляет участника или обновляет его значения (после нового лида, Chat ID)."""
+        position = self._positions.get(participant.participant_id)
+        values = self._field_values(participant)
+        if position is None:
+            position = len(self._chat_ids)
+            self._positions[participant.participant_id] = position
+            self._chat_ids.append(None)
+            self._values.append(())
+        else:
+            self._clear_bit(position, dict(zip(INDEXED_FIELDS, self._values[position])))
+        self._values[position] = tuple(values.values())
+        self._set_bit(position, values)
+        self._chat_ids[position] = participant.chat_id
+        if self._is_reachable(participant.chat_id):
+            self._reachable |= 1 << position
+        else:
+            self._reachable &= ~(1 << position)
+
+    def evaluate(self, conditions: List[Condition]) -> int:
+        """Маска доступных для рассылки участников, удовлетворяющих всем условиям."""
+        mask = self._reachable
+        for field, op, value in conditions:
+            matched = 0
+            for candidate, candidate_mask in self._masks.get(field, {}).items():
+                if op(candidate, value):
+                    matched |= candidate_mask
+            mask &= matched
+            if not mask:
+                break
+        return mask
+
+    def count(self, conditions: List[Condition]) -> int:
+        return self.evaluate(conditions).bit_count()
+
+    def chat_ids(self, conditions: List[Condition]) -> List[int]:
+        bits = bin(self.evaluate(conditions))[:1:-1]
+        return [self._chat_ids[position] for position, bit in enumerate(bits) if bit == '1']
@@ -1,217 +1,587 @@
+import os
+import time
+import pickle
+import logging
+import threading
+import httplib2
 from google.oauth2 import service_account
+from google_auth_httplib2 import AuthorizedHttp, Request
 from googleapiclient.discovery import build
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple, Callable
+from lead_index import LeadIndex
+from search_index import SearchIndex
+from campaign_stats import CampaignStats
+from segments import SegmentIndex, parse_segment
+from chat_registry import ChatRegistry, INACTIVE_FILE
+from tracing import TracedHttpRequest, traced_methods
+from throttle import sheets_quota
+import snapshot_cache
+from records import Snapshot, Participant, Lead, LEAD_FIELDS, ROW_WIDTH, DEFAULT_STATUS
+import moderation
+from seasons import (
+    ArchiveIndex, ARCHIVE_TTL, archive_title, is_archive_title, is_active,
+    identity_row, quote_sheet_title, rollover_requests
+)
 
+logger = logging.getLogger(__name__)
 
+SNAPSHOT_TTL = 60  # Сколько секунд считать снимок таблицы актуальным
+MAX_WRITE_ATTEMPTS = 3  # Попыток записи при конфликте с ручными правками
+
+
+class WriteConflict(Exception):
+    """Ячейки изменились в таблице между чтением снимка и записью."""
+
+
+_local = threading.local()
+
+
+class ThreadLocalHttpRequest(TracedHttpRequest):
+    """
+    Запрос к Sheets API через httplib2.Http текущего потока.
+
+    httplib2.Http не потокобезопасен, а методы обработчика вызываются
+    из нескольких потоков (asyncio.to_thread), поэтому у каждого потока
+    свое соединение на каждые учетные данные. Все запросы проходят через
+    общую квоту sheets_quota.
+    """
+
+    def execute(self, http=None, num_retries=0):
+        if http is None:
+            credentials = self.http.credentials
+            connections = _local.__dict__.setdefault('http', {})
+            http = connections.get(id(credentials))
+            if http is None:
+                http = connections[id(credentials)] = AuthorizedHttp(credentials, http=httplib2.Http())
+        sheets_quota.acquire()
+        return super().execute(http=http, num_retries=num_retries)
+
+
+def google_client(credentials_path: str) -> Tuple[Any, Any]:
+    """Учетные данные сервисного аккаунта и клиент Sheets API."""
+    credentials = service_account.Credentials.from_service_account_file(
+        credentials_path,
+        scopes=['https://www.googleapis.com/auth/spreadsheets']
+    )
+    return credentials, build('sheets', 'v4', credentials=credentials, requestBuilder=ThreadLocalHttpRequest)
+
+
+def _cell_str(value) -> str:
+    """Приводит значение ячейки к строке для сравнения (None -> '', 5.0 -> '5')."""
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+def _same_cell(old, current) -> bool:
+    """Совпадает ли ячейка со снимком; пустые баллы и 0 в снимке неразличимы."""
+    old, current = _cell_str(old), _cell_str(current)
+    return old == current or {old, current} == {'', '0'}
+
+
+@traced_methods
 class GoogleSheetsHandler:
-    def __init__(self, credentials_path: str, spreadsheet_id: str):
-        self.credentials = service_account.Credentials.from_service_account_file(
-            credentials_path,
-            scopes=['https://www.googleapis.com/auth/spreadsheets']
-        )
-        self.service = build('sheets', 'v4', credentials=self.credentials)
+    def __init__(self, credentials_path: str, spreadsheet_id: str, sheet_title: str | None = None,
+                 data_dir: str = '', client: Tuple[Any, Any] | None = None):
+        """
+        client - готовые (credentials, service), если несколько таблиц в процессе
+        работают через один сервисный аккаунт; data_dir - папка для файлов кэша.
+        """
+        self.credentials, self.service = client or google_client(credentials_path)
         self.spreadsheet_id = spreadsheet_id
+        # Горячий лист текущего сезона; без ACTIVE_SHEET используется первый лист
+        self.sheet_title = sheet_title or os.getenv('ACTIVE_SHEET') or None
+        self.snapshot_cache_path = os.path.join(data_dir, snapshot_cache.SNAPSHOT_CACHE_FILE)
+        self.archive_index = ArchiveIndex()
+        self._archive_loaded_at = None
+        self.lead_index = LeadIndex()
+        self.search_index = SearchIndex()
+        self.campaign_stats = CampaignStats()
+        self.chat_registry = ChatRegistry(os.path.join(data_dir, INACTIVE_FILE))
+        self.segment_index = SegmentIndex(is_reachable=self.chat_registry.is_active)
+        self._snapshot = None
+        self._snapshot_loaded_at = 0.0
+        self._snapshot_token = None  # Хэш значений A:R, по которым построен снимок
+        # Методы вызываются из нескольких потоков: _lock защищает снимок и индексы в памяти,
+        # _refresh_lock не дает нескольким потокам одновременно скачивать A:R
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        self._writes = 0  # Счетчик записей бота в таблицу
 
-    def update_ids_in_sheet(self, participant_id: int, chat_id: int, telegram_id: int) -> None:
+    def _range(self, a1: str) -> str:
+        """Диапазон в горячем листе текущего сезона."""
+        return f"{quote_sheet_title(self.sheet_title)}!{a1}" if self.sheet_title else a1
+
+    def sheet_range(self, a1: str) -> str:
+        """Диапазон A1 в листе, с которым работает бот (ACTIVE_SHEET), - для скриптов обслуживания."""
+        return self._range(a1)
+
+    def _get_snapshot(self, max_age: float = SNAPSHOT_TTL) -> Snapshot:
+        """
+        Возвращает разобранный снимок A:R, перечитывая таблицу не чаще раза в max_age секунд.
+
+        Методы записи вызывают его с max_age=0, чтобы номера строк были актуальными.
+        """
+        if self._snapshot is None or time.monotonic() - self._snapshot_loaded_at > max_age:
+            requested_at = time.monotonic()
+            with self._refresh_lock:
+                # Пока ждали, снимок мог перечитать другой поток
+                if self._snapshot is None or self._snapshot_loaded_at < requested_at - max_age:
+                    self.refresh_snapshot()
+        return self._snapshot
+
+    def _invalidate_snapshot(self) -> None:
+        """Снимок в памяти мог разойтись с таблицей: следующее чтение разберет ее заново."""
+        self._snapshot_loaded_at = 0.0
+        self._snapshot_token = None
+
+    def _build_state(self, values: List[list]) -> Dict[str, Any]:
+        """Новые снимок и индексы; текущие не трогаются, пока не вызван _install_state."""
+        snapshot = Snapshot(values)
+        # Chat ID, которые бот уже знает, но еще не записал в таблицу
+        with self._lock:
+            self.chat_registry.apply(snapshot)
+        state = {
+            'snapshot': snapshot,
+            'lead_index': LeadIndex(),
+            'search_index': SearchIndex(),
+            'campaign_stats': CampaignStats(),
+            'segment_index': SegmentIndex(is_reachable=self.chat_registry.is_active),
+        }
+        for name in ('lead_index', 'search_index', 'campaign_stats', 'segment_index'):
+            state[name].rebuild(snapshot.participants)
+        return state
+
+    def _install_state(self, state: Dict[str, Any], token: str | None) -> None:
+        with self._lock:
+            self._set_state(state, token)
+
+    def _set_state(self, state: Dict[str, Any], token: str | None) -> None:
+        self.lead_index = state['lead_index']
+        self.search_index = state['search_index']
+        self.campaign_stats = state['campaign_stats']
+        self.segment_index = state['segment_index']
+        self._snapshot = state['snapshot']
+        self._snapshot_token = token
+        self._snapshot_loaded_at = time.monotonic()
+
+    def refresh_snapshot(self, persist: bool = False) -> bool:
+        """
+        Перечитывает A:R; разбор и индексация выполняются, только если значения изменились.
+
+        С persist=True новый снимок сохраняется на диск (см. snapshot_cache.py).
+        Возвращает True, если снимок был перестроен.
+        """
+        writes_before = self._writes
+        result = self.service.spreadsheets().values().get(
+            spreadsheetId=self.spreadsheet_id,
+            range=self._range('A:R')
+        ).execute()
+        values = result.get('values', [])
+        token = snapshot_cache.values_token(values)
+        with self._lock:
+            if self._snapshot is not None and token == self._snapshot_token:
+                self._snapshot_loaded_at = time.monotonic()
+                return False
+
+        state = self._build_state(values)
+        with self._lock:
+            if self._snapshot is not None and self._writes != writes_before:
+                # Пока лист читался, бот сам записал в него: прочитанные значения
+                # уже устарели, а снимок в памяти эту запись содержит
+                return False
+            self._set_state(state, token)
+        if persist:
+            self._save_state(state, token)
+        return True
+
+    def _save_state(self, state: Dict[str, Any], token: str | None) -> None:
         try:
-            result = self.service.spreadsheets().values().get(
-                spreadsheetId=self.spreadsheet_id,
-                range='A:R'
-            ).execute()
-            values = result.get('values', [])
-
-            for i, row in enumerate(values[1:], start=2):
-                if len(row) > 1 and row[1] and int(row[1]) == participant_id:
-                    row += [''] * (18 - len(row))  # Ensure at least 18 columns
-
-                    chat_id_needs_update = not row[16]
-                    telegram_id_needs_update = not row[17]
-
-                    if chat_id_needs_update or telegram_id_needs_update:
-                        update_values = [
-                            [chat_id if chat_id_needs_update else row[16],
-                             telegram_id if telegram_id_needs_update else row[17]]
-                        ]
-                        self.service.spreadsheets().values().update(
-                            spreadsheetId=self.spreadsheet_id,
-                            range=f'Q{i}:R{i}',
-                            valueInputOption='RAW',
-                            body={'values': update_values}
-                        ).execute()
-                    return
+            snapshot_cache.save(dict(
+                state, spreadsheet_id=self.spreadsheet_id, sheet_title=self.sheet_title, token=token
+            ), self.snapshot_cache_path)
+        except Exception as e:
+            logger.error(f"Failed to save snapshot cache: {e}")
+
+    def save_snapshot_cache(self) -> None:
+        """Сохраняет текущие снимок и индексы (при остановке бота)."""
+        if self._snapshot is None:
+            return
+        self._save_state({
+            'snapshot': self._snapshot,
+            'lead_index': self.lead_index,
+            'search_index': self.search_index,
+            'campaign_stats': self.campaign_stats,
+            'segment_index': self.segment_index,
+        }, self._snapshot_token)
+
+    def load_snapshot_cache(self) -> bool:
+        """
+        Поднимает снимок и индексы с диска, чтобы отвечать сразу после запуска.
+
+        Таблицу после этого нужно перечитать (refresh_snapshot) - сохраненный
+        снимок мог устареть, пока бот был остановлен.
+        """
+        state = snapshot_cache.load(self.snapshot_cache_path)
+        if not state or state.get('spreadsheet_id') != self.spreadsheet_id \
+                or state.get('sheet_title') != self.sheet_title:
+            return False
+        state['segment_index']._is_reachable = self.chat_registry.is_active
+        self.chat_registry.apply(state['snapshot'])
+        self._install_state(state, state.get('token'))
+        logger.info(f"Loaded snapshot cache: {len(state['snapshot'].participants)} participants")
+        return True
+
+    def warmup(self) -> Dict[str, float]:
+        """
+        Готовит обработчик к первым запросам после запуска.
+
+        Обновляет токен сервисного аккаунта, читает и индексирует горячий лист
+        (заодно открывая соединение с Sheets API) и архивы. Возвращает время
+        этапов в миллисекундах и признак того, что снимок изменился.
+        """
+        timings = {}
+        started = time.perf_counter()
+        self.credentials.refresh(Request(httplib2.Http()))
+        timings['token_ms'] = round((time.perf_counter() - started) * 1000, 1)
+
+        started = time.perf_counter()
+        timings['snapshot_changed'] = self.refresh_snapshot(persist=True)
+        timings['snapshot_ms'] = round((time.perf_counter() - started) * 1000, 1)
+
+        started = time.perf_counter()
+        self._get_archive(max_age=0)
+        timings['archive_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        return timings
+
+    def get_campaign_stats(self) -> CampaignStats:
+        """Сводные счетчики по конкурсу; таблица перечитывается только при устаревшем снимке."""
+        try:
+            self._get_snapshot()
         except Exception as e:
-            print(f"Error updating IDs in sheet: {e}")
+            logger.error(f"Error refreshing campaign stats: {e}")
+        return self.campaign_stats
 
-    def find_participant_by_telegram_id(self, telegram_id: int) -> list | None:
+    def search(self, query: str) -> List[Dict[str, Any]]:
+        """Полнотекстовый поиск по участникам и лидам (см. SearchIndex)."""
         try:
-            result = self.service.spreadsheets().values().get(
-                spreadsheetId=self.spreadsheet_id,
-                range='A:R'
-            ).execute()
-            values = result.get('values', [])
-            for row in values[1:]:
-                if len(row) > 17 and row[17] and str(row[17]) == str(telegram_id):
-                    return row
-            return None
+            self._get_snapshot()
+            return self.search_index.search(query)
+        except Exception as e:
+            logger.error(f"Error searching: {e}")
+            return []
+
+    def count_segment(self, expression: str) -> int:
+        """Число получателей рассылки в сегменте; SegmentError при ошибке в выражении."""
+        conditions = parse_segment(expression)
+        self._get_snapshot()
+        return self.segment_index.count(conditions)
+
+    def segment_chat_ids(self, expression: str) -> List[int]:
+        """Chat ID участников сегмента (см. segments.py)."""
+        conditions = parse_segment(expression)
+        self._get_snapshot()
+        return self.segment_index.chat_ids(conditions)
+
+    @property
+    def loaded_participants(self) -> int | None:
+        """Число участников в снимке без обращения к таблице; None, пока снимок не загружен."""
+        snapshot = self._snapshot
+        return len(snapshot.participants) if snapshot is not None else None
+
+    def snapshot_version(self) -> Tuple[str | None, int]:
+        """Версия снимка: меняется при перечитывании измененной таблицы и при каждой записи бота."""
+        self._get_snapshot()
+        return self._snapshot_token, self._writes
+
+    def export_snapshot(self) -> Tuple[Tuple[str | None, int], bytes]:
+        """Версия снимка и его участники в pickle - для отрисовки отчетов в других процессах."""
+        self._get_snapshot()
+        with self._lock:
+            return (self._snapshot_token, self._writes), pickle.dumps(self._snapshot.participants, protocol=5)
+
+    def find_duplicate_lead(self, lead_data: Dict[str, Any]) -> Dict[str, Any] | None:
+        """Ищет лида с тем же телефоном ученика/родителя или username (см. LeadIndex)."""
+        try:
+            self._get_snapshot()
+            return self.lead_index.find_duplicate(lead_data)
         except Exception as e:
-            print(f"Error finding participant by telegram_id: {e}")
+            logger.error(f"Error checking duplicate lead: {e}")
             return None
 
-    def append_row(self, values: List[Any]) -> None:
-        # Получаем все строки
-        result = self.service.spreadsheets().values().get(
+    def _write_cells(self, cells: Dict[str, Tuple[Any, Any]], expected: Dict[str, Any] | None = None) -> int:
+        """
+        Записывает только изменившиеся ячейки.
+
+        cells: адрес ячейки (например, 'E5') -> (значение из снимка, новое значение).
+        expected: ячейки, которые не записываются, но должны совпасть со снимком
+        (например, ID участника в строке, если снимок мог устареть).
+        Перед записью проверяет, что в таблице все еще лежат прочитанные значения,
+        иначе бросает WriteConflict. Возвращает число записанных ячеек.
+        """
+        changed = {cell: (old, new) for cell, (old, new) in cells.items() if _cell_str(old) != _cell_str(new)}
+        if not changed:
+            return 0
+
+        checked = dict(changed)
+        for cell, value in (expected or {}).items():
+            checked.setdefault(cell, (value, value))
+        result = self.service.spreadsheets().values().batchGet(
             spreadsheetId=self.spreadsheet_id,
-            range='A:R'
+            ranges=[self._range(cell) for cell in checked],
+            valueRenderOption='UNFORMATTED_VALUE'
         ).execute()
-        rows = result.get('values', [])
-        row_num = len(rows) + 1
-        # Гарантируем 18 элементов (A–R)
-        if len(values) < 18:
-            values += [''] * (18 - len(values))
-        elif len(values) > 18:
-            values = values[:18]
-        # Обновляем диапазон A{row_num}:R{row_num}
-        self.service.spreadsheets().values().update(
+        for value_range, (cell, (old, _)) in zip(result.get('valueRanges', []), checked.items()):
+            rows = value_range.get('values') or [['']]
+            current = rows[0][0] if rows[0] else ''
+            if not _same_cell(old, current):
+                raise WriteConflict(f"{cell}: ожидалось {_cell_str(old)!r}, в таблице {_cell_str(current)!r}")
+
+        self.service.spreadsheets().values().batchUpdate(
             spreadsheetId=self.spreadsheet_id,
-            range=f'A{row_num}:R{row_num}',
-            valueInputOption='RAW',
-            body={'values': [values]}
+            body={
+                'valueInputOption': 'RAW',
+                'data': [{'range': self._range(cell), 'values': [[new]]} for cell, (_, new) in changed.items()]
+            }
         ).execute()
+        with self._lock:
+            self._writes += 1
+        return len(changed)
 
-    def update_participant_row(self, participant_id: int, lead_data: Dict[str, Any], chat_id: int) -> None:
+    def _with_retries(self, operation: Callable[[], Any]) -> Any:
+        """
+        Повторяет операцию чтение-изменение-запись при WriteConflict.
+
+        Каждая попытка заново читает снимок, поэтому ручные правки
+        администраторов не перезаписываются.
+        """
+        for attempt in range(1, MAX_WRITE_ATTEMPTS + 1):
+            try:
+                return operation()
+            except WriteConflict as e:
+                # Снимок расходится с таблицей: следующая попытка читает ее заново
+                self._invalidate_snapshot()
+                if attempt == MAX_WRITE_ATTEMPTS:
+                    raise
+                logger.warning(f"Write conflict, retrying ({attempt}/{MAX_WRITE_ATTEMPTS}): {e}")
+
+    def _register_ids(self, participant: Participant | None, chat_id: int | None, telegram_id: int | None) -> None:
+        if participant is None:
+            return
+        with self._lock:
+            if self.chat_registry.record(participant, chat_id, telegram_id):
+                if participant.telegram_id:
+                    self._snapshot.by_telegram_id.setdefault(participant.telegram_id, participant)
+                self.segment_index.add(participant)
+        if self.chat_registry.should_flush():
+            self.flush_chat_ids()
+
+    def update_ids_in_sheet(self, participant_id: int, chat_id: int, telegram_id: int) -> None:
+        """Запоминает Chat ID и Telegram ID участника; в таблицу они попадут пачкой."""
         try:
-            result = self.service.spreadsheets().values().get(
-                spreadsheetId=self.spreadsheet_id,
-                range='A:R'
-            ).execute()
-            values = result.get('values', [])
-
-            for i, row in enumerate(values):
-                if len(row) > 1 and str(row[1]) == str(participant_id):
-                    updated_row = row[:]
-                    updated_row += [''] * (18 - len(updated_row))
-
-                    new_lead_values = [
-                        lead_data['child_name'],
-                        lead_data['age'],
-                        lead_data['grade'],
-                        lead_data['telegram'],
-                        lead_data['phone'],
-                        lead_data['parent_name'],
-                        lead_data['parent_phone']
-                    ]
-
-                    if updated_row[4] == '':
-                        for j, value in enumerate(new_lead_values):
-                            updated_row[4 + j] = value
-                        if not updated_row[11]:
-                            updated_row[11] = '0'
-                    else:
-                        for j, value in enumerate(new_lead_values):
-                            updated_row[4 + j] = f"{updated_row[4 + j]}\n{value}"
-
-                    if not updated_row[16]:
-                        updated_row[16] = chat_id
-
-                    # Формируем диапазоны без A и M
-                    batch_body = {
-                        'valueInputOption': 'RAW',
-                        'data': [
-                            {
-                                'range': f'B{i+1}:L{i+1}',
-                                'values': [updated_row[1:12]]
-                            },
-                            {
-                                'range': f'N{i+1}:Q{i+1}',
-                                'values': [updated_row[13:17]]
-                            }
-                        ]
-                    }
-                    self.service.spreadsheets().values().batchUpdate(
-                        spreadsheetId=self.spreadsheet_id,
-                        body=batch_body
-                    ).execute()
-                    return
+            self._register_ids(self._get_snapshot().by_participant_id.get(int(participant_id)), chat_id, telegram_id)
         except Exception as e:
-            print(f"Error updating participant row: {e}")
+            logger.error(f"Error updating IDs in sheet: {e}")
 
-    def get_participant_points(self, participant_id: int) -> int:
+    def update_participant_chat_id(self, telegram_id: int, chat_id: int) -> None:
+        """Запоминает Chat ID участника при контакте с ботом (см. ChatRegistry)."""
         try:
-            result = self.service.spreadsheets().values().get(
-                spreadsheetId=self.spreadsheet_id,
-                range='A:R'
-            ).execute()
-            values = result.get('values', [])
-            for row in values:
-                if len(row) > 1 and str(row[1]) == str(participant_id):
-                    # Баллы находятся в колонке L (индекс 11)
-                    if len(row) > 11 and row[11]:
-                        try:
-                            return int(row[11])
-                        except (ValueError, TypeError):
-                            return 0
-                    return 0
+            self._register_ids(self._get_snapshot().by_telegram_id.get(int(telegram_id)), chat_id, None)
+        except Exception as e:
+            logger.error(f"Error updating chat_id: {e}")
+
+    def flush_chat_ids(self) -> int:
+        """Дописывает накопленные Chat ID/Telegram ID (колонки Q/R) одним batchUpdate."""
+        if not len(self.chat_registry):
             return 0
+
+        def write():
+            snapshot = self._get_snapshot(max_age=0)
+            with self._lock:
+                cells, entries = self.chat_registry.pending_cells(snapshot)
+            written = self._write_cells(cells)
+            with self._lock:
+                self.chat_registry.mark_flushed(entries)
+            return written
+
+        try:
+            written = self._with_retries(write)
+            logger.info(f"Backfilled {written} chat/telegram ID cells")
+            return written
         except Exception as e:
-            print(f"Error getting participant points: {e}")
+            logger.error(f"Error backfilling chat IDs: {e}")
             return 0
 
-    def get_all_leads(self, participant_id: int) -> List[Dict[str, Any]]:
+    def mark_chats_inactive(self, chat_ids: List[int]) -> None:
+        """Исключает из рассылок чаты, в которые Telegram больше не доставляет сообщения."""
+        with self._lock:
+            new = self.chat_registry.mark_inactive(chat_ids)
+            if not new or self._snapshot is None:
+                return
+            for participant in self._snapshot.participants:
+                if participant.chat_id in new:
+                    self.segment_index.add(participant)
+
+    def get_all_participants(self) -> List[Participant]:
         try:
+            return list(self._get_snapshot().participants)
+        except Exception as e:
+            logger.error(f"Error getting participants: {e}")
+            return []
+
+    def find_participant_by_telegram_id(self, telegram_id: int) -> Participant | None:
+        try:
+            return self._get_snapshot().by_telegram_id.get(int(telegram_id))
+        except Exception as e:
+            logger.error(f"Error finding participant by telegram_id: {e}")
+            return None
+
+    def append_row(self, values: List[Any]) -> int:
+        """Записывает строку A–R после последней строки таблицы и возвращает ее номер."""
+        # Гарантируем 18 элементов (A–R)
+        values = list(values[:ROW_WIDTH]) + [''] * (ROW_WIDTH - len(values))
+
+        def write():
+            row_num = self._get_snapshot(max_age=0).row_count + 1
+            # Строка могла быть занята после чтения снимка (другая регистрация или ручная правка)
             result = self.service.spreadsheets().values().get(
                 spreadsheetId=self.spreadsheet_id,
-                range='A:R'
+                range=self._range(f'A{row_num}:R{row_num}')
+            ).execute()
+            if result.get('values'):
+                raise WriteConflict(f"строка {row_num} уже занята")
+            # Обновляем диапазон A{row_num}:R{row_num}
+            self.service.spreadsheets().values().update(
+                spreadsheetId=self.spreadsheet_id,
+                range=self._range(f'A{row_num}:R{row_num}'),
+                valueInputOption='RAW',
+                body={'values': [values]}
             ).execute()
-            values = result.get('values', [])
-            leads = []
-            for row in values:
-                if len(row) > 1 and str(row[1]) == str(participant_id):
-                    # Проверяем, есть ли данные о лидах
-                    if len(row) > 4 and row[4]:  # Если есть имя ребенка
-                        child_names = row[4].split('\n') if row[4] else []
-                        ages = row[5].split('\n') if len(row) > 5 and row[5] else []
-                        grades = row[6].split('\n') if len(row) > 6 and row[6] else []
-                        telegrams = row[7].split('\n') if len(row) > 7 and row[7] else []
-                        parent_names = row[8].split('\n') if len(row) > 8 and row[8] else []
-                        parent_phones = row[10].split('\n') if len(row) > 10 and row[10] else []  # Колонка K (индекс 10)
-                        
-                        max_leads = max(
-                            len(child_names), len(ages), len(grades),
-                            len(telegrams), len(parent_names), len(parent_phones)
-                        )
-                        
-                        for i in range(max_leads):
-                            lead = {
-                                'child_name': child_names[i] if i < len(child_names) else '',
-                                'age': ages[i] if i < len(ages) else '',
-                                'grade': grades[i] if i < len(grades) else '',
-                                'telegram': telegrams[i] if i < len(telegrams) else '',
-                                'parent_name': parent_names[i] if i < len(parent_names) else '',
-                                'parent_phone': parent_phones[i] if i < len(parent_phones) else '',
-                                'status': row[12] if len(row) > 12 and row[12] else 'На проверке'  # Колонка M (индекс 12)
-                            }
-                            leads.append(lead)
-            return leads
+            with self._lock:
+                self._writes += 1
+            return row_num
+
+        return self._with_retries(write)
+
+    def update_participant_row(self, participant_id: int, lead_data: Dict[str, Any], chat_id: int) -> None:
+        """Добавляет лида и, если он еще не записан, Chat ID участника."""
+        try:
+            self.add_lead(participant_id, lead_data, chat_id=chat_id)
         except Exception as e:
-            print(f"Error getting leads: {e}")
+            logger.error(f"Error updating participant row: {e}")
+
+    def get_participant_points(self, participant_id: int) -> int:
+        try:
+            participant = self._get_snapshot().by_participant_id.get(int(participant_id))
+            # Баллы находятся в колонке L
+            return participant.points if participant else 0
+        except Exception as e:
+            logger.error(f"Error getting participant points: {e}")
+            return 0
+
+    def get_all_leads(self, participant_id: int) -> List[Lead]:
+        try:
+            participant = self._get_snapshot().by_participant_id.get(int(participant_id))
+            return participant.leads if participant else []
+        except Exception as e:
+            logger.error(f"Error getting leads: {e}")
             return []
 
     def get_max_id(self) -> int:
-        """Возвращает максимальный ID участника из столбца B."""
-        result = self.service.spreadsheets().values().get(
+        """Возвращает максимальный ID участника из столбца B, включая архивные сезоны."""
+        max_id = self._get_snapshot(max_age=0).max_id()
+        try:
+            max_id = max(max_id, self._get_archive().max_id)
+        except Exception as e:
+            logger.error(f"Error reading archive sheets: {e}")
+        return max_id
+
+    def _list_sheets(self) -> List[Dict[str, Any]]:
+        result = self.service.spreadsheets().get(
             spreadsheetId=self.spreadsheet_id,
-            range='B:B'
+            fields='sheets.properties(sheetId,title,index)'
         ).execute()
-        values = result.get('values', [])
-        max_id = 0
-        for row in values[1:]:
-            try:
-                val = int(row[0])
-                if val > max_id:
-                    max_id = val
-            except Exception:
-                continue
-        return max_id
+        return sorted((sheet['properties'] for sheet in result.get('sheets', [])),
+                      key=lambda properties: properties.get('index', 0))
+
+    def _get_archive(self, max_age: float = ARCHIVE_TTL) -> ArchiveIndex:
+        """Индекс архивных листов; архивы читаются одним batchGet и кэшируются надолго."""
+        if self._archive_loaded_at is None or time.monotonic() - self._archive_loaded_at > max_age:
+            titles = [properties['title'] for properties in self._list_sheets()
+                      if is_archive_title(properties['title'])]
+            sheets = []
+            if titles:
+                result = self.service.spreadsheets().values().batchGet(
+                    spreadsheetId=self.spreadsheet_id,
+                    ranges=[f"{quote_sheet_title(title)}!A:R" for title in titles]
+                ).execute()
+                sheets = [(title, value_range.get('values', []))
+                          for title, value_range in zip(titles, result.get('valueRanges', []))]
+            self.archive_index.rebuild(sheets)
+            self._archive_loaded_at = time.monotonic()
+        return self.archive_index
+
+    def restore_archived_participant(self, telegram_id: int, chat_id: int | None = None) -> Participant | None:
+        """Возвращает участника прошлых сезонов в горячий лист с прежним ID."""
+        try:
+            found = self._get_archive().find(telegram_id)
+            if found is None:
+                return None
+            _, archived = found
+            current = self._get_snapshot(max_age=0).by_telegram_id.get(int(telegram_id))
+            if current is not None:
+                return current
+            self.add_participant(
+                archived.participant_id, archived.full_name, archived.course or '',
+                chat_id or archived.chat_id or '', archived.telegram_id
+            )
+            return self._snapshot.by_telegram_id.get(int(telegram_id))
+        except Exception as e:
+            logger.error(f"Error restoring archived participant: {e}")
+            return None
+
+    def preview_rollover(self) -> Dict[str, int]:
+        """Сколько участников уйдет в архив и сколько перейдет в новый сезон."""
+        participants = self._get_snapshot(max_age=0).participants
+        return {'archived': len(participants), 'carried': sum(1 for p in participants if is_active(p))}
+
+    def rollover_season(self, season: str) -> Dict[str, int]:
+        """
+        Переносит текущий сезон в архив "Архив <season>" и начинает новый.
+
+        Горячий лист переименовывается в архив, новый лист с тем же названием
+        получает заголовки и активных участников без лидов и баллов. Все это
+        один запрос spreadsheets().batchUpdate.
+        """
+        sheets = self._list_sheets()
+        if any(properties['title'] == archive_title(season) for properties in sheets):
+            raise ValueError(f"Лист {archive_title(season)} уже существует")
+        hot = next(
+            (properties for properties in sheets if properties['title'] == self.sheet_title),
+            None
+        ) if self.sheet_title else (sheets[0] if sheets else None)
+        if hot is None:
+            raise ValueError("Горячий лист не найден")
+
+        snapshot = self._get_snapshot(max_age=0)
+        carried = [identity_row(participant, snapshot.columns)
+                   for participant in snapshot.participants if is_active(participant)]
+        new_sheet_id = max(properties['sheetId'] for properties in sheets) + 1
+        self.service.spreadsheets().batchUpdate(
+            spreadsheetId=self.spreadsheet_id,
+            body={'requests': rollover_requests(
+                hot['sheetId'], hot['title'], season, new_sheet_id, snapshot.header, carried
+            )}
+        ).execute()
+
+        # Оба кэша устарели: горячий лист новый, архивов стало больше
+        with self._lock:
+            self._writes += 1
+            self._snapshot = None
+            self._archive_loaded_at = None
+        return {'archived': len(snapshot.participants), 'carried': len(carried)}
 
     def add_participant(self, participant_id: int, full_name: str, course: int, chat_id: int = '', telegram_id: int = '') -> None:
         """Добавляет нового участника в Google-таблицу."""
@@ -226,56 +596,143 @@ class GoogleSheetsHandler:
             '',                 # G - Класс (пусто)
             '',                 # H - Telegram (пусто)
             '',                 # I - ФИО родителя (пусто)
-            '',                 # J - пустой столбец
+            '',                 # J - Телефон ученика (пусто)
             '',                 # K - Телефон родителя (пусто)
             '',                 # L - Баллы (пусто, заполняется вручную)
             '',                 # M - Статус (пусто, заполняется вручную)
             '',                 # N - пустой столбец
-            '',                 # O - пустой столбец
+            '',                 # O - Программа (пусто)
             '',                 # P - пустой столбец
             chat_id,            # Q - Chat ID
             telegram_id         # R - Telegram ID
         ]
-        self.append_row(row)
-
-    def add_lead(self, participant_id: int, lead_data: dict) -> None:
-        """Добавляет нового лида к участнику в Google-таблице."""
-        # Получаем все строки
-        result = self.service.spreadsheets().values().get(
-            spreadsheetId=self.spreadsheet_id,
-            range='A:R'
-        ).execute()
-        values = result.get('values', [])
-        for i, row in enumerate(values):
-            if len(row) > 1 and str(row[1]) == str(participant_id):
-                # Обновляем данные по лидам (E–K: 4–10)
-                # E=4: ФИО_лида, F=5: Возраст, G=6: Класс, H=7: Telegram, I=8: ФИО_родителя, K=10: Телефон_родителя
-                lead_data_mapping = {
-                    4: 'child_name',      # E: ФИО_лида
-                    5: 'age',             # F: Возраст  
-                    6: 'grade',           # G: Класс
-                    7: 'telegram',        # H: Telegram
-                    8: 'parent_name',     # I: ФИО_родителя
-                    10: 'parent_phone'    # K: Телефон_родителя (пропускаем J)
-                }
-                
-                for col, key in lead_data_mapping.items():
-                    if len(row) <= col:
-                        row += [''] * (col - len(row) + 1)
-                    if row[col]:
-                        row[col] += f"\n{lead_data.get(key, '')}"
-                    else:
-                        row[col] = str(lead_data.get(key, ''))
-                
-                # НЕ ТРОГАЕМ БАЛЛЫ (колонка L) - они заполняются вручную
-                # НЕ ТРОГАЕМ СТАТУС (колонка M) - он заполняется вручную
-                
-                # Обновляем строку в таблице
-                self.service.spreadsheets().values().update(
-                    spreadsheetId=self.spreadsheet_id,
-                    range=f'A{i+1}:R{i+1}',
-                    valueInputOption='RAW',
-                    body={'values': [row]}
-                ).execute()
+        row_number = self.append_row(row)
+        participant = Participant(
+            row_number, int(participant_id), full_name, int(course) if str(course).isdigit() else None,
+            chat_id=chat_id or None, telegram_id=telegram_id or None
+        )
+        with self._lock:
+            if self._snapshot is None or int(participant_id) in self._snapshot.by_participant_id:
+                # Снимок уже перечитан вместе с новой строкой (или сброшен)
                 return
+            self._snapshot.add(participant)
+            self.search_index.add_participant(participant_id, full_name, course)
+            self.campaign_stats.add_participant(course)
+            self.segment_index.add(participant)
+
+    def pending_leads(self) -> List[Tuple[Participant, Lead]]:
+        """Очередь модерации: лиды со статусом «На проверке»."""
+        return moderation.pending_leads(self._get_snapshot().participants)
+
+    def apply_moderation(self, decisions: moderation.Decisions) -> Dict[str, int]:
+        """
+        Записывает решения сессии модерации одним batchUpdate.
+
+        Для каждого участника меняются статусы лидов (M) и баллы (L) по POINTS;
+        строка сверяется со снимком по ID участника и именам лидов, чтобы
+        номера лидов не сдвинулись из-за ручных правок.
+        """
+        by_participant: Dict[int, Dict[int, str]] = {}
+        for (participant_id, lead_number), status in decisions.items():
+            by_participant.setdefault(participant_id, {})[lead_number] = status
 
+        def write():
+            snapshot = self._get_snapshot()
+            cells, expected, updates = {}, {}, []
+            result = {'approved': 0, 'rejected': 0, 'points': 0, 'missing': 0}
+            for participant_id, lead_decisions in by_participant.items():
+                participant = snapshot.by_participant_id.get(participant_id)
+                if participant is None:
+                    result['missing'] += len(lead_decisions)
+                    continue
+                status, points, counts = moderation.apply_decisions(participant, lead_decisions)
+                if status == '\n'.join(participant.lead_statuses()):
+                    continue
+                row = participant.row_number
+                cells[f"{snapshot.columns.letter('status')}{row}"] = (participant.status, status)
+                cells[f"{snapshot.columns.letter('points')}{row}"] = (participant.points, points)
+                expected[f"{snapshot.columns.letter('participant_id')}{row}"] = participant.participant_id
+                expected[f"{snapshot.columns.letter('child_name')}{row}"] = participant.lead_cell('child_name')
+                updates.append((participant, status, points))
+                result['approved'] += counts['approved']
+                result['rejected'] += counts['rejected']
+                result['points'] += points - participant.points
+            self._write_cells(cells, expected=expected)
+            return updates, result
+
+        updates, result = self._with_retries(write)
+        with self._lock:
+            for participant, status, points in updates:
+                if self._snapshot is None or \
+                        self._snapshot.by_participant_id.get(participant.participant_id) is not participant:
+                    # Снимок заменен во время записи: следующее чтение возьмет решения из таблицы
+                    self._invalidate_snapshot()
+                    break
+                self.campaign_stats.update_points(participant.points, points)
+                participant.status = status
+                participant.points = points
+                self.segment_index.add(participant)
+        return result
+
+    def add_lead(self, participant_id: int, lead_data: dict, chat_id: int | None = None) -> None:
+        """
+        Добавляет нового лида к участнику в Google-таблице.
+
+        Таблица не перечитывается целиком: запись сверяет ячейки лидов и ID
+        участника в строке со снимком, а при расхождении (WriteConflict)
+        повторяется по свежему снимку.
+        """
+        def write():
+            snapshot = self._get_snapshot()
+            participant = snapshot.by_participant_id.get(int(participant_id))
+            if participant is None:
+                snapshot = self._get_snapshot(max_age=0)
+                participant = snapshot.by_participant_id.get(int(participant_id))
+            if participant is None:
+                return None, None
+
+            # Обновляем только ячейки лидов (E–K, O) и статусы (M); баллы (L)
+            # начисляются при модерации и не перезаписываются
+            row = participant.row_number
+            old_cells = {field: participant.lead_cell(field) for field in LEAD_FIELDS}
+            lead_number = participant.lead_count
+            # Статусы в M идут по одному на лида: новому лиду - «На проверке»
+            old_status = participant.status
+            new_status = '\n'.join(participant.lead_statuses() + [DEFAULT_STATUS]) if old_status else old_status
+            new_cells = participant.append_lead(lead_data)
+            cells = {
+                f"{snapshot.columns.letter(field)}{row}": (old_cells[field], new_cells[field])
+                for field in LEAD_FIELDS
+            }
+            cells[f"{snapshot.columns.letter('status')}{row}"] = (old_status, new_status)
+            if chat_id and not participant.chat_id:
+                cells[f"{snapshot.columns.letter('chat_id')}{row}"] = (participant.chat_id, chat_id)
+            try:
+                self._write_cells(cells, expected={
+                    f"{snapshot.columns.letter('participant_id')}{row}": participant.participant_id
+                })
+            except Exception:
+                # append_lead уже добавил лида в снимок; без записи снимок нужно перечитать
+                self._invalidate_snapshot()
+                raise
+            if chat_id and not participant.chat_id:
+                participant.chat_id = chat_id
+            participant.status = new_status
+            return participant, lead_number
+
+        participant, lead_number = self._with_retries(write)
+        if participant is None:
+            return
+
+        with self._lock:
+            if self._snapshot is None or self._snapshot.by_participant_id.get(int(participant_id)) is not participant:
+                # Другой поток успел заменить снимок; пусть следующее чтение возьмет лида из таблицы
+                self._invalidate_snapshot()
+                return
+            self.lead_index.add(participant_id, lead_number, lead_data)
+            self.search_index.add_lead(
+                participant_id, lead_number, lead_data.get('child_name', ''),
+                lead_data.get('telegram', ''), lead_data.get('parent_name', ''), participant.full_name
+            )
+            self.campaign_stats.add_lead(lead_data)
+            self.segment_index.add(participant)
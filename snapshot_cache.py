@@ -0,0 +1,69 @@
+"""
+Снимок таблицы и индексы на диске для быстрого перезапуска.
+
+После каждого полного чтения листа разобранный снимок, индексы и токен
+изменений (хэш значений A:R) сохраняются в SNAPSHOT_CACHE_FILE. При запуске
+бот загружает их и сразу отвечает пользователям, а лист перечитывает в фоне:
+если токен не изменился, разбор и индексация пропускаются.
+
+Файл - заголовок (MAGIC, версия формата) и pickle protocol 5. Читается через
+mmap без промежуточной копии файла в памяти. Файл пишет только сам бот;
+при несовпадении версии, таблицы или листа он игнорируется.
+"""
+
+import gc
+import os
+import json
+import mmap
+import pickle
+import struct
+import hashlib
+import logging
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_CACHE_FILE = os.getenv('SNAPSHOT_CACHE_FILE', 'snapshot_cache.bin')
+MAGIC = b'SGSNAP'
+FORMAT_VERSION = 2  # Увеличивать при изменении классов снимка и индексов
+HEADER = struct.Struct('<6sH')
+
+
+def values_token(values: List[list]) -> str:
+    """Токен изменений листа: одинаковые значения A:R дают одинаковый токен."""
+    return hashlib.blake2b(
+        json.dumps(values, ensure_ascii=False, separators=(',', ':')).encode('utf-8'),
+        digest_size=16
+    ).hexdigest()
+
+
+def save(state: Dict[str, Any], path: str = SNAPSHOT_CACHE_FILE) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION))
+        pickle.dump(state, f, protocol=5)
+    os.replace(tmp_path, path)
+
+
+def load(path: str = SNAPSHOT_CACHE_FILE) -> Optional[Dict[str, Any]]:
+    """Загружает сохраненное состояние; None, если файла нет или он не подходит."""
+    if not os.path.exists(path) or os.path.getsize(path) <= HEADER.size:
+        return None
+    try:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            magic, version = HEADER.unpack_from(mapped)
+            if magic != MAGIC or version != FORMAT_VERSION:
+                logger.info(f"Ignoring {path}: format {magic!r} v{version}")
+                return None
+            # Сборщик мусора на миллионах новых объектов замедляет загрузку в несколько раз
+            gc_enabled = gc.isenabled()
+            gc.disable()
+            try:
+                with memoryview(mapped) as view:
+                    return pickle.loads(view[HEADER.size:])
+            finally:
+                if gc_enabled:
+                    gc.enable()
+    except Exception as e:
+        logger.error(f"Failed to load {path}: {e}")
+        return None
@@ -0,0 +1,278 @@
+"""
+Несколько ботов в одном процессе (многоботовый режим).
+
+Если задан TENANTS_FILE, процесс запускает по Application на каждого бота из
+файла, иначе - одного бота из .env (BOT_TOKEN, SPREADSHEET_ID). Формат файла:
+
+    [
+      {
+        "name": "singularity",
+        "bot_token_env": "BOT_TOKEN_SINGULARITY",
+        "spreadsheet_id": "...",
+        "admin_ids": [641057657],
+        "credentials": "credentials.json",
+        "active_sheet": null
+      }
+    ]
+
+Вместо bot_token_env можно указать сам bot_token. Общие на процесс: цикл
+событий, пул HTTP-соединений к Telegram (SharedHTTPXRequest), клиент Sheets API
+на каждый файл учетных данных, квота Sheets API (throttle.sheets_quota) и пул
+процессов отчетов. У каждого бота свои снимок таблицы и индексы, файлы кэша
+в data/<name>/, кэш file_id промо-материалов и метрики (TenantMetrics).
+
+Обработчики в bot.py обращаются к таблице текущего бота через TenantProxy:
+бот, получивший апдейт, задается в current_tenant оберткой use_tenant, а для
+задач JobQueue - оберткой tenant_job.
+"""
+
+import os
+import json
+import time
+import signal
+import asyncio
+import logging
+import contextvars
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Dict, List
+
+from telegram import Update
+
+from log_setup import tenant_var, wrap_callbacks
+from locks import KeyedLocks
+from promo_media import FileIdCache, CACHE_FILE, file_id_cache
+from reports import ReportService, LEADS_HISTORY_FILE
+from sheets_handler import GoogleSheetsHandler, google_client
+from tracing import TracedHTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+TENANTS_FILE = os.getenv('TENANTS_FILE')
+TENANTS_DATA_DIR = os.getenv('TENANTS_DATA_DIR', 'data')
+DEFAULT_CREDENTIALS = 'credentials.json'
+
+current_tenant_var = contextvars.ContextVar('current_tenant', default=None)
+
+
+class TenantMetrics:
+    """Счетчики апдейтов одного бота."""
+
+    def __init__(self):
+        self.updates = 0
+        self.errors = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def observe(self, latency: float, failed: bool) -> None:
+        self.updates += 1
+        self.errors += failed
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'updates': self.updates,
+            'errors': self.errors,
+            'avg_latency_ms': round(self.latency_total / self.updates * 1000, 1) if self.updates else None,
+            'max_latency_ms': round(self.latency_max * 1000, 1),
+        }
+
+
+class Tenant:
+    """Один бот: токен, таблица, админы и все, что у ботов не общее."""
+
+    def __init__(self, name: str, bot_token: str, spreadsheet_id: str, admin_ids: List[int],
+                 credentials_path: str = DEFAULT_CREDENTIALS, sheet_title: str | None = None,
+                 data_dir: str = '', client=None):
+        self.name = name
+        self.bot_token = bot_token
+        self.admin_ids = list(admin_ids)
+        self.data_dir = data_dir
+        if data_dir:
+            os.makedirs(data_dir, exist_ok=True)
+        self.sheets = GoogleSheetsHandler(
+            credentials_path=credentials_path,
+            spreadsheet_id=spreadsheet_id,
+            sheet_title=sheet_title,
+            data_dir=data_dir,
+            client=client
+        )
+        self.reports = ReportService(self.sheets, os.path.join(data_dir, LEADS_HISTORY_FILE))
+        self.media_cache = FileIdCache(os.path.join(data_dir, CACHE_FILE)) if data_dir else file_id_cache
+        self.participant_locks = KeyedLocks()
+        self.registration_lock = asyncio.Lock()
+        self.metrics = TenantMetrics()
+        # Объем user_data и chat_data приложения бота (UserDataJanitor.footprint)
+        self.footprint: Callable[[], Dict[str, Any]] | None = None
+
+    def __repr__(self) -> str:
+        return f"Tenant({self.name!r})"
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(
+            self.metrics.as_dict(),
+            participants=self.sheets.loaded_participants,
+            pending_chat_ids=len(self.sheets.chat_registry),
+            **(self.footprint() if self.footprint else {}),
+        )
+
+
+def load_tenants(default_admin_ids: List[int]) -> List[Tenant]:
+    """Боты из TENANTS_FILE или один бот из .env."""
+    if not TENANTS_FILE:
+        return [Tenant(
+            name='default',
+            bot_token=os.getenv('BOT_TOKEN'),
+            spreadsheet_id=os.getenv('SPREADSHEET_ID'),
+            admin_ids=default_admin_ids,
+        )]
+
+    with open(TENANTS_FILE, 'r', encoding='utf-8') as f:
+        configs = json.load(f)
+    clients = {}  # Файл учетных данных -> (credentials, service), один на процесс
+    tenants = []
+    for config in configs:
+        name = config['name']
+        credentials_path = config.get('credentials', DEFAULT_CREDENTIALS)
+        if credentials_path not in clients:
+            clients[credentials_path] = google_client(credentials_path)
+        bot_token = config.get('bot_token') or os.getenv(config.get('bot_token_env', ''))
+        if not bot_token:
+            raise ValueError(f"{TENANTS_FILE}: no bot token for {name}")
+        tenants.append(Tenant(
+            name=name,
+            bot_token=bot_token,
+            spreadsheet_id=config['spreadsheet_id'],
+            admin_ids=config.get('admin_ids', default_admin_ids),
+            credentials_path=credentials_path,
+            sheet_title=config.get('active_sheet'),
+            data_dir=os.path.join(TENANTS_DATA_DIR, name),
+            client=clients[credentials_path],
+        ))
+    if len({tenant.name for tenant in tenants}) != len(tenants):
+        raise ValueError(f"{TENANTS_FILE}: tenant names must be unique")
+    logger.info(f"Loaded {len(tenants)} tenants from {TENANTS_FILE}: {[t.name for t in tenants]}")
+    return tenants
+
+
+def current_tenant() -> Tenant:
+    tenant = current_tenant_var.get()
+    if tenant is None:
+        raise RuntimeError("No current tenant: called outside of an update handler")
+    return tenant
+
+
+class TenantProxy:
+    """Атрибут текущего бота: TenantProxy('sheets').search(...) -> current_tenant().sheets.search(...)."""
+
+    __slots__ = ('_attribute',)
+
+    def __init__(self, attribute: str):
+        self._attribute = attribute
+
+    def __getattr__(self, name: str):
+        return getattr(getattr(current_tenant(), self._attribute), name)
+
+    def __repr__(self) -> str:
+        return f"TenantProxy({self._attribute!r})"
+
+
+@contextmanager
+def tenant_context(tenant: Tenant):
+    """Делает tenant текущим ботом (для TenantProxy и логов) внутри блока."""
+    tokens = (current_tenant_var.set(tenant), tenant_var.set(tenant.name))
+    try:
+        yield tenant
+    finally:
+        tenant_var.reset(tokens[1])
+        current_tenant_var.reset(tokens[0])
+
+
+def _tenant_callback(tenant: Tenant):
+    def wrapper(callback):
+        @wraps(callback)
+        async def wrapped(update, context, *args, **kwargs):
+            started = time.perf_counter()
+            failed = True
+            with tenant_context(tenant):
+                try:
+                    result = await callback(update, context, *args, **kwargs)
+                    failed = False
+                    return result
+                finally:
+                    tenant.metrics.observe(time.perf_counter() - started, failed)
+        return wrapped
+    return wrapper
+
+
+def tenant_job(callback):
+    """Обертка задачи JobQueue: бот задачи берется из bot_data приложения (см. use_tenant)."""
+    @wraps(callback)
+    async def wrapped(context):
+        with tenant_context(context.application.bot_data['tenant']):
+            return await callback(context)
+    return wrapped
+
+
+def use_tenant(application, tenant: Tenant) -> None:
+    """Задает бота для всех обработчиков приложения; вызывать после остальных оберток."""
+    application.bot_data['tenant'] = tenant
+    wrap_callbacks(application, _tenant_callback(tenant))
+
+
+class SharedHTTPXRequest(TracedHTTPXRequest):
+    """
+    Один пул соединений к Bot API на все боты процесса.
+
+    Токен бота входит в URL запроса, поэтому клиент httpx можно делить;
+    соединения закрываются, когда остановлен последний бот.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._users = 0
+
+    async def initialize(self) -> None:
+        self._users += 1
+        await super().initialize()
+
+    async def shutdown(self) -> None:
+        self._users -= 1
+        if self._users <= 0:
+            await super().shutdown()
+
+
+async def run_applications(applications: list) -> None:
+    """
+    Запускает приложения в одном цикле событий до SIGINT/SIGTERM.
+
+    Порядок запуска и остановки тот же, что у Application.run_polling.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    initialized = []
+    try:
+        for application in applications:
+            await application.initialize()
+            initialized.append(application)
+            if application.post_init:
+                await application.post_init(application)
+            await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+            await application.start()
+        logger.info(f"Running {len(applications)} bots")
+        await stop.wait()
+    finally:
+        for application in reversed(initialized):
+            try:
+                if application.updater.running:
+                    await application.updater.stop()
+                if application.running:
+                    await application.stop()
+            finally:
+                await application.shutdown()
+                if application.post_shutdown:
+                    await application.post_shutdown(application)
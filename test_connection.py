@@ -7,6 +7,27 @@ import os
 from dotenv import load_dotenv
 from sheets_handler import GoogleSheetsHandler
 
+def check_sheets_access(sheets_handler: GoogleSheetsHandler) -> str:
+    """Читает заголовок таблицы; возвращает его описание или бросает исключение.
+
+    Используется и этим скриптом, и проверкой готовности бота (health.py).
+    """
+    result = sheets_handler.service.spreadsheets().values().get(
+        spreadsheetId=sheets_handler.spreadsheet_id,
+        range=sheets_handler.sheet_range('A1:R1')
+    ).execute()
+    header = result.get('values', [[]])
+    return f"{len(header[0]) if header else 0} колонок в заголовке"
+
+def check_bot_token() -> str | None:
+    """Возвращает описание проблемы с BOT_TOKEN или None, если токен задан."""
+    bot_token = os.getenv('BOT_TOKEN')
+    if not bot_token:
+        return "BOT_TOKEN не найден в файле .env!"
+    if bot_token == 'your_bot_token_here':
+        return "BOT_TOKEN не настроен (используется значение по умолчанию)"
+    return None
+
 def test_google_sheets_connection():
     """Тестирует подключение к Google Sheets."""
     
@@ -41,6 +62,7 @@ def test_google_sheets_connection():
         )
         
         print("✅ Подключение к Google Sheets установлено")
+        print(f"✅ Доступ к таблице есть: {check_sheets_access(sheets_handler)}")
         
         # Тестируем чтение данных
         print("📖 Тестирование чтения данных...")
@@ -87,14 +109,10 @@ def test_bot_token():
     print("\n🤖 Проверка токена бота...")
     
     load_dotenv()
-    bot_token = os.getenv('BOT_TOKEN')
+    problem = check_bot_token()
     
-    if not bot_token:
-        print("❌ BOT_TOKEN не найден в файле .env!")
-        return False
-    
-    if bot_token == 'your_bot_token_here':
-        print("❌ BOT_TOKEN не настроен (используется значение по умолчанию)")
+    if problem:
+        print(f"❌ {problem}")
         return False
     
     print("✅ BOT_TOKEN найден")
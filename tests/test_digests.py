@@ -0,0 +1,45 @@
+import random
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from digests import TIMEZONE, DigestScheduler, parse_schedule, plan_delivery, quiet_until
+
+
+def test_parse_schedule():
+    day, at = parse_schedule('mon 10:00')
+    assert day == 1 and (at.hour, at.minute) == (10, 0)
+    assert parse_schedule(' ') is None
+
+
+def test_quiet_until_overnight():
+    evening = datetime(2025, 3, 3, 23, 30, tzinfo=TIMEZONE)
+    assert quiet_until(evening, (22, 9)) == datetime(2025, 3, 4, 9, 0, tzinfo=TIMEZONE)
+    assert quiet_until(evening.replace(hour=12), (22, 9)) is None
+    assert quiet_until(evening, None) is None
+
+
+def test_plan_delivery_respects_rate():
+    start = datetime(2025, 3, 3, 10, 0, tzinfo=TIMEZONE)
+    times = plan_delivery(100, start, window=10, rate=5, jitter=0)
+    assert times[0] == start
+    assert times[-1] - times[0] == timedelta(seconds=99 / 5)
+
+
+def test_respread_spreads_messages_held_by_quiet_hours():
+    scheduler = DigestScheduler(SimpleNamespace(job_queue=None), quiet=(22, 9))
+    held_from = datetime(2025, 3, 3, 22, 0, tzinfo=TIMEZONE)
+    resume_at = datetime(2025, 3, 4, 9, 0, tzinfo=TIMEZONE)
+    later = resume_at + timedelta(hours=5)
+    scheduler._queue = [(held_from + timedelta(seconds=i), i, 'digest', i, 'text') for i in range(50)]
+    scheduler._queue.append((later, 50, 'digest', 50, 'text'))
+
+    random.seed(1)
+    scheduler.respread(resume_at)
+
+    times = sorted(item[0] for item in scheduler._queue)
+    assert len(times) == 51
+    assert times[0] >= resume_at
+    assert later in times
+    held = [t for t in times if t != later]
+    # Раньше все 50 ушли бы подряд в 9:00; теперь они распределены по окну
+    assert held[-1] - held[0] > timedelta(minutes=30)
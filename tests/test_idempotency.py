@@ -0,0 +1,75 @@
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+
+import idempotency
+from idempotency import DONE, PENDING, IdempotencyCache, claim, content_hash
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_cache_states_and_ttl():
+    clock = Clock()
+    cache = IdempotencyCache(ttl=10, max_keys=100)
+    with mock.patch('idempotency.time.monotonic', clock):
+        assert cache.state(['a']) is None
+        cache.set(['a', 'b'], PENDING)
+        assert cache.state(['b', 'c']) == PENDING
+        cache.set(['c'], DONE)
+        assert cache.state(['a', 'c']) == DONE
+        clock.now += 11
+        assert cache.state(['a', 'b', 'c']) is None
+        assert len(cache) == 0
+
+
+def test_cache_evicts_oldest_over_limit():
+    cache = IdempotencyCache(ttl=60, max_keys=2)
+    for key in ('a', 'b', 'c'):
+        cache.set([key], DONE)
+    assert cache.state(['a']) is None
+    assert cache.state(['b']) == cache.state(['c']) == DONE
+
+
+def test_content_hash_normalizes_case_and_spaces():
+    assert content_hash('Иван  Иванов', 1) == content_hash(' иван иванов ', '1')
+    assert content_hash('Иван', 1) != content_hash('Иван', 2)
+
+
+def make_update(update_id, message_id, user_id=5):
+    return SimpleNamespace(
+        update_id=update_id,
+        effective_message=SimpleNamespace(chat_id=user_id, message_id=message_id),
+        effective_user=SimpleNamespace(id=user_id),
+    )
+
+
+def test_claim_rejects_redelivery_and_resubmission():
+    context = SimpleNamespace(bot=SimpleNamespace(id=1))
+    with mock.patch.object(idempotency, 'submissions', IdempotencyCache()):
+        with claim(make_update(1, 10), context, 'lead', 'Иван') as submission:
+            assert submission.duplicate is None
+            with claim(make_update(1, 10), context, 'lead', 'Иван') as redelivered:
+                assert redelivered.duplicate == PENDING
+            submission.done()
+        # То же содержимое в новом сообщении - повторная отправка
+        with claim(make_update(2, 11), context, 'lead', ' иван ') as repeated:
+            assert repeated.duplicate == DONE
+        with claim(make_update(3, 12), context, 'lead', 'Петр') as other:
+            assert other.duplicate is None
+
+
+def test_failed_claim_releases_keys():
+    context = SimpleNamespace(bot=SimpleNamespace(id=1))
+    with mock.patch.object(idempotency, 'submissions', IdempotencyCache()):
+        with pytest.raises(RuntimeError):
+            with claim(make_update(1, 10), context, 'registration', 'Иван'):
+                raise RuntimeError('Sheets unavailable')
+        with claim(make_update(1, 10), context, 'registration', 'Иван') as retry:
+            assert retry.duplicate is None
@@ -0,0 +1,47 @@
+from lead_form import LEAD_TEMPLATE, MAX_AGE, MIN_AGE, parse_lead_form
+
+
+def form(**overrides) -> str:
+    lines = dict(line.split(': ', 1) for line in LEAD_TEMPLATE.splitlines())
+    lines.update(overrides)
+    return '\n'.join(f"{label}: {value}" for label, value in lines.items())
+
+
+def test_template_is_valid():
+    lead_data, errors = parse_lead_form(LEAD_TEMPLATE)
+    assert errors == []
+    assert lead_data == {
+        'child_name': 'Иванов Иван Иванович',
+        'parent_name': 'Иванова Мария Петровна',
+        'age': 14,
+        'grade': 8,
+        'telegram': '@ivanov',
+        'phone': '+79991234567',
+        'parent_phone': '+79997654321',
+        'program_type': 'lead_camp_do',
+    }
+
+
+def test_age_bounds():
+    for age in (str(MIN_AGE), str(MAX_AGE)):
+        assert parse_lead_form(form(**{'Возраст': age}))[1] == []
+    for age in ('0', str(MAX_AGE + 1), '150', 'четырнадцать'):
+        _, errors = parse_lead_form(form(**{'Возраст': age}))
+        assert len(errors) == 1 and errors[0].startswith('Возраст')
+
+
+def test_grade_selects_program():
+    lead_data, errors = parse_lead_form(form(**{'Класс': '9'}))
+    assert errors == [] and lead_data['program_type'] == 'lead_college'
+    lead_data, errors = parse_lead_form(form(**{'Класс': '9', 'Программа': 'Кэмп/ДО'}))
+    assert errors == [] and lead_data['program_type'] == 'lead_camp_do'
+    _, errors = parse_lead_form(form(**{'Класс': '11'}))
+    assert errors and errors[0].startswith('Класс')
+
+
+def test_reports_every_field_error():
+    lead_data, errors = parse_lead_form("ФИО ученика: Петров\nTelegram: нет\nЧто-то: еще")
+    assert lead_data['telegram'] == 'Не указан'
+    assert 'Непонятная строка «Что-то: еще»' in errors
+    assert 'Возраст: не заполнено' in errors
+    assert 'Телефон родителя: не заполнено' in errors
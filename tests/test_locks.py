@@ -0,0 +1,87 @@
+import asyncio
+from datetime import datetime
+
+from telegram import Chat, Message, Update, User
+
+from locks import KeyedLocks, PerUserUpdateProcessor, update_key
+
+
+def make_update(update_id: int, user_id: int) -> Update:
+    chat = Chat(user_id, Chat.PRIVATE)
+    user = User(user_id, 'user', False)
+    return Update(update_id, message=Message(update_id, datetime.now(), chat, from_user=user, text='x'))
+
+
+def run_updates(processor, user_ids):
+    """Обрабатывает апдейты пользователей user_ids; возвращает наибольшую параллельность по пользователю и всего."""
+    active = {}
+    peaks = {'total': 0}
+
+    async def work(user_id):
+        active[user_id] = active.get(user_id, 0) + 1
+        peaks[user_id] = max(peaks.get(user_id, 0), active[user_id])
+        peaks['total'] = max(peaks['total'], sum(active.values()))
+        await asyncio.sleep(0.01)
+        active[user_id] -= 1
+
+    async def main():
+        await asyncio.gather(*(
+            processor.process_update(make_update(i, user_id), work(user_id))
+            for i, user_id in enumerate(user_ids)
+        ))
+
+    asyncio.run(main())
+    return peaks
+
+
+def test_update_key_prefers_user():
+    assert update_key(make_update(1, 42)) == ('user', 42)
+    assert update_key(object()) is None
+
+
+def test_same_user_updates_run_one_at_a_time():
+    peaks = run_updates(PerUserUpdateProcessor(8), [1, 1, 1, 2, 2])
+    assert peaks[1] == 1
+    assert peaks[2] == 1
+    assert peaks['total'] == 2
+
+
+def test_concurrency_limit_applies_across_users():
+    processor = PerUserUpdateProcessor(2)
+    assert processor.max_concurrent_updates == 2
+    assert run_updates(processor, [1, 2, 3, 4])['total'] == 2
+
+
+def test_keyed_locks_release_keys():
+    locks = KeyedLocks()
+
+    async def main():
+        async with locks.hold('a'):
+            assert len(locks) == 1
+        assert len(locks) == 0
+
+    asyncio.run(main())
+
+
+def test_hold_all_waits_for_every_key():
+    locks = KeyedLocks()
+    order = []
+
+    async def single(key):
+        async with locks.hold(key):
+            order.append(('start', key))
+            await asyncio.sleep(0.02)
+            order.append(('end', key))
+
+    async def many():
+        await asyncio.sleep(0.005)
+        async with locks.hold_all([3, 1, 3]):
+            order.append(('start', 'all'))
+
+    async def main():
+        await asyncio.gather(single(1), single(3), many())
+        assert len(locks) == 0
+
+    asyncio.run(main())
+    assert order.index(('start', 'all')) > order.index(('end', 1))
+    assert order.index(('start', 'all')) > order.index(('end', 3))
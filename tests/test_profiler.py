@@ -0,0 +1,34 @@
+import os
+import threading
+
+from profiler import SamplingProfiler, is_project_file
+
+
+def test_is_project_file_skips_virtualenv(tmp_path):
+    project = str(tmp_path)
+    assert is_project_file(os.path.join(project, 'bot.py'), project)
+    assert not is_project_file(os.path.join(project, '.venv', 'lib', 'site-packages', 'x.py'), project)
+    assert not is_project_file('/usr/lib/python3/asyncio/events.py', project)
+
+
+def test_reports_while_sampling_new_stacks():
+    profiler = SamplingProfiler()
+    stop = threading.Event()
+
+    def add_stacks():
+        for count in range(20000):
+            if stop.is_set():
+                break
+            profiler._record(f"bot:handler{count}")
+
+    writer = threading.Thread(target=add_stacks)
+    writer.start()
+    profiler.started_at = 0.0
+    try:
+        for _ in range(50):
+            profiler.collapsed()
+            profiler.top()
+    finally:
+        stop.set()
+        writer.join()
+    assert profiler.collapsed().count('\n') == len(profiler.stacks)
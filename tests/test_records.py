@@ -0,0 +1,76 @@
+from records import (
+    DEFAULT_COLUMNS, DEFAULT_STATUS, STATUS_APPROVED, ColumnMap, Participant, Snapshot, column_letter
+)
+
+STANDARD_HEADER = [
+    '', 'ID_участника', 'ФИО', 'Курс', 'ФИО_лида', 'Возраст', 'Класс', 'Telegram', 'ФИО_родителя',
+    'Телефон_ученика', 'Телефон_родителя', 'Баллы', 'Статус', '', 'Программа', '', 'Chat_ID', 'Telegram_ID'
+]
+# Старый create_table.py: подписи I и J перепутаны, данные лежат по стандартной структуре
+LEGACY_HEADER = STANDARD_HEADER[:8] + ['Телефон_ученика', 'ФИО_родителя'] + STANDARD_HEADER[10:]
+
+
+def test_column_letter():
+    assert column_letter(0) == 'A'
+    assert column_letter(17) == 'R'
+    assert ColumnMap().letter('points') == 'L'
+
+
+def test_from_header_standard_and_moved_columns():
+    assert ColumnMap.from_header(STANDARD_HEADER).columns == DEFAULT_COLUMNS
+    moved = ['ID_участника', 'Баллы', 'ФИО']
+    columns = ColumnMap.from_header(moved)
+    assert (columns['participant_id'], columns['points'], columns['full_name']) == (0, 1, 2)
+    # Поля, которых нет в заголовке, берутся по умолчанию
+    assert columns['chat_id'] == DEFAULT_COLUMNS['chat_id']
+
+
+def test_from_header_without_participant_id_uses_defaults():
+    assert ColumnMap.from_header(['Баллы', 'ФИО']).columns == DEFAULT_COLUMNS
+    assert ColumnMap.from_header([]).columns == DEFAULT_COLUMNS
+
+
+def test_from_header_legacy_phone_columns():
+    assert ColumnMap.is_legacy_header(LEGACY_HEADER)
+    assert not ColumnMap.is_legacy_header(STANDARD_HEADER)
+    columns = ColumnMap.from_header(LEGACY_HEADER)
+    assert columns['parent_name'] == 8
+    assert columns['phone'] == 9
+
+
+def test_lead_statuses():
+    def statuses(status, leads=3):
+        return Participant(2, 1, status=status, lead_cells=('\n'.join('abc'[:leads]),)).lead_statuses()
+
+    assert statuses('') == [DEFAULT_STATUS] * 3
+    # Одно значение без переносов относится ко всем лидам
+    assert statuses(STATUS_APPROVED) == [STATUS_APPROVED] * 3
+    assert statuses(f"{STATUS_APPROVED}\n\n") == [STATUS_APPROVED, DEFAULT_STATUS, DEFAULT_STATUS]
+    assert statuses(f"{STATUS_APPROVED}\n{STATUS_APPROVED}", leads=1) == [STATUS_APPROVED]
+    assert Participant(2, 1).lead_statuses() == []
+
+
+def test_append_lead_aligns_columns():
+    participant = Participant(2, 1, lead_cells=('Иван', '14', '8', '@ivan', 'Мария', '', '', ''))
+    cells = participant.append_lead({
+        'child_name': 'Петр', 'age': 12, 'grade': 6, 'telegram': 'Не указан', 'parent_name': 'Ольга',
+        'phone': '+79990000000', 'parent_phone': '+79990000001', 'program_type': 'lead_camp_do',
+    })
+    assert cells['child_name'] == 'Иван\nПетр'
+    assert cells['age'] == '14\n12'
+    # Пустые колонки первого лида выравниваются по числу лидов
+    assert cells['phone'] == '\n+79990000000'
+    assert cells['program_type'] == '\nlead_camp_do'
+    assert participant.lead_count == 2
+    assert [lead.child_name for lead in participant.leads] == ['Иван', 'Петр']
+    assert participant.lead_values('phone') == ['', '+79990000000']
+
+
+def test_snapshot_indexes_rows():
+    row = [''] * 18
+    row[1], row[2], row[11], row[17] = '7', 'Участник', '30', '1001'
+    snapshot = Snapshot([STANDARD_HEADER, row, ['', 'не число']])
+    participant = snapshot.by_participant_id[7]
+    assert participant.points == 30
+    assert snapshot.by_telegram_id[1001] is participant
+    assert snapshot.max_id() == 7
@@ -0,0 +1,32 @@
+import snapshot_cache
+from records import Snapshot
+
+HEADER = ['', 'ID_участника', 'ФИО', 'Курс', 'ФИО_лида']
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'snapshot_cache.bin')
+    values = [HEADER, ['', '1', 'Участник', '2', 'Иван\nПетр']]
+    state = {'token': snapshot_cache.values_token(values), 'snapshot': Snapshot(values)}
+    snapshot_cache.save(state, path)
+
+    loaded = snapshot_cache.load(path)
+    assert loaded['token'] == state['token']
+    participant = loaded['snapshot'].by_participant_id[1]
+    assert participant.full_name == 'Участник'
+    assert participant.lead_values('child_name') == ['Иван', 'Петр']
+
+
+def test_values_token_tracks_changes():
+    values = [HEADER, ['', '1', 'Участник']]
+    assert snapshot_cache.values_token(values) == snapshot_cache.values_token([list(row) for row in values])
+    assert snapshot_cache.values_token(values) != snapshot_cache.values_token([HEADER, ['', '1', 'Другой']])
+
+
+def test_ignores_missing_and_foreign_files(tmp_path):
+    path = tmp_path / 'snapshot_cache.bin'
+    assert snapshot_cache.load(str(path)) is None
+    path.write_bytes(snapshot_cache.HEADER.pack(snapshot_cache.MAGIC, snapshot_cache.FORMAT_VERSION - 1) + b'data')
+    assert snapshot_cache.load(str(path)) is None
+    path.write_bytes(b'not a snapshot cache')
+    assert snapshot_cache.load(str(path)) is None
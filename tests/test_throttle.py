@@ -0,0 +1,69 @@
+import asyncio
+from types import SimpleNamespace
+from unittest import mock
+
+import throttle
+from throttle import DUPLICATE_TEXT, TokenBucketLimiter, rate_limited
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_allows_burst_then_refills():
+    clock = Clock()
+    limiter = TokenBucketLimiter(capacity=2, refill_per_second=0.5)
+    with mock.patch('throttle.time.monotonic', clock):
+        assert limiter.consume(1) == (True, 0.0)
+        assert limiter.consume(1) == (True, 0.0)
+        allowed, retry_after = limiter.consume(1)
+        assert not allowed and retry_after == 2.0
+        # Ведра пользователей независимы
+        assert limiter.consume(2)[0]
+        clock.now += 2
+        assert limiter.consume(1)[0]
+
+
+def test_token_bucket_warns_once_per_wait():
+    clock = Clock()
+    limiter = TokenBucketLimiter(capacity=1, refill_per_second=1)
+    with mock.patch('throttle.time.monotonic', clock):
+        limiter.consume(1)
+        _, retry_after = limiter.consume(1)
+        assert limiter.should_warn(1, retry_after)
+        assert not limiter.should_warn(1, retry_after)
+        clock.now += retry_after
+        assert limiter.should_warn(1, retry_after)
+
+
+def make_update(user_id=1, data='stats'):
+    query = SimpleNamespace(data=data, answer=mock.AsyncMock())
+    return SimpleNamespace(
+        callback_query=query, effective_message=None, effective_user=SimpleNamespace(id=user_id)
+    )
+
+
+def test_duplicate_is_answered_and_keeps_state():
+    calls = []
+
+    @rate_limited
+    async def handler(update, context):
+        calls.append(update)
+        return 'NEXT_STATE'
+
+    context = SimpleNamespace(bot=SimpleNamespace(id=99))
+    first, duplicate = make_update(), make_update()
+
+    async def main():
+        with mock.patch.dict(throttle._recent, clear=True), \
+                mock.patch.object(throttle, 'limiter', TokenBucketLimiter()):
+            assert await handler(first, context) == 'NEXT_STATE'
+            assert await handler(duplicate, context) is None
+
+    asyncio.run(main())
+    assert calls == [first]
+    duplicate.callback_query.answer.assert_awaited_once_with(DUPLICATE_TEXT)
@@ -0,0 +1,192 @@
+"""
+Ограничение частоты запросов пользователей к обработчикам, читающим Google Sheets.
+
+Каждый пользователь получает "ведро" токенов: один запрос - один токен,
+токены восполняются с постоянной скоростью. Повторный одинаковый запрос
+(то же сообщение или та же кнопка), пока первый выполняется или в течение
+короткого окна после него, не выполняется заново: пользователь получает
+короткий ответ DUPLICATE_TEXT, а состояние разговора не меняется.
+
+Кроме того, sheets_quota распределяет квоту Sheets API (запросов в минуту на
+сервисный аккаунт) между всеми потоками и всеми ботами процесса: запрос сверх
+квоты ждет в своем потоке, а не получает 429 от Google. Так же telegram_quota
+ограничивает скорость массовых отправок (рассылки, сводки) всех ботов процесса.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+from functools import wraps
+from typing import Dict, Set, Tuple
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+logger = logging.getLogger(__name__)
+
+BUCKET_CAPACITY = 5      # Сколько запросов подряд можно сделать
+REFILL_PER_SECOND = 0.5  # Один запрос раз в 2 секунды в среднем
+DEDUPE_WINDOW = 3.0      # Секунд, в течение которых одинаковый запрос не повторяется
+MAX_TRACKED_USERS = 10000
+SHEETS_REQUESTS_PER_MINUTE = int(os.getenv('SHEETS_REQUESTS_PER_MINUTE', 60))
+# Telegram допускает около 30 сообщений в секунду на бота; оставляем запас
+TELEGRAM_MESSAGES_PER_SECOND = float(os.getenv('TELEGRAM_MESSAGES_PER_SECOND', 20))
+
+COOLDOWN_TEXT = "⏳ Слишком много запросов. Пожалуйста, подождите {seconds} сек. и попробуйте снова."
+DUPLICATE_TEXT = "⏳ Этот запрос уже обрабатывается."
+
+
+class TokenBucketLimiter:
+    """Token bucket на пользователя."""
+
+    def __init__(self, capacity: float = BUCKET_CAPACITY, refill_per_second: float = REFILL_PER_SECOND):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        # user_id -> (токены, время последнего обновления, до какого момента уже предупреждали)
+        self._buckets: Dict[int, Tuple[float, float, float]] = {}
+
+    def consume(self, user_id: int) -> Tuple[bool, float]:
+        """Списывает токен. Возвращает (разрешено, через сколько секунд появится токен)."""
+        now = time.monotonic()
+        tokens, updated_at, warned_until = self._buckets.get(user_id, (self.capacity, now, 0.0))
+        tokens = min(self.capacity, tokens + (now - updated_at) * self.refill_per_second)
+        if tokens >= 1:
+            self._buckets[user_id] = (tokens - 1, now, warned_until)
+            self._prune(now)
+            return True, 0.0
+        self._buckets[user_id] = (tokens, now, warned_until)
+        return False, (1 - tokens) / self.refill_per_second
+
+    def should_warn(self, user_id: int, retry_after: float) -> bool:
+        """Предупреждаем о паузе один раз за период ожидания, а не на каждое нажатие."""
+        now = time.monotonic()
+        tokens, updated_at, warned_until = self._buckets[user_id]
+        if warned_until > now:
+            return False
+        self._buckets[user_id] = (tokens, updated_at, now + retry_after)
+        return True
+
+    def _prune(self, now: float) -> None:
+        if len(self._buckets) <= MAX_TRACKED_USERS:
+            return
+        # Полные ведра ничем не отличаются от отсутствующих
+        full_after = self.capacity / self.refill_per_second
+        for user_id, (_, updated_at, _) in list(self._buckets.items()):
+            if now - updated_at > full_after:
+                del self._buckets[user_id]
+
+
+limiter = TokenBucketLimiter()
+
+
+class RequestQuota:
+    """Общий token bucket для запросов к API из разных потоков и корутин."""
+
+    def __init__(self, per_minute: float = SHEETS_REQUESTS_PER_MINUTE, capacity: float | None = None,
+                 name: str = 'Sheets'):
+        self.name = name
+        self.capacity = capacity if capacity is not None else per_minute
+        self.refill_per_second = per_minute / 60
+        self._tokens = float(self.capacity)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+        self.waited = 0.0  # Сколько секунд запросы суммарно ждали квоту
+
+    def _reserve(self) -> float:
+        """Занимает место под запрос; возвращает, сколько секунд ждать до него."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.refill_per_second)
+            self._updated_at = now
+            self._tokens -= 1
+            # Долг распределяет ожидающих по очереди: каждый следующий ждет на один интервал дольше
+            delay = -self._tokens / self.refill_per_second if self._tokens < 0 else 0.0
+            self.waited += delay
+        return delay
+
+    def acquire(self) -> None:
+        """Ждет своей очереди в текущем потоке."""
+        delay = self._reserve()
+        if delay:
+            logger.info(f"{self.name} quota exhausted, waiting {delay:.1f}s")
+            time.sleep(delay)
+
+    async def wait(self) -> None:
+        """Ждет своей очереди, не блокируя цикл событий."""
+        delay = self._reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+
+sheets_quota = RequestQuota()
+telegram_quota = RequestQuota(
+    per_minute=TELEGRAM_MESSAGES_PER_SECOND * 60, capacity=TELEGRAM_MESSAGES_PER_SECOND, name='Telegram'
+)
+
+# Ключи (user_id, обработчик, текст запроса, ID бота) выполняющихся и недавно выполненных (-> истекает) запросов
+_in_flight: Set[Tuple] = set()
+_recent: Dict[Tuple, float] = {}
+
+
+def _request_key(update: Update, context: ContextTypes.DEFAULT_TYPE, handler_name: str) -> Tuple:
+    if update.callback_query:
+        payload = update.callback_query.data
+    elif update.effective_message:
+        payload = update.effective_message.text
+    else:
+        payload = None
+    # ID бота различает одинаковые запросы к разным ботам процесса (см. tenants.py)
+    return update.effective_user.id, handler_name, payload, context.bot.id
+
+
+def _forget_expired(now: float) -> None:
+    for key in [key for key, expires_at in _recent.items() if expires_at <= now]:
+        del _recent[key]
+
+
+async def _answer_duplicate(update: Update) -> None:
+    if update.callback_query:
+        await update.callback_query.answer(DUPLICATE_TEXT)
+    elif update.effective_message:
+        await update.effective_message.reply_text(DUPLICATE_TEXT)
+
+
+def rate_limited(func):
+    """
+    Decorator to throttle and dedupe Sheets-backed handlers per user.
+
+    A duplicate of a request that is running or finished within DEDUPE_WINDOW is
+    not executed: the user gets DUPLICATE_TEXT (a callback answer for buttons) and
+    the handler returns None, so a ConversationHandler keeps its current state.
+    A throttled request gets COOLDOWN_TEXT and also returns None.
+    """
+    @wraps(func)
+    async def wrapped(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
+        key = _request_key(update, context, func.__name__)
+        now = time.monotonic()
+        _forget_expired(now)
+
+        if key in _recent or key in _in_flight:
+            logger.info(f"Duplicate request from user {key[0]} in {func.__name__}")
+            await _answer_duplicate(update)
+            return None
+
+        allowed, retry_after = limiter.consume(key[0])
+        if not allowed:
+            if limiter.should_warn(key[0], retry_after) and update.effective_message:
+                await update.effective_message.reply_text(
+                    COOLDOWN_TEXT.format(seconds=max(1, round(retry_after)))
+                )
+            logger.info(f"Throttled user {key[0]} in {func.__name__}")
+            return None
+
+        _in_flight.add(key)
+        try:
+            result = await func(update, context, *args, **kwargs)
+        finally:
+            _in_flight.discard(key)
+        _recent[key] = time.monotonic() + DEDUPE_WINDOW
+        return result
+    return wrapped
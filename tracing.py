@@ -0,0 +1,220 @@
+"""
+Трассировка: от апдейта Telegram до запросов к Sheets API.
+
+На каждый апдейт открывается корневой span (обработчик, update_id, user_id),
+внутри него - дочерние span'ы для вызовов GoogleSheetsHandler, каждого
+HTTP-запроса к Sheets API (диапазон, байты, HTTP-статус) и каждого запроса
+к Telegram Bot API. В корневом span'е дополнительно подсчитываются запросы
+к Sheets и прочитанные байты, чтобы лишние чтения таблицы были видны сразу.
+
+Span'ы пишутся в TRACE_FILE построчно в JSON с полями OTLP (traceId, spanId,
+parentSpanId, startTimeUnixNano, ...) через ту же очередь с фоновым потоком,
+что и журнал: при заполненной очереди span'ы отбрасываются и считаются
+(trace_stats). Доля трассируемых апдейтов задается TRACE_SAMPLE_RATE;
+у остальных апдейтов span'ы не создаются вовсе.
+"""
+
+import os
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import contextvars
+import urllib.parse
+from functools import wraps
+from contextlib import contextmanager
+from logging.handlers import QueueListener, RotatingFileHandler
+from typing import Any, Dict, Optional
+
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
+from telegram.request import HTTPXRequest
+
+from log_setup import (
+    LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_QUEUE_SIZE, DroppingQueueHandler, tenant_var, wrap_callbacks
+)
+
+TRACE_FILE = os.getenv('TRACE_FILE', 'logs/traces.jsonl')
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 1.0))
+
+current_span = contextvars.ContextVar('current_span', default=None)
+
+trace_logger = logging.getLogger('trace')
+trace_logger.propagate = False
+_listener = None
+_queue_handler = None
+
+
+class Span:
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'root', 'name', 'start_ns', 'end_ns',
+                 'attributes', 'error')
+
+    def __init__(self, name: str, parent: Optional['Span'] = None, **attributes):
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.root = parent.root if parent else self
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes: Dict[str, Any] = attributes
+        self.error: Optional[str] = None
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def count(self, name: str, value: int = 1) -> None:
+        self.attributes[name] = self.attributes.get(name, 0) + value
+
+    def as_dict(self) -> Dict[str, Any]:
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'startTimeUnixNano': self.start_ns,
+            'endTimeUnixNano': self.end_ns,
+            'durationMs': round((self.end_ns - self.start_ns) / 1e6, 2),
+            'attributes': self.attributes,
+            'status': {'code': 'ERROR', 'message': self.error} if self.error else {'code': 'OK'},
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+
+@contextmanager
+def start_span(name: str, root: bool = False, **attributes):
+    """
+    Открывает span внутри текущего; корневой - только с root=True.
+
+    Вне трассируемого апдейта (или если апдейт не попал в выборку) отдает None.
+    """
+    parent = current_span.get()
+    if parent is None and not (root and random.random() < TRACE_SAMPLE_RATE and _listener is not None):
+        yield None
+        return
+    span = Span(name, parent, **attributes)
+    token = current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current_span.reset(token)
+        span.end_ns = time.time_ns()
+        trace_logger.info(json.dumps(span.as_dict(), ensure_ascii=False, default=str))
+
+
+def traced_methods(cls):
+    """Декоратор класса: span на каждый вызов публичного метода и методов чтения/записи."""
+    for name, method in list(vars(cls).items()):
+        if not callable(method) or name.startswith('__'):
+            continue
+        if name.startswith('_') and name not in ('_get_snapshot', '_get_archive', '_write_cells'):
+            continue
+
+        def wrap(method, span_name):
+            @wraps(method)
+            def wrapped(*args, **kwargs):
+                if current_span.get() is None:
+                    return method(*args, **kwargs)
+                with start_span(span_name):
+                    return method(*args, **kwargs)
+            return wrapped
+
+        setattr(cls, name, wrap(method, f"{cls.__name__}.{name}"))
+    return cls
+
+
+def _sheets_range(uri: str) -> str:
+    parsed = urllib.parse.urlparse(uri)
+    ranges = urllib.parse.parse_qs(parsed.query).get('ranges')
+    if ranges:
+        return ','.join(ranges)
+    if '/values/' in parsed.path:
+        return urllib.parse.unquote(parsed.path.split('/values/', 1)[1])
+    return ''
+
+
+class TracedHttpRequest(HttpRequest):
+    """HTTP-запрос к Google API со span'ом: метод, диапазон, байты, статус."""
+
+    def execute(self, http=None, num_retries=0):
+        with start_span(self.methodId or 'google.request', range=_sheets_range(self.uri),
+                        request_bytes=len(self.body or '')) as span:
+            if span is None:
+                return super().execute(http=http, num_retries=num_retries)
+            postproc = self.postproc
+
+            def traced_postproc(resp, content):
+                span.set(status=resp.status, response_bytes=len(content))
+                span.root.count('sheets.requests')
+                span.root.count('sheets.bytes', len(content))
+                return postproc(resp, content)
+
+            self.postproc = traced_postproc
+            try:
+                return super().execute(http=http, num_retries=num_retries)
+            except HttpError as e:
+                span.set(status=e.resp.status)
+                raise
+            finally:
+                self.postproc = postproc
+
+
+class TracedHTTPXRequest(HTTPXRequest):
+    """Запросы к Telegram Bot API со span'ом: метод, байты, статус."""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        with start_span(f"telegram.{url.rsplit('/', 1)[-1]}") as span:
+            status, payload = await super().do_request(url, method, *args, **kwargs)
+            if span is not None:
+                span.set(status=status, response_bytes=len(payload))
+                span.root.count('telegram.requests')
+            return status, payload
+
+
+def _trace_update(callback):
+    @wraps(callback)
+    async def wrapped(update, context, *args, **kwargs):
+        user = getattr(update, 'effective_user', None)
+        with start_span(f"update.{callback.__name__}", root=True,
+                        tenant=tenant_var.get(),
+                        update_id=getattr(update, 'update_id', None),
+                        user_id=user.id if user else None):
+            return await callback(update, context, *args, **kwargs)
+    return wrapped
+
+
+def setup_tracing() -> None:
+    """Включает запись span'ов в TRACE_FILE через очередь с фоновым писателем."""
+    global _listener, _queue_handler
+    if _listener is not None or not TRACE_FILE or TRACE_SAMPLE_RATE <= 0:
+        return
+    trace_dir = os.path.dirname(TRACE_FILE)
+    if trace_dir:
+        os.makedirs(trace_dir, exist_ok=True)
+    file_handler = RotatingFileHandler(
+        TRACE_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8'
+    )
+    file_handler.setFormatter(logging.Formatter('%(message)s'))
+    trace_queue = queue.Queue(LOG_QUEUE_SIZE)
+    _queue_handler = DroppingQueueHandler(trace_queue)
+    trace_logger.addHandler(_queue_handler)
+    trace_logger.setLevel(logging.INFO)
+    _listener = QueueListener(trace_queue, file_handler)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def trace_stats() -> dict:
+    """Счетчики трассировки для /metrics."""
+    return {'dropped_spans': _queue_handler.dropped if _queue_handler is not None else 0}
+
+
+def trace_handlers(application) -> None:
+    """Открывает корневой span на каждый обработанный апдейт."""
+    wrap_callbacks(application, _trace_update)
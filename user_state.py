@@ -0,0 +1,145 @@
+"""
+Ограничение памяти под данные пользователей и чатов (user_data, chat_data).
+
+Разговоры (ConversationHandler) хранят введенные шаги в user_data. Чтобы они
+не оставались там навсегда:
+
+- clear_on_end удаляет ключи разговора, когда любой его обработчик вернул END
+  (успех, отказ, ошибка или /cancel);
+- брошенный разговор завершается через CONVERSATION_TIMEOUT секунд, и
+  timeout_handler удаляет его ключи и сообщает об этом пользователю.
+
+Остальные данные (сессия модерации, последний поиск и т.п.) чистит
+UserDataJanitor: он помнит время последнего апдейта каждого пользователя и
+чата и раз в USER_DATA_SWEEP_INTERVAL удаляет данные тех, кто не писал
+USER_DATA_TTL секунд, а сверх USER_DATA_MAX_ENTRIES - давно не писавших первыми
+(LRU). Текущий объем отдается в /metrics (footprint).
+"""
+
+import os
+import time
+import logging
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Dict, Iterable
+
+from telegram import Update
+from telegram.ext import ContextTypes, ConversationHandler, TypeHandler
+
+from log_setup import walk_handlers
+from tenants import tenant_job
+
+logger = logging.getLogger(__name__)
+
+CONVERSATION_TIMEOUT = int(os.getenv('CONVERSATION_TIMEOUT', 30 * 60))
+USER_DATA_TTL = int(os.getenv('USER_DATA_TTL', 24 * 60 * 60))
+USER_DATA_MAX_ENTRIES = int(os.getenv('USER_DATA_MAX_ENTRIES', 5000))
+USER_DATA_SWEEP_INTERVAL = 10 * 60
+
+
+def clear_keys(user_data: dict, keys: Iterable[str]) -> None:
+    for key in keys:
+        user_data.pop(key, None)
+
+
+def clear_on_end(conversation: ConversationHandler, keys: Iterable[str]) -> None:
+    """Удаляет ключи user_data разговора, как только он завершается."""
+    keys = tuple(keys)
+
+    def wrapper(callback):
+        @wraps(callback)
+        async def wrapped(update, context, *args, **kwargs):
+            state = await callback(update, context, *args, **kwargs)
+            if state == ConversationHandler.END and context.user_data is not None:
+                clear_keys(context.user_data, keys)
+            return state
+        return wrapped
+
+    for handler in walk_handlers([conversation]):
+        handler.callback = wrapper(handler.callback)
+
+
+def timeout_handler(keys: Iterable[str], text: str) -> TypeHandler:
+    """Обработчик состояния ConversationHandler.TIMEOUT: чистит ключи разговора и предупреждает пользователя."""
+    keys = tuple(keys)
+
+    async def conversation_timeout(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if context.user_data is not None:
+            clear_keys(context.user_data, keys)
+        if update.effective_chat:
+            try:
+                await context.bot.send_message(chat_id=update.effective_chat.id, text=text)
+            except Exception as e:
+                logger.error(f"Failed to notify {update.effective_chat.id} about conversation timeout: {e}")
+
+    return TypeHandler(Update, conversation_timeout)
+
+
+class UserDataJanitor:
+    """Вытесняет user_data и chat_data пользователей и чатов, которые давно не писали боту."""
+
+    def __init__(self, application, ttl: float = USER_DATA_TTL, max_entries: int = USER_DATA_MAX_ENTRIES):
+        self.application = application
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # ID -> время последнего апдейта, от давних к недавним
+        self._users: 'OrderedDict[int, float]' = OrderedDict()
+        self._chats: 'OrderedDict[int, float]' = OrderedDict()
+        self.evicted = 0
+
+    async def touch(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Отмечает пользователя и чат апдейта; регистрируется в группе -1, до остальных обработчиков."""
+        now = time.monotonic()
+        for seen, entity in ((self._users, update.effective_user), (self._chats, update.effective_chat)):
+            if entity is not None:
+                seen.pop(entity.id, None)
+                seen[entity.id] = now
+
+    def schedule(self) -> None:
+        job_queue = self.application.job_queue
+        if job_queue is None:
+            logger.warning("JobQueue is not available, user_data is evicted only on restart")
+            return
+        job_queue.run_repeating(
+            tenant_job(self._sweep), interval=USER_DATA_SWEEP_INTERVAL, first=USER_DATA_SWEEP_INTERVAL,
+            name='user_data_sweep'
+        )
+
+    async def _sweep(self, context) -> None:
+        evicted = self.sweep()
+        if evicted:
+            logger.info(f"Evicted data of {evicted} idle users and chats, footprint: {self.footprint()}")
+
+    def sweep(self) -> int:
+        """Удаляет данные неактивных пользователей и чатов; возвращает, сколько записей удалено."""
+        now = time.monotonic()
+        evicted = 0
+        application = self.application
+        for seen, data, drop in (
+            (self._users, application.user_data, application.drop_user_data),
+            (self._chats, application.chat_data, application.drop_chat_data),
+        ):
+            # Данные, появившиеся без апдейта (например, из задач), считаем только что использованными
+            for key in list(data):
+                if key not in seen:
+                    seen[key] = now
+            while seen:
+                key, seen_at = next(iter(seen.items()))
+                if now - seen_at <= self.ttl and len(seen) <= self.max_entries:
+                    break
+                del seen[key]
+                if key in data:
+                    drop(key)
+                    evicted += 1
+        self.evicted += evicted
+        return evicted
+
+    def footprint(self) -> Dict[str, Any]:
+        user_data = self.application.user_data
+        return {
+            'user_data_entries': len(user_data),
+            'user_data_keys': sum(len(values) for values in user_data.values()),
+            'chat_data_entries': len(self.application.chat_data),
+            'tracked_users': len(self._users),
+            'evicted_entries': self.evicted,
+        }